@@ -0,0 +1,144 @@
+"""
+Token-budgeted prompt assembly.
+
+Prompts are built as named segments, each with an estimated token cost.
+Segments that can give way carry a priority and a list of progressively
+shorter variants; when the prompt is over budget the lowest-priority
+segments are shortened first and, if they are optional, dropped. Segments
+without a priority (the user's prompt, the phase, the drawing, the response
+format) are always sent as they are.
+
+Token counts are estimates (about four characters per text token and
+Gemini's fixed per-tile image cost), close enough to budget by without a
+count_tokens round trip per request.
+"""
+
+import math
+from io import BytesIO
+
+from PIL import Image
+
+# Estimated characters per text token
+CHARS_PER_TOKEN = 4
+# Gemini bills images with both sides up to 384px as one tile; larger ones are split into 768px tiles
+IMAGE_TILE_TOKENS = 258
+IMAGE_SMALL_SIDE = 384
+IMAGE_TILE_SIDE = 768
+
+class Segment:
+    """
+    One part of a prompt.
+
+    Args:
+        name (str): Label used in the token breakdown (segments may share one)
+        content: Prompt text, or an image part with 'mime_type' and 'data'
+        priority (int): Lower priorities give way first; None never gives way
+        variants (list): Callables returning shorter replacements for `content`, shortest last
+        optional (bool): Whether the segment may be dropped once its variants are used up
+    """
+
+    def __init__(self, name, content, priority=None, variants=(), optional=False):
+        self.name = name
+        self.content = content
+        self.priority = priority
+        self.variants = list(variants)
+        self.optional = optional
+        self.level = 0
+        self.dropped = False
+
+    @property
+    def tokens(self):
+        return 0 if self.dropped else estimate_tokens(self.content)
+
+    def shrink(self):
+        """
+        Replace the content with the next shorter variant, or drop an optional segment.
+
+        Returns:
+            bool: False if the segment can't get any smaller
+        """
+        if self.level < len(self.variants):
+            self.content = self.variants[self.level]()
+            self.level += 1
+            return True
+        if self.optional and not self.dropped:
+            self.dropped = True
+            return True
+        return False
+
+def image_tokens(width, height):
+    """Estimated tokens for an image of the given size"""
+    if width <= IMAGE_SMALL_SIDE and height <= IMAGE_SMALL_SIDE:
+        return IMAGE_TILE_TOKENS
+    return math.ceil(width / IMAGE_TILE_SIDE) * math.ceil(height / IMAGE_TILE_SIDE) * IMAGE_TILE_TOKENS
+
+def estimate_tokens(content):
+    """
+    Estimate the input tokens of a prompt segment.
+
+    Args:
+        content: Text, or an image part with 'mime_type' and 'data'
+
+    Returns:
+        int: Estimated token count
+    """
+    if content is None:
+        return 0
+    if isinstance(content, dict) and 'data' in content:
+        try:
+            # Only the header is read
+            width, height = Image.open(BytesIO(content['data'])).size
+        except (OSError, ValueError, TypeError):
+            return IMAGE_TILE_TOKENS
+        return image_tokens(width, height)
+    text = str(content)
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+def fit_segments(segments, budget):
+    """
+    Shrink and drop segments until the prompt fits a token budget.
+
+    The lowest-priority segment is shortened step by step, then dropped if
+    optional, before the next one is touched. Required segments are never
+    changed, so the result can still be over budget.
+
+    Args:
+        segments (list): Segment objects in prompt order (modified in place)
+        budget (int): Token budget (0 or less for no limit)
+
+    Returns:
+        tuple: (list of prompt parts, usage dict with total, budget, per-segment tokens and compacted segments)
+    """
+    if budget > 0:
+        total = sum(segment.tokens for segment in segments)
+        adjustable = sorted((segment for segment in segments if segment.priority is not None),
+                            key=lambda segment: segment.priority)
+        for segment in adjustable:
+            while total > budget:
+                before = segment.tokens
+                if not segment.shrink():
+                    break
+                total += segment.tokens - before
+            if total <= budget:
+                break
+
+    breakdown = {}
+    compacted = []
+    for segment in segments:
+        breakdown[segment.name] = breakdown.get(segment.name, 0) + segment.tokens
+        if (segment.level or segment.dropped) and segment.name not in compacted:
+            compacted.append(segment.name)
+    usage = {
+        'total': sum(breakdown.values()),
+        'budget': budget,
+        'segments': breakdown,
+        'compacted': compacted,
+    }
+    return [segment.content for segment in segments if not segment.dropped], usage
+
+def format_usage(usage):
+    """One-line summary of a prompt's token usage for the log"""
+    limit = f"/{usage['budget']}" if usage['budget'] > 0 else ""
+    segments = ", ".join(f"{name} {tokens}" for name, tokens in usage['segments'].items())
+    compacted = f" (compacted: {', '.join(usage['compacted'])})" if usage['compacted'] else ""
+    return f"~{usage['total']}{limit} tokens: {segments}{compacted}"
@@ -0,0 +1,336 @@
+"""
+Persistent cache of model responses.
+
+Gemini calls take seconds and cost money, yet demo prompts, retries and
+regression runs often send byte-identical requests. Responses are stored in
+a SQLite file keyed by a hash of the prompt segments (with image data hashed),
+the generation config and the model name, with a TTL and a size budget.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from utils.hashing import canonical_json, stable_digest
+from config.phases import GENERATION_CONFIG
+from config.settings import RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_BYTES
+
+def prompt_fingerprint(prompt_parts):
+    """
+    Describe prompt segments in a hashable, JSON-compatible form.
+
+    Text segments are kept as-is; inline images (dicts with 'mime_type' and
+    'data') are replaced by their MIME type and a digest of their bytes.
+
+    Args:
+        prompt_parts (list): Prompt segments from build_prompt
+
+    Returns:
+        list: JSON-compatible description of the prompt
+    """
+    if not isinstance(prompt_parts, (list, tuple)):
+        prompt_parts = [prompt_parts]
+
+    fingerprint = []
+    for part in prompt_parts:
+        if isinstance(part, dict) and 'data' in part:
+            data = part['data']
+            fingerprint.append({
+                'mime_type': part.get('mime_type'),
+                'digest': stable_digest(data if isinstance(data, (bytes, str)) else bytes(data)),
+            })
+        else:
+            fingerprint.append(part)
+    return fingerprint
+
+def request_key(prompt_parts, generation_config=GENERATION_CONFIG, model_name=''):
+    """
+    Identify a model request: identical requests get identical keys.
+
+    Args:
+        prompt_parts (list): Prompt segments sent to the model
+        generation_config (dict): Generation settings
+        model_name (str): Model identifier
+
+    Returns:
+        str: Hex digest of the request
+    """
+    return stable_digest(canonical_json({
+        'model': model_name,
+        'config': generation_config,
+        'prompt': prompt_fingerprint(prompt_parts),
+    }))
+
+class ResponseCache:
+    """
+    SQLite-backed cache of model response text.
+
+    Entries expire `ttl` seconds after they were stored. When the stored text
+    exceeds `max_bytes`, the least recently used entries are deleted.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path) and self.max_bytes > 0
+
+    def make_key(self, prompt_parts, generation_config=GENERATION_CONFIG, model_name=''):
+        """
+        Build the cache key for a model request.
+
+        Args:
+            prompt_parts (list): Prompt segments sent to the model
+            generation_config (dict): Generation settings
+            model_name (str): Model identifier
+
+        Returns:
+            str: Cache key
+        """
+        return request_key(prompt_parts, generation_config, model_name)
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): Cache key from make_key
+
+        Returns:
+            str: Cached response text, or None on a miss or expired entry
+        """
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] > self.ttl:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self.hits += 1
+                return row[0]
+            except sqlite3.Error as e:
+                print(f"Response cache read failed: {e}")
+                self.misses += 1
+                return None
+
+    def put(self, key, response):
+        """
+        Store a response, evicting expired and least recently used entries.
+
+        Args:
+            key (str): Cache key from make_key
+            response (str): Model response text
+        """
+        if not self.enabled or not response:
+            return
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, response, size, now, now),
+                )
+                conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                self.stores += 1
+                self._trim(conn)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Response cache write failed: {e}")
+
+    def clear(self):
+        """Delete every cached response"""
+        if not self.enabled:
+            return
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute("DELETE FROM responses")
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Response cache clear failed: {e}")
+
+    def stats(self):
+        """
+        Report cache counters for monitoring.
+
+        Returns:
+            dict: Hit/miss counters, hit rate and storage usage
+        """
+        entries, stored_bytes = 0, 0
+        with self._lock:
+            if self.enabled:
+                try:
+                    entries, stored_bytes = self._connect().execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    print(f"Response cache stats failed: {e}")
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'entries': entries,
+                'bytes': stored_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'path': self.path,
+            }
+
+    def _connect(self):
+        """Open the database on first use (call with the lock held)"""
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self._conn.commit()
+        return self._conn
+
+    def _trim(self, conn):
+        """Delete least recently used entries until the cache fits its budget"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+# Process-wide response cache shared by all routes
+response_cache = ResponseCache()
+
+def get_response_cache():
+    """
+    Get the process-wide response cache.
+
+    Returns:
+        ResponseCache: The shared response cache
+    """
+    return response_cache
+
+def cache_mode(headers):
+    """
+    Read the client's caching preference from request headers.
+
+    `Cache-Control: no-cache` skips the lookup but still stores the fresh
+    response; `no-store` bypasses the cache entirely.
+
+    Args:
+        headers: Request headers
+
+    Returns:
+        tuple: (use cached responses, store new responses)
+    """
+    directives = {d.strip().lower() for d in headers.get('Cache-Control', '').split(',')}
+    if 'no-store' in directives:
+        return False, False
+    if 'no-cache' in directives:
+        return False, True
+    return True, True
+
+def generate_cached(model, prompt_parts, generation_config=GENERATION_CONFIG, lookup=True, store=True):
+    """
+    Generate model output, reusing a cached response for an identical request.
+
+    Args:
+        model: Initialized GenerativeModel
+        prompt_parts (list): Prompt segments
+        generation_config (dict): Generation settings
+        lookup (bool): Whether a cached response may be returned
+        store (bool): Whether a fresh response is stored
+
+    Returns:
+        tuple: (response text, True if it came from the cache)
+    """
+    cache = get_response_cache()
+    key = cache.make_key(prompt_parts, generation_config, getattr(model, 'model_name', ''))
+
+    if lookup:
+        text = cache.get(key)
+        if text is not None:
+            return text, True
+
+    response = model.generate_content(prompt_parts, generation_config=generation_config)
+    text = response.text
+    if store:
+        cache.put(key, text)
+    return text, False
+
+def stream_cached(model, prompt_parts, generation_config=GENERATION_CONFIG, lookup=True, store=True):
+    """
+    Stream model output, replaying a cached response for an identical request.
+
+    The full response is stored once the stream completes.
+
+    Args:
+        model: Initialized GenerativeModel
+        prompt_parts (list): Prompt segments
+        generation_config (dict): Generation settings
+        lookup (bool): Whether a cached response may be returned
+        store (bool): Whether a fresh response is stored
+
+    Yields:
+        tuple: (text chunk, True if it came from the cache)
+    """
+    cache = get_response_cache()
+    key = cache.make_key(prompt_parts, generation_config, getattr(model, 'model_name', ''))
+
+    if lookup:
+        text = cache.get(key)
+        if text is not None:
+            yield text, True
+            return
+
+    chunks = []
+    for chunk in model.generate_content(prompt_parts, generation_config=generation_config, stream=True):
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. finish metadata) carry nothing to draw
+            continue
+        chunks.append(text)
+        yield text, False
+
+    if store:
+        cache.put(key, ''.join(chunks))
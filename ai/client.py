@@ -0,0 +1,307 @@
+"""
+Asynchronous model client with a concurrency limit, timeouts and request
+coalescing.
+
+All upstream calls run on one asyncio event loop in a background thread, so
+an in-flight Gemini call costs a coroutine rather than a blocked thread.
+Identical concurrent requests share a single upstream call, and a semaphore
+caps how many calls are outstanding at once. ModelClient also exposes the
+synchronous generate_content interface of GenerativeModel, so it can be used
+anywhere the model was; that interface blocks its caller until the answer
+arrives. Routes that must not hold a worker thread for the call queue it as
+a job instead (POST /jobs, or `Prefer: respond-async` on /get_commands).
+"""
+
+import asyncio
+import functools
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from ai.model import get_model
+from ai.cache import request_key
+from config.phases import GENERATION_CONFIG
+from config.settings import MODEL_MAX_CONCURRENCY, MODEL_REQUEST_TIMEOUT
+
+# Minimal stand-in for a generate_content response (or stream chunk)
+ModelResponse = namedtuple('ModelResponse', 'text')
+
+# Marks the end of a streamed response
+_STREAM_END = object()
+
+class ModelTimeoutError(TimeoutError):
+    """The model did not answer within the request timeout"""
+
+class ModelClient:
+    """
+    Concurrency-limited, coalescing wrapper around the Gemini model.
+
+    Args:
+        model_getter: Callable returning the GenerativeModel (or None)
+        max_concurrency (int): Maximum concurrent upstream calls
+        timeout (float): Default per-request timeout in seconds
+    """
+
+    def __init__(self, model_getter=get_model, max_concurrency=MODEL_MAX_CONCURRENCY,
+                 timeout=MODEL_REQUEST_TIMEOUT):
+        self._get_model = model_getter
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self._loop = None
+        self._semaphore = None
+        self._start_lock = threading.Lock()
+        # Counters are updated from the event loop and from caller threads
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.active = 0
+
+    @property
+    def available(self):
+        """True if the underlying model is initialized"""
+        return self._get_model() is not None
+
+    @property
+    def model_name(self):
+        return getattr(self._get_model(), 'model_name', '')
+
+    def generate_content(self, prompt_parts, generation_config=GENERATION_CONFIG, stream=False, timeout=None):
+        """
+        Blocking, GenerativeModel-compatible entry point.
+
+        Args:
+            prompt_parts (list): Prompt segments
+            generation_config (dict): Generation settings
+            stream (bool): Return an iterator of chunks instead of one response
+            timeout (float): Seconds to wait (default: the client timeout)
+
+        Returns:
+            ModelResponse, or an iterator of ModelResponse chunks when streaming
+
+        Raises:
+            ModelTimeoutError: If the model doesn't answer in time
+        """
+        if stream:
+            return self._stream(prompt_parts, generation_config, timeout)
+        return ModelResponse(self.submit(prompt_parts, generation_config, timeout).result())
+
+    def submit(self, prompt_parts, generation_config=GENERATION_CONFIG, timeout=None):
+        """
+        Start a request without waiting for it.
+
+        Args:
+            prompt_parts (list): Prompt segments
+            generation_config (dict): Generation settings
+            timeout (float): Seconds to wait (default: the client timeout)
+
+        Returns:
+            concurrent.futures.Future: Resolves to the response text
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(
+            self.generate_async(prompt_parts, generation_config, timeout), loop
+        )
+
+    async def generate_async(self, prompt_parts, generation_config=GENERATION_CONFIG, timeout=None):
+        """
+        Generate a response, sharing the upstream call with identical in-flight requests.
+
+        Must run on the client's event loop (use submit from other threads).
+
+        Returns:
+            str: Response text
+        """
+        key = request_key(prompt_parts, generation_config, self.model_name)
+        task = self._inflight.get(key)
+        with self._lock:
+            self.requests += 1
+            if task is not None:
+                self.coalesced += 1
+        if task is None:
+            task = asyncio.ensure_future(self._call(prompt_parts, generation_config))
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._forget, key))
+
+        try:
+            # Shielded so one caller timing out doesn't cancel the call for the others
+            return await asyncio.wait_for(asyncio.shield(task), timeout or self.timeout)
+        except ModelTimeoutError:
+            raise
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise ModelTimeoutError(f"Model did not respond within {timeout or self.timeout}s")
+
+    def stats(self):
+        """
+        Report client counters for monitoring.
+
+        Returns:
+            dict: Request, coalescing, timeout and concurrency counters
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'coalesced': self.coalesced,
+                'upstream_calls': self.upstream_calls,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+                'active': self.active,
+                'in_flight': len(self._inflight),
+                'max_concurrency': self.max_concurrency,
+                'timeout': self.timeout,
+            }
+
+    def _ensure_loop(self):
+        """Start the event loop thread on first use"""
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='model-client', daemon=True)
+                thread.start()
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._loop = loop
+            return self._loop
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def _model(self):
+        model = self._get_model()
+        if model is None:
+            raise RuntimeError('AI model not initialized')
+        return model
+
+    async def _call(self, prompt_parts, generation_config):
+        """Make one upstream call under the concurrency limit"""
+        model = self._model()
+        async with self._semaphore:
+            with self._lock:
+                self.active += 1
+                self.upstream_calls += 1
+            try:
+                if hasattr(model, 'generate_content_async'):
+                    pending = model.generate_content_async(prompt_parts, generation_config=generation_config)
+                else:
+                    pending = asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                        model.generate_content, prompt_parts, generation_config=generation_config
+                    ))
+                response = await asyncio.wait_for(pending, self.timeout)
+                return response.text
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self.timeouts += 1
+                raise ModelTimeoutError(f"Model did not respond within {self.timeout}s")
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+    async def _stream_into(self, prompt_parts, generation_config, chunks, cancelled):
+        """
+        Stream one upstream call under the concurrency limit, pushing chunks onto `chunks`.
+
+        The slot is held until the upstream stream has actually stopped, which
+        `cancelled` (set when the consumer goes away) makes happen at the next chunk.
+        """
+        async with self._semaphore:
+            with self._lock:
+                self.active += 1
+                self.upstream_calls += 1
+            try:
+                model = self._model()
+                if hasattr(model, 'generate_content_async'):
+                    response = await model.generate_content_async(
+                        prompt_parts, generation_config=generation_config, stream=True
+                    )
+                    iterator = response.__aiter__()
+                    try:
+                        async for chunk in iterator:
+                            chunks.put(chunk)
+                    finally:
+                        close = getattr(iterator, 'aclose', None)
+                        if close is not None:
+                            await close()
+                else:
+                    def pump():
+                        stream = model.generate_content(prompt_parts, generation_config=generation_config, stream=True)
+                        iterator = iter(stream)
+                        try:
+                            for chunk in iterator:
+                                if cancelled.is_set():
+                                    break
+                                chunks.put(chunk)
+                        finally:
+                            # Closing the iterator ends the upstream response
+                            for closable in (iterator, stream):
+                                close = getattr(closable, 'close', None)
+                                if callable(close):
+                                    close()
+                    work = asyncio.get_running_loop().run_in_executor(None, pump)
+                    try:
+                        await asyncio.shield(work)
+                    except asyncio.CancelledError:
+                        # The executor thread can't be interrupted; wait for it to see the flag
+                        cancelled.set()
+                        await work
+                        raise
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                chunks.put(e)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                chunks.put(_STREAM_END)
+
+    def _stream(self, prompt_parts, generation_config, timeout):
+        """Blocking iterator over streamed chunks (streams are not coalesced)"""
+        with self._lock:
+            self.requests += 1
+        loop = self._ensure_loop()
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+        future = asyncio.run_coroutine_threadsafe(
+            self._stream_into(prompt_parts, generation_config, chunks, cancelled), loop
+        )
+        deadline = time.monotonic() + (timeout or self.timeout)
+
+        try:
+            while True:
+                try:
+                    item = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise ModelTimeoutError(f"Model did not finish streaming within {timeout or self.timeout}s")
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stop the upstream call if the consumer went away early
+            if not future.done():
+                cancelled.set()
+                future.cancel()
+
+# Process-wide client shared by all routes
+model_client = ModelClient()
+
+def get_model_client():
+    """
+    Get the process-wide model client.
+
+    Returns:
+        ModelClient: The shared model client
+    """
+    return model_client
@@ -0,0 +1,172 @@
+"""
+Incrementally maintained canvas summary for continuation prompts.
+
+A PromptContext follows a command history as it grows: each ingested
+command is added to a spatial index (which tracks occlusion, the background
+and per-cell coverage), to its region's element list and to the color
+counts. Summarizing the canvas for a prompt then only looks at the most
+recent elements of each region and the last few commands, so its cost does
+not grow with the length of the painting. Undo truncates the context the
+same way instead of rebuilding it.
+"""
+
+from collections import Counter
+
+from config.settings import DEFAULT_CANVAS_WIDTH, DEFAULT_CANVAS_HEIGHT
+from drawing.spatial import SpatialIndex
+
+# Actions listed in the spatial context
+DESCRIBED_ACTIONS = ('draw_rect', 'draw_circle', 'draw_polyline')
+
+# Canvas regions used in position descriptions, as (name, box)
+REGIONS = [
+    (f"{vertical}-{horizontal}", (x0, y0, x1, y1))
+    for vertical, y0, y1 in (("top", 0, 133), ("middle", 133, 266), ("bottom", 266, DEFAULT_CANVAS_HEIGHT))
+    for horizontal, x0, x1 in (("left", 0, 167), ("middle", 167, 333), ("right", 333, DEFAULT_CANVAS_WIDTH))
+]
+
+# Commands summarized in the recent history line
+RECENT_COMMANDS = 10
+
+def get_position_description(x, y):
+    """Provide a human-readable position description"""
+    horizontal = "left" if x < 167 else "middle" if x < 333 else "right"
+    vertical = "top" if y < 133 else "middle" if y < 266 else "bottom"
+    return f"{vertical}-{horizontal}"
+
+class PromptContext:
+    """
+    Canvas summary state for one command history.
+
+    Callers must serialize access (sessions hold their lock).
+
+    Args:
+        size (tuple): Canvas (width, height)
+    """
+
+    def __init__(self, size=(DEFAULT_CANVAS_WIDTH, DEFAULT_CANVAS_HEIGHT)):
+        self.index = SpatialIndex(size)
+        self.commands = []
+        self.colors = Counter()
+        # Listed elements of each region, bottom to top
+        self._regions = {name: [] for name, _ in REGIONS}
+
+    @classmethod
+    def from_commands(cls, commands, size=(DEFAULT_CANVAS_WIDTH, DEFAULT_CANVAS_HEIGHT)):
+        """Build a context over a whole command history"""
+        context = cls(size)
+        context.ingest(commands)
+        return context
+
+    @property
+    def count(self):
+        """Number of history commands ingested"""
+        return len(self.commands)
+
+    def ingest(self, commands):
+        """
+        Add the next commands of the history.
+
+        Args:
+            commands (list): Commands in history order
+        """
+        for command in commands or []:
+            self.commands.append(command)
+            if not isinstance(command, dict):
+                self.index.add(command)
+                continue
+            if 'color' in command:
+                self.colors[str(command['color'])] += 1
+            element = self.index.add(command)
+            if element is not None and element.action in DESCRIBED_ACTIONS:
+                self._regions[get_position_description(*element.center)].append(element)
+
+    def truncate(self, count):
+        """
+        Forget every command from position `count` on (undo).
+
+        Args:
+            count (int): Number of history commands to keep
+        """
+        count = max(0, count)
+        for command in self.commands[count:]:
+            if isinstance(command, dict) and 'color' in command:
+                color = str(command['color'])
+                self.colors[color] -= 1
+                if not self.colors[color]:
+                    del self.colors[color]
+        del self.commands[count:]
+        self.index.truncate(count)
+        for elements in self._regions.values():
+            while elements and elements[-1].z >= count:
+                elements.pop()
+
+    def sync(self, commands, position):
+        """
+        Follow a history that was moved to `position` (undo, redo or seek).
+
+        Args:
+            commands (list): Full recorded history, including any redo tail
+            position (int): Number of commands the canvas reflects
+        """
+        if position < self.count:
+            self.truncate(position)
+        elif position > self.count:
+            self.ingest(commands[self.count:position])
+
+    def recent(self, limit=RECENT_COMMANDS):
+        """The last `limit` commands"""
+        return self.commands[-limit:]
+
+    def background_color(self):
+        """Color of the most recent background fill, or None"""
+        background = self.index.background()
+        return background.color if background else None
+
+    def visible_count(self):
+        """Number of listed elements not hidden behind a later opaque fill"""
+        return sum(self.index.shown[action] for action in DESCRIBED_ACTIONS)
+
+    def select(self, limit):
+        """
+        Pick up to `limit` visible elements spread over the canvas regions.
+
+        Regions take turns contributing their most recent remaining element.
+        Only the newest visible elements of each region are looked at.
+
+        Args:
+            limit (int): Maximum number of elements
+
+        Returns:
+            list: The chosen elements, bottom to top
+        """
+        queues = []
+        for name, _ in REGIONS:
+            queue = []
+            for element in reversed(self._regions[name]):
+                if len(queue) >= limit:
+                    break
+                if not element.background and element.hidden_by is None:
+                    queue.append(element)
+            if queue:
+                queues.append(queue)
+
+        chosen = []
+        while len(chosen) < limit and any(queues):
+            for queue in queues:
+                if queue and len(chosen) < limit:
+                    chosen.append(queue.pop(0))
+        return sorted(chosen, key=lambda element: element.z)
+
+    def coverage(self):
+        """
+        Share of each region drawn on.
+
+        Returns:
+            dict: Coverage fraction by region name
+        """
+        return {name: self.index.coverage(box) for name, box in REGIONS}
+
+    def palette(self, limit=3):
+        """The most used colors, most used first"""
+        return [color for color, _ in self.colors.most_common(limit)]
@@ -0,0 +1,215 @@
+"""
+Phase progression, prompt assembly and response handling shared by the
+command generation routes.
+"""
+
+import json
+
+from ai.prompts import get_initial_sketch_prompt, get_continuation_prompt, format_command_history
+from ai.budget import fit_segments, format_usage
+from ai.cache import generate_cached
+from drawing.schema import command_response_schema, validate_commands
+from utils.json_repair import parse_commands
+from config.phases import PHASES, GENERATION_CONFIG
+from utils.image import prepare_model_image
+from config.settings import (STRUCTURED_OUTPUT, MODEL_IMAGE_MAX_SIDE, MODEL_IMAGE_FORMAT, MODEL_IMAGE_QUALITY,
+                             PROMPT_TOKEN_BUDGET)
+
+def generation_config(structured=STRUCTURED_OUTPUT):
+    """
+    Get the generation settings for a command request.
+
+    Args:
+        structured (bool): Constrain the response to the command schema
+
+    Returns:
+        dict: Generation config for generate_content
+    """
+    if not structured:
+        return GENERATION_CONFIG
+    return {
+        **GENERATION_CONFIG,
+        "response_mime_type": "application/json",
+        "response_schema": command_response_schema(),
+    }
+
+def next_step(current_phase, current_part):
+    """
+    Work out which phase and part follow the current one.
+
+    Args:
+        current_phase (str): Current phase name
+        current_part (int): Current part index within the phase
+
+    Returns:
+        tuple: (next_phase, next_part, has_more)
+    """
+    phase_info = next((phase for phase in PHASES if phase["name"] == current_phase), PHASES[0])
+
+    next_part = current_part + 1
+    next_phase = current_phase
+
+    # If we've reached the end of parts for this phase, move to the next phase
+    if next_part >= len(phase_info["parts"]):
+        next_part = 0
+        phase_index = next((i for i, p in enumerate(PHASES) if p["name"] == current_phase), 0)
+        if phase_index < len(PHASES) - 1:
+            next_phase = PHASES[phase_index + 1]["name"]
+
+    has_more = not (next_phase == PHASES[-1]["name"] and next_part == len(PHASES[-1]["parts"]) - 1)
+    return next_phase, next_part, has_more
+
+def needs_image(current_phase, current_part):
+    """True if the prompt for this step includes the current drawing"""
+    return not (current_phase == 'sketch' and current_part == 0)
+
+def model_image(source, options=None):
+    """
+    Prepare the current drawing for the model using the configured size and format.
+
+    Args:
+        source: Canvas as a data URI, encoded bytes or PIL Image
+        options (dict): Per-request overrides for max_side, format and quality
+
+    Returns:
+        tuple: (image part for the prompt, dict describing the size and format sent)
+    """
+    options = options or {}
+    return prepare_model_image(
+        source,
+        max_side=int(options.get('max_side', MODEL_IMAGE_MAX_SIDE)),
+        format=options.get('format', MODEL_IMAGE_FORMAT),
+        quality=int(options.get('quality', MODEL_IMAGE_QUALITY)),
+    )
+
+def build_prompt(prompt, current_phase, current_part, command_history, image_part=None, structured=STRUCTURED_OUTPUT,
+                 context=None, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Build the prompt segments for a generation step, fitted to a token budget.
+
+    The estimated per-segment token breakdown is logged.
+
+    Args:
+        prompt (str): User's original prompt
+        current_phase (str): Current phase name
+        current_part (int): Current part index within the phase
+        command_history (list): Commands drawn so far
+        image_part (dict): Current drawing from prepare_model_image (required when needs_image is true)
+        structured (bool): Leave out format instructions covered by the response schema
+        context (PromptContext): Maintained summary of the history (e.g. a session's),
+                                 used instead of command_history
+        budget (int): Estimated input token budget (0 for no limit)
+
+    Returns:
+        tuple: (list of prompt segments for the model, token usage dict from fit_segments)
+    """
+    history_text = format_command_history(context.recent() if context is not None else command_history)
+
+    if not needs_image(current_phase, current_part):
+        segments = get_initial_sketch_prompt(prompt, history_text, structured)
+    else:
+        segments = get_continuation_prompt(
+            prompt,
+            current_phase,
+            current_part,
+            image_part,
+            history_text,
+            command_history,
+            structured,
+            context
+        )
+
+    prompt_parts, usage = fit_segments(segments, budget)
+    print(f"Prompt for phase {current_phase}, part {current_part}: {format_usage(usage)}")
+    return prompt_parts, usage
+
+def parse_model_output(text, structured=STRUCTURED_OUTPUT):
+    """
+    Turn a model response into validated drawing commands.
+
+    Schema-constrained responses are decoded directly; anything that doesn't
+    comply goes through the tolerant parser. Every command is then checked
+    against the command schema.
+
+    Args:
+        text (str): Raw model response
+        structured (bool): Whether the response was requested as schema JSON
+
+    Returns:
+        dict: commands, thinking, repairs, rejected and whether the fallback parser ran
+    """
+    commands = None
+    if structured:
+        try:
+            data = json.loads(text)
+            if isinstance(data, dict) and isinstance(data.get('commands'), list):
+                commands = data['commands']
+                thinking = data.get('analysis') or ''
+                repairs = {}
+        except (json.JSONDecodeError, RecursionError):
+            pass
+
+    fallback = commands is None
+    if fallback:
+        if structured:
+            print("Model response did not match the schema, using the tolerant parser")
+        commands, thinking, repairs = parse_commands(text)
+
+    commands, rejected = validate_commands(commands)
+    return {
+        'commands': commands,
+        'thinking': thinking,
+        'repairs': repairs,
+        'rejected': rejected,
+        'fallback': fallback and structured,
+    }
+
+def generation_step(context):
+    """Phase progression fields returned alongside generated commands"""
+    return {key: context[key] for key in ('current_phase', 'current_part', 'next_phase', 'next_part', 'has_more')}
+
+def generate_commands(model, context, lookup=True, store=True):
+    """
+    Run one generation step: call the model and decode its commands.
+
+    Args:
+        model: Model client (or GenerativeModel)
+        context (dict): Prepared request from prepare_generation
+        lookup (bool): Whether a cached response may be used
+        store (bool): Whether a fresh response is cached
+
+    Returns:
+        dict: Response payload with commands, phase progression and parse details
+    """
+    current_phase = context['current_phase']
+    current_part = context['current_part']
+
+    # Generate content from AI
+    print(f"Sending prompt to AI (Phase: {current_phase}, Part: {current_part})")
+    response_text, cached = generate_cached(
+        model, context['prompt_text'], generation_config(), lookup=lookup, store=store
+    )
+    print(f"Raw Gemini Response (Phase: {current_phase}, Part: {current_part}{', cached' if cached else ''}):")
+    print(response_text[:200] + "...") # Only print beginning to avoid console clutter
+
+    # Decode and validate the commands, falling back to the tolerant parser
+    parsed = parse_model_output(response_text)
+    commands = parsed['commands']
+    if parsed['repairs']:
+        print(f"Repaired model JSON: {parsed['repairs']}")
+    if parsed['rejected']:
+        print(f"Rejected {len(parsed['rejected'])} invalid commands: {parsed['rejected']}")
+
+    print(f"Returning {len(commands)} drawing commands for phase {current_phase}, part {current_part}")
+
+    return {
+        'commands': commands,
+        **generation_step(context),
+        'thinking': parsed['thinking'],  # Include the thinking for UI display
+        'cached': cached,
+        'repairs': parsed['repairs'],
+        'rejected': parsed['rejected'],
+        'fallback': parsed['fallback'],
+        'model_image': context.get('model_image'),
+        'prompt_tokens': context.get('prompt_tokens'),
+    }
@@ -0,0 +1,293 @@
+"""
+Background job queue for command generation.
+
+A generation step can take longer than a proxy or gunicorn worker is willing
+to wait. Jobs put the work on a bounded queue serviced by a small pool of
+worker threads; the HTTP request returns a job id straight away and clients
+long-poll for the result. A full queue is reported to the caller instead of
+letting requests pile up behind the model.
+"""
+
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+from config.settings import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RESULT_TTL
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Number of recent jobs the wait/run time metrics are computed over
+TIMING_WINDOW = 200
+
+class JobQueueFullError(Exception):
+    """The job queue is at capacity"""
+
+class Job:
+    """
+    One queued unit of work and its outcome.
+
+    Args:
+        func: Callable run by a worker; its return value becomes the result
+        args: Positional arguments for func
+        kwargs: Keyword arguments for func
+    """
+
+    def __init__(self, func, args=(), kwargs=None):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    @property
+    def wait_time(self):
+        """Seconds spent queued (so far, if still queued)"""
+        end = self.started_at or self.finished_at or time.time()
+        return end - self.created_at
+
+    @property
+    def run_time(self):
+        """Seconds spent running, or None if it never started"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def describe(self):
+        """
+        Summarize the job for API responses.
+
+        Returns:
+            dict: Status, timings and the result or error once finished
+        """
+        info = {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'wait_time': round(self.wait_time, 3),
+        }
+        if self.run_time is not None:
+            info['run_time'] = round(self.run_time, 3)
+        if self.status == DONE:
+            info['result'] = self.result
+        elif self.status == FAILED:
+            info['error'] = self.error
+        return info
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class JobQueue:
+    """
+    Bounded queue of jobs serviced by a pool of worker threads.
+
+    Finished jobs are kept for `result_ttl` seconds so clients can collect
+    their results, then dropped.
+
+    Args:
+        workers (int): Number of worker threads
+        max_size (int): Maximum number of queued (not yet running) jobs
+        result_ttl (float): Seconds to keep finished jobs
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_size=JOB_QUEUE_SIZE, result_ttl=JOB_RESULT_TTL):
+        self.workers = max(1, workers)
+        self.max_size = max(1, max_size)
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(self.max_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._wait_times = deque(maxlen=TIMING_WINDOW)
+        self._run_times = deque(maxlen=TIMING_WINDOW)
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.running = 0
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue a call to func(*args, **kwargs).
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            JobQueueFullError: If the queue is at capacity
+        """
+        self._ensure_workers()
+        self._purge()
+        job = Job(func, args, kwargs)
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self.rejected += 1
+                raise JobQueueFullError(f"Job queue is full ({self.max_size} jobs waiting)")
+            self._jobs[job.id] = job
+            self.submitted += 1
+        return job
+
+    def get(self, job_id):
+        """
+        Look up a job.
+
+        Returns:
+            Job: The job, or None if unknown or expired
+        """
+        self._purge()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """
+        Wait up to `timeout` seconds for a job to finish.
+
+        Returns:
+            Job: The job (possibly still queued or running), or None if unknown
+        """
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.done.wait(timeout)
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a job.
+
+        A queued job never runs. A running job can't be interrupted, so it
+        finishes in the background and its result is discarded.
+
+        Returns:
+            Job: The job, or None if unknown
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            if job.finished:
+                return job
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            self.cancelled += 1
+        job.done.set()
+        return job
+
+    def stats(self):
+        """
+        Report queue counters and timings for monitoring.
+
+        Returns:
+            dict: Queue depth, job counts and wait/run time averages over recent jobs
+        """
+        with self._lock:
+            wait_times = list(self._wait_times)
+            run_times = list(self._run_times)
+            queued = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            return {
+                'workers': self.workers,
+                'max_size': self.max_size,
+                'queue_depth': queued,
+                'running': self.running,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'retained': len(self._jobs),
+                'wait_time_avg': sum(wait_times) / len(wait_times) if wait_times else 0.0,
+                'wait_time_p95': _percentile(wait_times, 0.95),
+                'run_time_avg': sum(run_times) / len(run_times) if run_times else 0.0,
+                'run_time_p95': _percentile(run_times, 0.95),
+            }
+
+    def retry_after(self):
+        """Rough number of seconds until the queue has room, for Retry-After headers"""
+        with self._lock:
+            run_times = list(self._run_times)
+        average = sum(run_times) / len(run_times) if run_times else 1.0
+        return max(1, round(average * self._queue.qsize() / self.workers))
+
+    def _ensure_workers(self):
+        """Start the worker threads on first use"""
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.status != QUEUED:
+                    # Cancelled while waiting
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._wait_times.append(job.wait_time)
+                self.running += 1
+
+            try:
+                result, error = job.func(*job.args, **job.kwargs), None
+            except Exception as e:
+                print(f"Job {job.id} failed: {e}")
+                result, error = None, str(e)
+
+            with self._lock:
+                self.running -= 1
+                self._run_times.append(time.time() - job.started_at)
+                if job.status == RUNNING:
+                    job.finished_at = time.time()
+                    if error is None:
+                        job.status, job.result = DONE, result
+                        self.completed += 1
+                    else:
+                        job.status, job.error = FAILED, error
+                        self.failed += 1
+            job.done.set()
+
+    def _purge(self):
+        """Drop finished jobs older than the result TTL"""
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+# Process-wide job queue shared by all routes
+job_queue = JobQueue()
+
+def get_job_queue():
+    """
+    Get the process-wide job queue.
+
+    Returns:
+        JobQueue: The shared job queue
+    """
+    return job_queue
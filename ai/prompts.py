@@ -3,37 +3,94 @@ Improved prompt construction with better spatial awareness for painting phases.
 """
 
 from config.phases import PHASES
+from ai.budget import Segment
+from ai.context import PromptContext, REGIONS, RECENT_COMMANDS, get_position_description
+
+# Segment priorities for the token budget (see ai/budget.py): instructions the
+# phase already implies give way first, then the history, then the spatial context
+PRIORITY_PHASE_IMPLIED = 0
+PRIORITY_HISTORY = 1
+PRIORITY_SPATIAL = 2
+
+# Command formats listed in free-form continuation prompts
+COMMAND_FORMATS = [
+    ('draw_polyline', "{'action':'draw_polyline','points':[[x,y],...],'color':'#HEX','width':N}"),
+    ('draw_rect', "{'action':'draw_rect','x0':N,'y0':N,'x1':N,'y1':N,'color':'#HEX','fill':bool}"),
+    ('draw_circle', "{'action':'draw_circle','x':N,'y':N,'radius':N,'color':'#HEX','fill':bool}"),
+    ('fill_area', "{'action':'fill_area','x':N,'y':N,'color':'#HEX'}"),
+    ('modify_color', "{'action':'modify_color','target_color':'#HEX','new_color':'#HEX','area_x':N,'area_y':N}"),
+]
+
+# Actions each line-drawing phase works with; other command formats are implied away by the phase
+LINE_ACTIONS = ('draw_polyline', 'draw_rect', 'draw_circle')
+PHASE_ACTIONS = {
+    'sketch': LINE_ACTIONS,
+    'refine_lines': LINE_ACTIONS,
+}
+
+def get_initial_sketch_prompt(prompt, history_text="", structured=False):
+    """
+    Creates initial sketch prompt with optimized token usage.
+
+    With structured output the response schema defines the command format,
+    so the format instructions are left out.
+
+    Returns:
+        list: Segment objects for fit_segments
+    """
+    if structured:
+        return [
+            Segment('intro', "Digital painting assistant. Create a simple sketch based on the prompt."),
+            
+            Segment('prompt', f"Prompt: {prompt}"),
+            
+            Segment('phase', "PHASE: SKETCH - Initial line drawing"),
+            Segment('phase', "FOCUS: Create a simple line sketch of the main elements"),
+            
+            Segment('canvas', "CANVAS: 500×400px. (0,0)=top-left, (500,400)=bottom-right"),
+            Segment('canvas', "USE ENTIRE CANVAS! Distribute elements across all regions (TL/TR/BL/BR)"),
+            
+            Segment('rules', "- SKETCH PHASE: only draw_polyline, draw_rect and draw_circle outlines, thin black lines (width:1, fill:false)"),
+            Segment('rules', "- Try to plan the entire 500×400px composition"),
+            Segment('rules', "- Include all major elements from the prompt"),
+            Segment('rules', "- Simple cartoon-like style, not realistic"),
+            
+            Segment('format', "Put a brief plan in analysis, then the commands.")
+        ]
 
-def get_initial_sketch_prompt(prompt, history_text=""):
-    """Creates initial sketch prompt with optimized token usage"""
     return [
-        "Digital painting assistant. Create a simple sketch based on the prompt.",
+        Segment('intro', "Digital painting assistant. Create a simple sketch based on the prompt."),
         
-        f"Prompt: {prompt}",
+        Segment('prompt', f"Prompt: {prompt}"),
         
-        "PHASE: SKETCH - Initial line drawing",
-        "FOCUS: Create a simple line sketch of the main elements",
+        Segment('phase', "PHASE: SKETCH - Initial line drawing"),
+        Segment('phase', "FOCUS: Create a simple line sketch of the main elements"),
         
-        "CANVAS: 500×400px. (0,0)=top-left, (500,400)=bottom-right",
-        "USE ENTIRE CANVAS! Distribute elements across all regions (TL/TR/BL/BR)",
+        Segment('canvas', "CANVAS: 500×400px. (0,0)=top-left, (500,400)=bottom-right"),
+        Segment('canvas', "USE ENTIRE CANVAS! Distribute elements across all regions (TL/TR/BL/BR)"),
         
-        "JSON Commands:",
-        "{'action':'draw_polyline','points':[[x,y],...],'color':'#000000','width':1}",
-        "{'action':'draw_rect','x0':N,'y0':N,'x1':N,'y1':N,'color':'#000000','width':1,'fill':false}",
-        "{'action':'draw_circle','x':N,'y':N,'radius':N,'color':'#000000','width':1,'fill':false}",
+        Segment('format', "JSON Commands:"),
+        Segment('format', "{'action':'draw_polyline','points':[[x,y],...],'color':'#000000','width':1}"),
+        Segment('format', "{'action':'draw_rect','x0':N,'y0':N,'x1':N,'y1':N,'color':'#000000','width':1,'fill':false}"),
+        Segment('format', "{'action':'draw_circle','x':N,'y':N,'radius':N,'color':'#000000','width':1,'fill':false}"),
         
-        "- SKETCH PHASE: Please use thin black lines only (width:1)",
-        "- Please no FILL or COLOR in this phase - only outlines!",
-        "- Try to plan the entire 500×400px composition",
-        "- Include all major elements from the prompt",
-        "- Simple cartoon-like style, not realistic",
+        Segment('rules', "- SKETCH PHASE: Please use thin black lines only (width:1)"),
+        # Already implied by the line above and the fill:false formats
+        Segment('rules', "- Please no FILL or COLOR in this phase - only outlines!", PRIORITY_PHASE_IMPLIED, optional=True),
+        Segment('rules', "- Try to plan the entire 500×400px composition"),
+        Segment('rules', "- Include all major elements from the prompt"),
+        Segment('rules', "- Simple cartoon-like style, not realistic"),
         
-        "Respond with <think></think> tags, then JSON array of commands wrapped in ```json``` blocks."
+        Segment('format', "Respond with <think></think> tags, then JSON array of commands wrapped in ```json``` blocks.")
     ]
 
-def get_continuation_prompt(prompt, current_phase, current_part, image, history_text="", command_history=None):
+def get_continuation_prompt(prompt, current_phase, current_part, image, history_text="", command_history=None,
+                            structured=False, context=None):
     """
     Get prompt for continuing painting phases with enhanced spatial context preservation.
+
+    The spatial context and history summary can be shortened, and command
+    formats the phase doesn't use dropped, to fit a token budget.
     
     Args:
         prompt (str): User's original prompt
@@ -42,15 +99,26 @@ def get_continuation_prompt(prompt, current_phase, current_part, image, history_
         image: The current image (will be included in prompt)
         history_text (str): Previous command history summary
         command_history (list): Actual command history objects
+        structured (bool): Whether the response schema defines the command format
+        context (PromptContext): Maintained summary of the history, used instead of command_history
         
     Returns:
-        list: List of prompt segments for the AI
+        list: Segment objects for fit_segments
     """
     phase_info = next((phase for phase in PHASES if phase["name"] == current_phase), PHASES[0])
     
-    # Create compressed spatial and command summaries
-    spatial_context = create_spatial_context(command_history)
-    cmd_summary = format_command_history(command_history)
+    # Create compressed spatial and command summaries from one context, which the shorter variants reuse
+    if context is None and command_history:
+        context = PromptContext.from_commands(command_history)
+    recent = context.recent() if context is not None else []
+    spatial = Segment('spatial', create_spatial_context(None, context), PRIORITY_SPATIAL, variants=[
+        lambda: create_spatial_context(None, context, limit=MAX_CONTEXT_ELEMENTS // 2),
+        lambda: create_spatial_context(None, context, merge=True),
+        lambda: create_spatial_context(None, context, limit=0),
+    ])
+    history = Segment('history', format_command_history(recent), PRIORITY_HISTORY, variants=[
+        lambda: format_command_history(recent[-(RECENT_COMMANDS // 2):]),
+    ], optional=True)
     
     # Phase-specific instructions without repeating main prompt content
     phase_instructions = {
@@ -68,144 +136,214 @@ def get_continuation_prompt(prompt, current_phase, current_part, image, history_
     else:
         part_focus = "Continue working on the current phase"
     
+    if structured:
+        return [
+            Segment('intro', "Digital painting assistant."),
+            
+            Segment('phase', f"PHASE: {phase_info['display_name']} - {instruction}"),
+            Segment('phase', f"FOCUS: {part_focus}"),
+            
+            Segment('image', "Current drawing:"),
+            Segment('image', image),
+            
+            Segment('canvas', "CANVAS: 500×400px | STATUS:"),
+            spatial,
+            history,
+            
+            Segment('rules', "⚠️ CRITICAL:"),
+            Segment('rules', "- Work across ENTIRE 500×400px canvas"),
+            Segment('rules', "- Make 5-8 specific changes to progress the drawing"),
+            Segment('rules', "- Keep style simple and cartoonish"),
+            
+            Segment('format', "Put a brief plan in analysis, then the commands.")
+        ]
+
+    phase_actions = PHASE_ACTIONS.get(current_phase)
+    formats = [
+        Segment('format', template, PRIORITY_PHASE_IMPLIED, optional=True)
+        if phase_actions is not None and action not in phase_actions else Segment('format', template)
+        for action, template in COMMAND_FORMATS
+    ]
+
     return [
-        "Digital painting assistant.",
+        Segment('intro', "Digital painting assistant."),
         
-        f"PHASE: {phase_info['display_name']} - {instruction}",
-        f"FOCUS: {part_focus}",
+        Segment('phase', f"PHASE: {phase_info['display_name']} - {instruction}"),
+        Segment('phase', f"FOCUS: {part_focus}"),
         
-        "Current drawing:",
-        image,
+        Segment('image', "Current drawing:"),
+        Segment('image', image),
         
-        "CANVAS: 500×400px | STATUS:",
-        spatial_context,
-        cmd_summary,
+        Segment('canvas', "CANVAS: 500×400px | STATUS:"),
+        spatial,
+        history,
         
-        "AVAILABLE COMMANDS:",
-        "{'action':'draw_polyline','points':[[x,y],...],'color':'#HEX','width':N}",
-        "{'action':'draw_rect','x0':N,'y0':N,'x1':N,'y1':N,'color':'#HEX','fill':bool}",
-        "{'action':'draw_circle','x':N,'y':N,'radius':N,'color':'#HEX','fill':bool}",
-        "{'action':'fill_area','x':N,'y':N,'color':'#HEX'}",
-        "{'action':'modify_color','target_color':'#HEX','new_color':'#HEX','area_x':N,'area_y':N}",
+        Segment('format', "AVAILABLE COMMANDS:"),
+        *formats,
         
-        "⚠️ CRITICAL:",
-        "- Work across ENTIRE 500×400px canvas",
-        "- Make 5-8 specific changes to progress the drawing",
-        "- Keep style simple and cartoonish",
-        "- Respond in this format: ```json [commands] ```",
+        Segment('rules', "⚠️ CRITICAL:"),
+        Segment('rules', "- Work across ENTIRE 500×400px canvas"),
+        Segment('rules', "- Make 5-8 specific changes to progress the drawing"),
+        Segment('rules', "- Keep style simple and cartoonish"),
+        Segment('format', "- Respond in this format: ```json [commands] ```"),
 
-        "Respond with <think></think> tags, then only a valid JSON array of commands inside ```json and ``` tags."
+        Segment('format', "Respond with <think></think> tags, then only a valid JSON array of commands inside ```json and ``` tags.")
     ]
 
-def create_spatial_context(command_history):
+# Most elements listed in the spatial context
+MAX_CONTEXT_ELEMENTS = 15
+# Regions with less of their area drawn on than this are listed as mostly empty
+SPARSE_REGION_COVERAGE = 0.25
+
+def create_spatial_context(command_history, context=None, limit=MAX_CONTEXT_ELEMENTS, merge=False):
     """
     Create a detailed spatial context summary from command history.
-    
+
+    Elements are looked up in a spatial index: anything hidden behind a later
+    opaque fill is skipped, and when there are too many to list the most
+    recent ones are picked from every region in turn so the whole canvas is
+    represented. Regions with little on them are listed so the model can
+    fill them.
+
     Args:
         command_history (list): List of previous drawing commands
-        
+        context (PromptContext): Maintained summary of the history, used instead of command_history
+        limit (int): Most elements to list
+        merge (bool): List the elements as per-region counts of same-colored shapes instead
+
     Returns:
         str: Detailed summary of what elements exist where on the canvas
     """
-    if not command_history or len(command_history) == 0:
+    if context is None:
+        if not command_history:
+            return "Canvas: empty"
+        context = PromptContext.from_commands(command_history)
+    if not context.count:
         return "Canvas: empty"
-    
-    # Track specific elements by type and location
-    elements = []
-    bg_color = None
-    
-    for i, cmd in enumerate(command_history):
-        action = cmd.get('action', '')
-        
-        # Extract background color (usually the first filled rectangle covering the entire canvas)
-        if action == 'draw_rect' and i < 5:  # Check early commands
-            x0 = cmd.get('x0', 0)
-            y0 = cmd.get('y0', 0)
-            x1 = cmd.get('x1', 0)
-            y1 = cmd.get('y1', 0)
-            fill = cmd.get('fill', False)
-            
-            # If this covers most of the canvas, it's likely the background
-            if x0 <= 10 and y0 <= 10 and x1 >= 490 and y1 >= 390 and fill:
-                bg_color = cmd.get('color', 'unknown')
-                elements.append(f"Background: {bg_color} rectangle covering the entire canvas")
-                continue
-        
-        if action == 'draw_rect':
-            x0 = cmd.get('x0', 0)
-            y0 = cmd.get('y0', 0)
-            x1 = cmd.get('x1', 0)
-            y1 = cmd.get('y1', 0)
-            color = cmd.get('color', 'unknown')
-            fill = cmd.get('fill', False)
-            
-            width = abs(x1 - x0)
-            height = abs(y1 - y0)
-            center_x = (x0 + x1) / 2
-            center_y = (y0 + y1) / 2
-            
-            position = get_position_description(center_x, center_y)
-            size_desc = get_size_description(width, height)
-            
-            elements.append(f"{size_desc} {color} rectangle in the {position} ({x0},{y0} to {x1},{y1}), {'filled' if fill else 'outlined'}")
-            
-        elif action == 'draw_circle':
-            x = cmd.get('x', 0)
-            y = cmd.get('y', 0)
-            radius = cmd.get('radius', 0)
-            color = cmd.get('color', 'unknown')
-            fill = cmd.get('fill', False)
-            
-            position = get_position_description(x, y)
-            size_desc = get_size_description(radius * 2, radius * 2)
-            
-            elements.append(f"{size_desc} {color} circle at {position} (center: {x},{y}, radius: {radius}), {'filled' if fill else 'outlined'}")
-            
-        elif action == 'draw_polyline':
-            points = cmd.get('points', [])
-            color = cmd.get('color', 'unknown')
-            width = cmd.get('width', 1)
-            
-            if len(points) < 2:
-                continue
-                
-            # Calculate center of polyline
-            x_coords = [p[0] for p in points]
-            y_coords = [p[1] for p in points]
-            center_x = sum(x_coords) / len(x_coords)
-            center_y = sum(y_coords) / len(y_coords)
-            
-            position = get_position_description(center_x, center_y)
-            
-            # Estimate size of polyline
-            min_x, max_x = min(x_coords), max(x_coords)
-            min_y, max_y = min(y_coords), max(y_coords)
-            width_line = max_x - min_x
-            height_line = max_y - min_y
-            size_desc = get_size_description(width_line, height_line)
-            
-            elements.append(f"{size_desc} {color} line in the {position} (from {points[0]} to {points[-1]})")
-    
-    # Create a summary with a max of 15 elements to avoid overloading
-    if len(elements) > 15:
-        main_elements = elements[:15]
-        summary = "Canvas content overview (showing 15 of {} elements):\n".format(len(elements))
-        summary += "\n".join(f"- {element}" for element in main_elements)
+
+    bg_color = context.background_color()
+    chosen = context.select(limit)
+    if merge:
+        elements = merge_elements(chosen)
     else:
-        summary = "Canvas content overview ({} elements):\n".format(len(elements))
-        summary += "\n".join(f"- {element}" for element in elements)
-    
+        elements = [describe_element(element.command) for element in chosen]
+    shown, total = len(chosen), context.visible_count()
+    if bg_color:
+        elements.insert(0, f"Background: {bg_color} rectangle covering the entire canvas")
+        shown += 1
+        total += 1
+
+    if total > shown:
+        summary = "Canvas content overview (showing {} of {} elements):\n".format(shown, total)
+    else:
+        summary = "Canvas content overview ({} elements):\n".format(total)
+    summary += "\n".join(f"- {element}" for element in elements)
+
+    sparse = [name for name, coverage in context.coverage().items() if coverage < SPARSE_REGION_COVERAGE]
+    if sparse:
+        summary += f"\nMostly empty: {', '.join(sparse)}"
+
+    palette = context.palette()
+    if palette:
+        summary += f"\nMain colors: {', '.join(palette)}"
+
     # Add a note about background if detected
     if bg_color:
         summary += f"\n\nBackground color: {bg_color}"
-    
+
     return summary
 
-def get_position_description(x, y):
-    """Provide a human-readable position description"""
-    horizontal = "left" if x < 167 else "middle" if x < 333 else "right"
-    vertical = "top" if y < 133 else "middle" if y < 266 else "bottom"
-    return f"{vertical}-{horizontal}"
+# Shape names used when merging elements
+SHAPE_NAMES = {'draw_rect': 'rectangle', 'draw_circle': 'circle', 'draw_polyline': 'line'}
+
+def merge_elements(elements):
+    """
+    Summarize elements region by region, merging shapes of the same kind and color.
+
+    Args:
+        elements (list): Spatial index elements
+
+    Returns:
+        list: One description per region, e.g. "top-left: 2 #00ff00 circles, 1 #000000 line"
+    """
+    regions = {}
+    for element in elements:
+        shapes = regions.setdefault(get_position_description(*element.center), {})
+        key = (element.color, SHAPE_NAMES.get(element.action, 'shape'))
+        shapes[key] = shapes.get(key, 0) + 1
+    return [
+        f"{name}: " + ", ".join(f"{count} {color} {shape}{'s' if count > 1 else ''}"
+                                for (color, shape), count in regions[name].items())
+        for name, _ in REGIONS if name in regions
+    ]
+
+def describe_element(cmd):
+    """
+    Describe a shape or line for the spatial context.
+
+    Args:
+        cmd (dict): Drawing command
+
+    Returns:
+        str: Description, or None for commands that aren't listed
+    """
+    action = cmd.get('action', '')
+
+    if action == 'draw_rect':
+        x0 = cmd.get('x0', 0)
+        y0 = cmd.get('y0', 0)
+        x1 = cmd.get('x1', 0)
+        y1 = cmd.get('y1', 0)
+        color = cmd.get('color', 'unknown')
+        fill = cmd.get('fill', False)
+
+        width = abs(x1 - x0)
+        height = abs(y1 - y0)
+        center_x = (x0 + x1) / 2
+        center_y = (y0 + y1) / 2
+
+        position = get_position_description(center_x, center_y)
+        size_desc = get_size_description(width, height)
+
+        return f"{size_desc} {color} rectangle in the {position} ({x0},{y0} to {x1},{y1}), {'filled' if fill else 'outlined'}"
+
+    if action == 'draw_circle':
+        x = cmd.get('x', 0)
+        y = cmd.get('y', 0)
+        radius = cmd.get('radius', 0)
+        color = cmd.get('color', 'unknown')
+        fill = cmd.get('fill', False)
+
+        position = get_position_description(x, y)
+        size_desc = get_size_description(radius * 2, radius * 2)
+
+        return f"{size_desc} {color} circle at {position} (center: {x},{y}, radius: {radius}), {'filled' if fill else 'outlined'}"
+
+    if action == 'draw_polyline':
+        points = cmd.get('points', [])
+        color = cmd.get('color', 'unknown')
+
+        if len(points) < 2:
+            return None
+
+        # Calculate center of polyline
+        x_coords = [p[0] for p in points]
+        y_coords = [p[1] for p in points]
+        center_x = sum(x_coords) / len(x_coords)
+        center_y = sum(y_coords) / len(y_coords)
+
+        position = get_position_description(center_x, center_y)
+
+        # Estimate size of polyline
+        min_x, max_x = min(x_coords), max(x_coords)
+        min_y, max_y = min(y_coords), max(y_coords)
+        width_line = max_x - min_x
+        height_line = max_y - min_y
+        size_desc = get_size_description(width_line, height_line)
+
+        return f"{size_desc} {color} line in the {position} (from {points[0]} to {points[-1]})"
+
+    return None
 
 def get_size_description(width, height):
     """Provide a size description based on dimensions"""
@@ -231,9 +369,10 @@ def format_command_history(command_history):
         
     # Count commands and colors from last 10 commands only
     counts = {}
-    recent_colors = set()
+    # Colors in first-seen order; set order changes with the hash seed and would change the cache key
+    recent_colors = {}
     
-    for cmd in command_history[-10:]:
+    for cmd in command_history[-RECENT_COMMANDS:]:
         action = cmd.get('action', '')
         # Use abbreviated action names
         action_short = action.replace('draw_', '').replace('_', '')[:5]
@@ -241,7 +380,7 @@ def format_command_history(command_history):
         counts[action_short] = counts.get(action_short, 0) + 1
         
         if 'color' in cmd:
-            recent_colors.add(cmd['color'])
+            recent_colors.setdefault(cmd['color'])
     
     # Create compact summary
     actions = " ".join(f"{a}:{c}" for a, c in counts.items())
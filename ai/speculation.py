@@ -0,0 +1,243 @@
+"""
+Speculative prefetch of the next generation step for canvas sessions.
+
+Phase progression is deterministic, so once a session has rendered the
+commands for part k we already know the client will ask for part k+1. The
+model call for that step is started in the background and its result parked
+in a per-session slot. When the request arrives it is served from the slot,
+provided the prompt it would send is byte-identical to the speculated one;
+otherwise (the canvas was undone, reset or drawn on differently) the
+speculation is discarded and the request runs normally.
+"""
+
+import threading
+import time
+
+from ai.cache import request_key
+from ai.generation import next_step, build_prompt, needs_image, model_image, generate_commands, generation_config
+from ai.jobs import get_job_queue, JobQueueFullError, DONE
+from config.settings import SPECULATION_TTL, SPECULATION_KEY_WAIT, PROMPT_TOKEN_BUDGET
+
+class _Slot:
+    """A speculative generation in progress (or finished) for one session"""
+
+    def __init__(self, plan, job=None):
+        self.plan = plan
+        self.job = job
+        self.key = None
+        self.key_ready = threading.Event()
+        self.created_at = time.time()
+
+class Speculator:
+    """
+    Tracks the next expected step of each session and prefetches it.
+
+    Args:
+        ttl (float): Seconds a plan or prefetched result stays usable
+        key_wait (float): Seconds a request waits for a prefetch that hasn't started to build its prompt
+    """
+
+    def __init__(self, ttl=SPECULATION_TTL, key_wait=SPECULATION_KEY_WAIT / 1000):
+        self.ttl = ttl
+        self.key_wait = key_wait
+        self._plans = {}
+        self._slots = {}
+        # Reentrant so _discard can count under it whether or not the caller holds it
+        self._lock = threading.RLock()
+        self.started = 0
+        self.hits = 0
+        self.discarded = 0
+        self.expired = 0
+        self.skipped = 0
+
+    def plan(self, session, prompt, phase, part, pending, model, lookup=True, store=True, image_options=None,
+             token_budget=PROMPT_TOKEN_BUDGET):
+        """
+        Expect `pending` commands to be rendered into a session, then prefetch the given step.
+
+        Args:
+            session (CanvasSession): Session the commands will be drawn into
+            prompt (str): User's original prompt
+            phase (str): Phase of the step to prefetch
+            part (int): Part of the step to prefetch
+            pending (int): Number of commands the client is about to render
+            model: Model client used for the prefetch
+            lookup (bool): Whether the prefetch may use a cached response
+            store (bool): Whether the prefetched response is cached
+            image_options (dict): Model image overrides from the request
+            token_budget (int): Prompt token budget from the request
+        """
+        plan = {
+            'prompt': prompt,
+            'phase': phase,
+            'part': part,
+            'pending': pending,
+            'model': model,
+            'lookup': lookup,
+            'store': store,
+            'model_image': image_options,
+            'token_budget': token_budget,
+            'created_at': time.time(),
+        }
+        with self._lock:
+            self._plans[session.id] = plan
+            self._discard(self._slots.pop(session.id, None))
+        if pending <= 0:
+            self.rendered(session, 0)
+
+    def rendered(self, session, count):
+        """
+        Note that `count` commands were rendered into a session, starting the prefetch once all have been.
+
+        Args:
+            session (CanvasSession): Session that was drawn into
+            count (int): Number of commands rendered
+        """
+        with self._lock:
+            plan = self._plans.get(session.id)
+            if plan is None:
+                return
+            plan['pending'] -= count
+            if plan['pending'] > 0:
+                return
+            del self._plans[session.id]
+            if time.time() - plan['created_at'] > self.ttl:
+                self.expired += 1
+                return
+
+        # Snapshot the canvas now; the prompt is built on the worker from the session's context
+        with session.lock:
+            img = session.image.copy() if needs_image(plan['phase'], plan['part']) else None
+
+        slot = _Slot(plan)
+        try:
+            slot.job = get_job_queue().submit(self._run, slot, session, img)
+        except JobQueueFullError:
+            # Speculation never competes with real requests for queue space
+            with self._lock:
+                self.skipped += 1
+            return
+
+        with self._lock:
+            self._discard(self._slots.pop(session.id, None))
+            self._slots[session.id] = slot
+            self.started += 1
+        print(f"Prefetching phase {plan['phase']}, part {plan['part']} for session {session.id}")
+
+    def claim(self, session_id, context, model, timeout):
+        """
+        Take the prefetched result for a request, if it is still valid.
+
+        Args:
+            session_id (str): Session the request is for
+            context (dict): Prepared request from prepare_generation
+            model: Model client the request would use
+            timeout (float): Seconds to wait for a matching prefetch that is already running
+
+        Returns:
+            dict: Response payload from generate_commands, or None to generate normally
+        """
+        with self._lock:
+            slot = self._slots.pop(session_id, None)
+        if slot is None:
+            return None
+
+        plan = slot.plan
+        if time.time() - slot.created_at > self.ttl:
+            with self._lock:
+                self.expired += 1
+            self._discard(slot, count=False)
+            return None
+        if (plan['phase'], plan['part']) != (context['current_phase'], context['current_part']):
+            self._discard(slot)
+            return None
+
+        # A prefetch still queued behind other jobs would only delay the request; generate directly instead
+        if not slot.key_ready.wait(self.key_wait):
+            print(f"Prefetch for session {session_id} hasn't started yet, discarding it")
+            self._discard(slot)
+            return None
+        if slot.key != request_key(context['prompt_text'], generation_config(), model.model_name):
+            print(f"Canvas diverged from prefetch for session {session_id}, discarding it")
+            self._discard(slot)
+            return None
+
+        job = get_job_queue().wait(slot.job.id, timeout)
+        if job is None or job.status != DONE:
+            self._discard(slot)
+            return None
+        with self._lock:
+            self.hits += 1
+        return job.result
+
+    def forget(self, session_id):
+        """Drop any plan or prefetch for a session"""
+        with self._lock:
+            self._plans.pop(session_id, None)
+            self._discard(self._slots.pop(session_id, None))
+
+    def stats(self):
+        """
+        Report prefetch counters for monitoring.
+
+        Returns:
+            dict: Started, hit, discarded, expired and skipped counts
+        """
+        with self._lock:
+            return {
+                'started': self.started,
+                'hits': self.hits,
+                'discarded': self.discarded,
+                'expired': self.expired,
+                'skipped': self.skipped,
+                'hit_rate': self.hits / self.started if self.started else 0.0,
+                'pending_plans': len(self._plans),
+                'slots': len(self._slots),
+                'ttl': self.ttl,
+                'key_wait': self.key_wait,
+            }
+
+    def _run(self, slot, session, img):
+        """Build the prompt for the speculated step and generate it (runs on a job worker)"""
+        plan = slot.plan
+        model = plan['model']
+        try:
+            image_part, image_info = model_image(img, plan['model_image']) if img is not None else (None, None)
+            with session.lock:
+                prompt_text, prompt_tokens = build_prompt(plan['prompt'], plan['phase'], plan['part'], None, image_part,
+                                                          context=session.context, budget=plan['token_budget'])
+            slot.key = request_key(prompt_text, generation_config(), model.model_name)
+        finally:
+            slot.key_ready.set()
+        next_phase, next_part, has_more = next_step(plan['phase'], plan['part'])
+        return generate_commands(model, {
+            'prompt_text': prompt_text,
+            'model_image': image_info,
+            'prompt_tokens': prompt_tokens,
+            'current_phase': plan['phase'],
+            'current_part': plan['part'],
+            'next_phase': next_phase,
+            'next_part': next_part,
+            'has_more': has_more,
+        }, lookup=plan['lookup'], store=plan['store'])
+
+    def _discard(self, slot, count=True):
+        if slot is None:
+            return
+        if slot.job is not None:
+            get_job_queue().cancel(slot.job.id)
+        if count:
+            with self._lock:
+                self.discarded += 1
+
+# Process-wide speculator shared by all routes
+speculator = Speculator()
+
+def get_speculator():
+    """
+    Get the process-wide speculator.
+
+    Returns:
+        Speculator: The shared speculator
+    """
+    return speculator
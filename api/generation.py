@@ -0,0 +1,98 @@
+"""
+Request helpers shared by the command generation routes.
+"""
+
+import json
+from flask import jsonify
+
+from api.sessions import lookup_session
+from ai.generation import next_step, needs_image, build_prompt, model_image
+from config.settings import PROMPT_TOKEN_BUDGET
+
+def prepare_generation(data):
+    """
+    Resolve a command generation request into a prompt and phase progression.
+
+    Args:
+        data (dict): Request payload with prompt, phase, part, either
+                     current_image/command_history or a session_id, and
+                     optional token_budget and model_image options
+
+    Returns:
+        tuple: (context dict, None) on success, or (None, Flask response) on a bad request
+    """
+    prompt = data.get('prompt')
+    current_phase = data.get('phase', 'sketch')  # Default to sketch phase
+    current_part = data.get('part', 0)  # Default to first part (0-indexed)
+    current_image = data.get('current_image')
+    command_history = data.get('command_history', [])
+    session_id = data.get('session_id')
+
+    if not prompt:
+        return None, (jsonify({'error': 'No prompt provided'}), 400)
+
+    try:
+        budget = int(data.get('token_budget', PROMPT_TOKEN_BUDGET))
+    except (TypeError, ValueError, OverflowError):
+        return None, (jsonify({'error': 'token_budget must be an integer'}), 400)
+
+    image_options = data.get('model_image')
+    if image_options is not None and not isinstance(image_options, dict):
+        return None, (jsonify({'error': 'model_image must be an object'}), 400)
+
+    # A session supplies the canvas and history so the client doesn't have to
+    session = None
+    if session_id:
+        session, error = lookup_session(session_id)
+        if error:
+            return None, error
+
+    image_part, image_info = None, None
+    if needs_image(current_phase, current_part):
+        if session is not None:
+            with session.lock:
+                source = session.image.copy()
+        elif current_image:
+            # Uploaded bytes go to the model as-is unless they need resizing or re-encoding
+            source = current_image
+        else:
+            return None, (jsonify({'error': 'No current image provided'}), 400)
+        try:
+            image_part, image_info = model_image(source, image_options)
+        except (ValueError, TypeError, OverflowError, OSError) as e:
+            return None, (jsonify({'error': f'Invalid image data: {e}'}), 400)
+
+    if session is not None and not command_history:
+        # The session's context already summarizes its history
+        with session.lock:
+            prompt_text, prompt_tokens = build_prompt(prompt, current_phase, current_part, None, image_part,
+                                                      context=session.context, budget=budget)
+    else:
+        prompt_text, prompt_tokens = build_prompt(prompt, current_phase, current_part, command_history, image_part,
+                                                  budget=budget)
+
+    next_phase, next_part, has_more = next_step(current_phase, current_part)
+    return {
+        'prompt_text': prompt_text,
+        'model_image': image_info,
+        'prompt_tokens': prompt_tokens,
+        'token_budget': budget,
+        'current_phase': current_phase,
+        'current_part': current_part,
+        'next_phase': next_phase,
+        'next_part': next_part,
+        'has_more': has_more,
+    }, None
+
+def sse_event(event, data):
+    """
+    Format a Server-Sent Event.
+
+    Args:
+        event (str): Event name
+        data: JSON-compatible payload
+
+    Returns:
+        str: The encoded event
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
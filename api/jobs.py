@@ -0,0 +1,100 @@
+"""
+API routes for background command generation jobs.
+"""
+
+from flask import request, jsonify
+
+from api.generation import prepare_generation
+from api.transport import read_payload
+from ai.client import get_model_client
+from ai.cache import cache_mode
+from ai.generation import generate_commands
+from ai.jobs import get_job_queue, JobQueueFullError
+from config.settings import JOB_MAX_WAIT
+
+def prefers_async(headers):
+    """True if the client sent `Prefer: respond-async` and takes a job instead of waiting for the result"""
+    directives = {d.strip().lower() for d in headers.get('Prefer', '').split(',')}
+    return 'respond-async' in directives
+
+def queue_generation(context, model, lookup=True, store=True):
+    """
+    Queue a prepared generation step as a background job.
+
+    Args:
+        context (dict): Prepared request from prepare_generation
+        model: Model client
+        lookup (bool): Whether a cached response may be used
+        store (bool): Whether a fresh response is cached
+
+    Returns:
+        tuple: (response, status) 202 with the job and its Location, or 429 if the queue is full
+    """
+    jobs = get_job_queue()
+    try:
+        job = jobs.submit(generate_commands, model, context, lookup=lookup, store=store)
+    except JobQueueFullError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(jobs.retry_after())
+        return response, 429
+
+    response = jsonify(job.describe())
+    response.headers['Location'] = f'/jobs/{job.id}'
+    return response, 202
+
+def register_job_routes(app):
+    """
+    Register job routes with the Flask application.
+
+    Args:
+        app (Flask): Flask application instance
+    """
+
+    @app.route('/jobs', methods=['POST'])
+    def create_job():
+        """Queue a generation step; the result is collected from GET /jobs/<id>"""
+        data, error = read_payload('current_image')
+        if error:
+            return error
+
+        try:
+            # Resolve the prompt and canvas now, so the job doesn't depend on later session edits
+            context, error = prepare_generation(data)
+            if error:
+                return error
+
+            model = get_model_client()
+            if not model.available:
+                return jsonify({'error': 'AI model not initialized'}), 500
+
+            lookup, store = cache_mode(request.headers)
+            return queue_generation(context, model, lookup, store)
+        except Exception as e:
+            print(f"Error queueing job: {e}")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/jobs', methods=['GET'])
+    def job_stats():
+        """Report job queue depth, counts and wait/run times"""
+        return jsonify(get_job_queue().stats())
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        """Get a job's status, waiting up to ?wait= seconds for it to finish"""
+        try:
+            wait = float(request.args.get('wait', 0))
+        except ValueError:
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
+
+        job = get_job_queue().wait(job_id, min(max(wait, 0.0), JOB_MAX_WAIT))
+        if job is None:
+            return jsonify({'error': f'Unknown or expired job: {job_id}'}), 404
+        return jsonify(job.describe())
+
+    @app.route('/jobs/<job_id>', methods=['DELETE'])
+    def cancel_job(job_id):
+        """Cancel a queued or running job"""
+        job = get_job_queue().cancel(job_id)
+        if job is None:
+            return jsonify({'error': f'Unknown or expired job: {job_id}'}), 404
+        return jsonify(job.describe())
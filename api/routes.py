@@ -2,18 +2,22 @@
 API routes for the Flask application with improved element tracking.
 """
 
-import json
-import re
-from io import BytesIO
-from flask import request, jsonify, send_file
-from PIL import Image
-
-from utils.image import data_uri_to_image, image_to_data_uri
-from utils.text import clean_json_string, extract_thinking, summarize_command_history
-from drawing.processor import process_drawing_command
-from ai.model import get_model
-from ai.prompts import get_initial_sketch_prompt, get_continuation_prompt, format_command_history
-from config.phases import PHASES, GENERATION_CONFIG
+from flask import request, jsonify, Response, stream_with_context
+
+from utils.json_repair import CommandStreamParser
+from drawing.processor import process_drawing_command, process_drawing_commands, get_render_executor, RenderError, RenderQueueFullError, RenderTimeoutError
+from drawing.sessions import get_session_store
+from drawing.cache import get_render_cache
+from api.sessions import register_session_routes, lookup_session, session_draw_response, requested_patch_format, requested_codec
+from api.generation import prepare_generation, sse_event
+from api.jobs import register_job_routes, prefers_async, queue_generation
+from api.transport import read_payload, canvas_response
+from ai.client import get_model_client, ModelTimeoutError
+from ai.cache import get_response_cache, cache_mode, stream_cached
+from ai.generation import generation_config, generation_step, generate_commands
+from ai.speculation import get_speculator
+from drawing.schema import validate_command
+from config.settings import MODEL_REQUEST_TIMEOUT, SPECULATIVE_PREFETCH
 
 def register_routes(app):
     """
@@ -22,123 +26,260 @@ def register_routes(app):
     Args:
         app: Flask application instance
     """
+    register_session_routes(app)
+    register_job_routes(app)
     
+    @app.errorhandler(RenderError)
+    def render_error(e):
+        """Report render executor overload and timeouts instead of a generic failure"""
+        print(f"Render error: {e}")
+        if isinstance(e, RenderQueueFullError):
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        if isinstance(e, RenderTimeoutError):
+            return jsonify({'error': str(e)}), 504
+        return jsonify({'error': str(e)}), 500
+
     @app.route('/draw_command', methods=['POST'])
     def draw_command():
-        """Process a drawing command"""
-        data = request.get_json()
+        """Process a drawing command against an image or a canvas session"""
+        data, error = read_payload()
+        if error:
+            return error
         command = data.get('command', {})
         image_data = data.get('image_data')
+        session_id = data.get('session_id')
         
-        if not image_data or not command or 'action' not in command:
+        if not (image_data or session_id) or not command or 'action' not in command:
             return jsonify({'error': 'Invalid command or data'}), 400
+
+        if session_id:
+            session, error = lookup_session(session_id)
+            if error:
+                return error
+            results, patches = session.apply([command], requested_patch_format(data, session.codec))
+            get_session_store().update(session.id)
+            get_speculator().rendered(session, 1)
+            return canvas_response(session_draw_response(session, results, patches, data))
+
+        patch_format = requested_patch_format(data)
+        codec = requested_codec(data)
+        if patch_format or codec != 'png':
+            try:
+                return canvas_response(process_drawing_commands(image_data, [command], patch_format, codec))
+            except RenderError:
+                raise
+            except Exception as e:
+                print(f"Drawing error: {e} while decoding canvas")
+                return jsonify({'error': f'Invalid image data: {e}'}), 400
             
         updated_image_data = process_drawing_command(image_data, command)
-        return jsonify({'image_data': updated_image_data})
+        return canvas_response({'image_data': updated_image_data})
+
+    @app.route('/draw_commands', methods=['POST'])
+    def draw_commands():
+        """Process an ordered list of drawing commands in one decode/encode cycle"""
+        data, error = read_payload()
+        if error:
+            return error
+        commands = data.get('commands', [])
+        image_data = data.get('image_data')
+        session_id = data.get('session_id')
+
+        if not (image_data or session_id) or not isinstance(commands, list):
+            return jsonify({'error': 'Invalid commands or data'}), 400
+
+        if session_id:
+            session, error = lookup_session(session_id)
+            if error:
+                return error
+            results, patches = session.apply(commands, requested_patch_format(data, session.codec))
+            get_session_store().update(session.id)
+            get_speculator().rendered(session, len(commands))
+            return canvas_response(session_draw_response(session, results, patches, data))
+
+        try:
+            payload = process_drawing_commands(image_data, commands, requested_patch_format(data), requested_codec(data))
+        except RenderError:
+            raise
+        except Exception as e:
+            print(f"Drawing error: {e} while decoding canvas")
+            return jsonify({'error': f'Invalid image data: {e}'}), 400
+
+        failed = sum(1 for result in payload['results'] if result['status'] != 'ok')
+        payload['applied'] = len(payload['results']) - failed
+        payload['failed'] = failed
+        return canvas_response(payload)
+
+    @app.route('/render_cache', methods=['GET'])
+    def render_cache_stats():
+        """Report render cache hit/miss counters for monitoring"""
+        return jsonify(get_render_cache().stats())
+
+    @app.route('/render_executor', methods=['GET'])
+    def render_executor_stats():
+        """Report render worker pool usage"""
+        return jsonify(get_render_executor().stats())
+
+    @app.route('/response_cache', methods=['GET'])
+    def response_cache_stats():
+        """Report model response cache counters for monitoring"""
+        return jsonify(get_response_cache().stats())
+
+    @app.route('/model_client', methods=['GET'])
+    def model_client_stats():
+        """Report model client concurrency, coalescing and timeout counters"""
+        return jsonify(get_model_client().stats())
+
+    @app.route('/speculation', methods=['GET'])
+    def speculation_stats():
+        """Report speculative prefetch counters"""
+        return jsonify(get_speculator().stats())
 
     @app.route('/reset_drawing', methods=['POST'])
     def reset_drawing():
-        """Reset drawing state"""
+        """Reset drawing state, rewinding a session to its blank canvas"""
+        data = request.get_json(silent=True) or {}
+        session_id = data.get('session_id')
+        if session_id:
+            session, error = lookup_session(session_id)
+            if error:
+                return error
+            # Seeking keeps the history as redo, so a reset can be undone
+            session.seek(0)
+            get_session_store().update(session.id)
+            return jsonify({'status': 'Drawing state reset', **session.describe()})
         return jsonify({'status': 'Drawing state reset'})
 
     @app.route('/get_commands', methods=['POST'])
     def get_commands():
         """Get drawing commands from Gemini with spatial awareness"""
-        data = request.get_json()
-        prompt = data.get('prompt')
-        current_phase = data.get('phase', 'sketch')  # Default to sketch phase
-        current_part = data.get('part', 0)  # Default to first part (0-indexed)
-        current_image = data.get('current_image')
-        command_history = data.get('command_history', [])
-
-        if not prompt:
-            return jsonify({'error': 'No prompt provided'}), 400
+        data, error = read_payload('current_image')
+        if error:
+            return error
 
         try:
-            # Format the command history for readability
-            history_text = format_command_history(command_history)
-                
-            # Find the current phase details
-            phase_info = next((phase for phase in PHASES if phase["name"] == current_phase), PHASES[0])
-            
-            # Determine next part or phase
-            next_part = current_part + 1
-            next_phase = current_phase
-            
-            # If we've reached the end of parts for this phase, move to the next phase
-            if next_part >= len(phase_info["parts"]):
-                next_part = 0
-                phase_index = next((i for i, p in enumerate(PHASES) if p["name"] == current_phase), 0)
-                if phase_index < len(PHASES) - 1:
-                    next_phase = PHASES[phase_index + 1]["name"]
-            
-            has_more = not (next_phase == PHASES[-1]["name"] and next_part == len(PHASES[-1]["parts"]) - 1)
-            
-            # Get the AI model
-            model = get_model()
-            if not model:
+            context, error = prepare_generation(data)
+            if error:
+                return error
+
+            # Get the AI model client
+            model = get_model_client()
+            if not model.available:
                 return jsonify({'error': 'AI model not initialized'}), 500
-            
-            # Build different prompts based on phase and part
-            if current_phase == 'sketch' and current_part == 0:
-                # Initial sketch, first part
-                prompt_text = get_initial_sketch_prompt(prompt, history_text)
+
+            lookup, store = cache_mode(request.headers)
+            if prefers_async(request.headers):
+                # Answer with a job instead of holding this worker thread for the model call
+                return queue_generation(context, model, lookup, store)
+
+            session_id = data.get('session_id')
+            speculator = get_speculator()
+
+            # A prefetch started while the previous part rendered may already have the answer
+            payload = speculator.claim(session_id, context, model, MODEL_REQUEST_TIMEOUT) if session_id else None
+            prefetched = payload is not None
+            if prefetched:
+                print(f"Serving prefetched commands for phase {context['current_phase']}, part {context['current_part']}")
+                payload = dict(payload)
             else:
-                # All other phases and parts
-                if not current_image:
-                    return jsonify({'error': 'No current image provided'}), 400
-                
-                img = data_uri_to_image(current_image)
-                buffered = BytesIO()
-                img.save(buffered, format="PNG")
-                image_part = {"mime_type": "image/png", "data": buffered.getvalue()}
-                
-                prompt_text = get_continuation_prompt(
-                    prompt, 
-                    current_phase, 
-                    current_part, 
-                    image_part, 
-                    history_text,
-                    command_history
-                )
-
-            # Generate content from AI
-            print(f"Sending prompt to AI (Phase: {current_phase}, Part: {current_part})")
-            response = model.generate_content(prompt_text, generation_config=GENERATION_CONFIG)
-            print(f"Raw Gemini Response (Phase: {current_phase}, Part: {current_part}):")
-            print(response.text[:200] + "...") # Only print beginning to avoid console clutter
-            
-            # Extract thinking for UI display
-            thinking = extract_thinking(response.text)
-            if thinking:
-                print(f"Extracted thinking from AI response")
-            
-            # Clean the JSON string
-            cleaned_json = clean_json_string(response.text)
-            
-            # Try to parse commands
-            try:
-                commands = json.loads(cleaned_json)
-                if not isinstance(commands, list):
-                    commands = [commands] if commands else []
-            except json.JSONDecodeError:
-                print("Failed to parse JSON response, returning empty command list")
-                commands = []
-                
-            print(f"Returning {len(commands)} drawing commands for phase {current_phase}, part {current_part}")
-                
-            return jsonify({
-                'commands': commands, 
-                'current_phase': current_phase,
-                'current_part': current_part,
-                'next_phase': next_phase,
-                'next_part': next_part,
-                'has_more': has_more,
-                'thinking': thinking  # Include the thinking for UI display
-            })
+                payload = generate_commands(model, context, lookup=lookup, store=store)
+            payload['prefetched'] = prefetched
 
+            if session_id and payload['has_more'] and data.get('speculate', SPECULATIVE_PREFETCH):
+                session = get_session_store().get(session_id)
+                if session is not None:
+                    speculator.plan(session, data['prompt'], payload['next_phase'], payload['next_part'],
+                                    len(payload['commands']), model, lookup=lookup, store=store,
+                                    image_options=data.get('model_image'),
+                                    token_budget=context['token_budget'])
+            return jsonify(payload)
+
+        except ModelTimeoutError as e:
+            print(f"Model timeout: {e}")
+            return jsonify({'error': str(e)}), 504
         except Exception as e:
             import traceback
             print(f"Error: {e}")
             print(traceback.format_exc())
-            return jsonify({'error': str(e)}), 500
\ No newline at end of file
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/get_commands/stream', methods=['POST'])
+    def get_commands_stream():
+        """
+        Stream drawing commands from Gemini as Server-Sent Events.
+
+        Events: 'step' (phase progression), 'thinking' (text deltas),
+        'command' (one parsed command each), then 'done' or 'error'.
+        """
+        data, error = read_payload('current_image')
+        if error:
+            return error
+
+        try:
+            context, error = prepare_generation(data)
+        except Exception as e:
+            print(f"Error preparing prompt: {e}")
+            return jsonify({'error': str(e)}), 500
+        if error:
+            return error
+
+        model = get_model_client()
+        if not model.available:
+            return jsonify({'error': 'AI model not initialized'}), 500
+
+        lookup, store = cache_mode(request.headers)
+        current_phase, current_part = context['current_phase'], context['current_part']
+
+        def events():
+            yield sse_event('step', generation_step(context))
+            parser = CommandStreamParser()
+            count = 0
+            received = 0
+            cached = False
+            rejected = []
+
+            def encode(parsed):
+                nonlocal count, received
+                for kind, value in parsed:
+                    if kind == 'thinking':
+                        yield sse_event('thinking', {'text': value})
+                        continue
+                    command, problems = validate_command(value)
+                    received += 1
+                    if command is None:
+                        rejected.append({'index': received - 1, 'action': value.get('action'), 'problems': problems})
+                        continue
+                    yield sse_event('command', {'index': count, 'command': command})
+                    count += 1
+
+            try:
+                print(f"Streaming prompt to AI (Phase: {current_phase}, Part: {current_part})")
+                for chunk, cached in stream_cached(
+                    model, context['prompt_text'], generation_config(), lookup=lookup, store=store
+                ):
+                    yield from encode(parser.feed(chunk))
+                yield from encode(parser.close())
+
+                print(f"Streamed {count} drawing commands for phase {current_phase}, part {current_part}")
+                yield sse_event('done', {
+                    'count': count,
+                    'thinking': parser.thinking,
+                    'cached': cached,
+                    'repairs': parser.repairs,
+                    'rejected': rejected,
+                    'model_image': context['model_image'],
+                    'prompt_tokens': context['prompt_tokens'],
+                })
+            except Exception as e:
+                import traceback
+                print(f"Error: {e}")
+                print(traceback.format_exc())
+                yield sse_event('error', {'error': str(e)})
+
+        return Response(
+            stream_with_context(events()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
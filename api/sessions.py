@@ -0,0 +1,218 @@
+"""
+API routes for server-side canvas sessions.
+"""
+
+from flask import request, jsonify
+
+from utils.image import data_uri_to_image
+from utils.codecs import parse_codec, valid_codec, encode_image_string
+from drawing.actions import parse_color
+from drawing.sessions import get_session_store, new_canvas
+from ai.speculation import get_speculator
+from config.settings import DEFAULT_CANVAS_WIDTH, DEFAULT_CANVAS_HEIGHT, MAX_CANVAS_PIXELS, CANVAS_CODEC, TILED_SESSIONS
+
+def lookup_session(session_id):
+    """
+    Resolve a session id from a request payload.
+
+    Args:
+        session_id (str): Session identifier sent by the client
+
+    Returns:
+        tuple: (CanvasSession, None) on success, or (None, Flask response) if unknown
+    """
+    session = get_session_store().get(session_id)
+    if session is None:
+        return None, (jsonify({'error': f'Unknown or expired session: {session_id}'}), 404)
+    return session, None
+
+def session_draw_response(session, results, patches, data):
+    """
+    Build the JSON payload returned after drawing into a session.
+
+    The updated canvas is only encoded when the client asks for it
+    (the default), so pure server-side pipelines can skip the encode. It
+    uses the requested codec, or the session's.
+    When patches were collected they replace the full image.
+
+    Args:
+        session (CanvasSession): Session that was drawn into
+        results (list): Per-command results from CanvasSession.apply
+        patches (list): Changed-region patches, or None
+        data (dict): Request payload
+
+    Returns:
+        dict: Response payload
+    """
+    failed = sum(1 for result in results if result['status'] != 'ok')
+    payload = {
+        'session_id': session.id,
+        'history_length': len(session.history),
+        'results': results,
+        'applied': len(results) - failed,
+        'failed': failed,
+    }
+    payload['width'], payload['height'] = session.size
+    if patches is not None:
+        payload['patches'] = patches
+    elif data.get('return_image', True):
+        codec = requested_codec(data, session.codec)
+        with session.lock:
+            payload['image_data'] = encode_image_string(session.image, codec)
+        payload['codec'] = codec
+    return payload
+
+def requested_codec(data, default=CANVAS_CODEC):
+    """
+    Get the codec requested for a full image in a draw payload.
+
+    Args:
+        data (dict): Request payload with an optional 'codec' spec
+        default (str): Codec to use when none or an unknown one was requested
+
+    Returns:
+        str: Codec spec (see utils.codecs)
+    """
+    return valid_codec(data.get('codec'), default)
+
+def requested_patch_format(data, default='png'):
+    """
+    Get the patch format requested by a draw payload.
+
+    Args:
+        data (dict): Request payload with optional 'response_mode' and 'patch_format'
+        default (str): Codec to use when none or an unknown one was requested
+
+    Returns:
+        str: Codec spec for patches in patch mode, otherwise None
+    """
+    if data.get('response_mode') != 'patch':
+        return None
+    return valid_codec(data.get('patch_format'), default)
+
+def register_session_routes(app):
+    """
+    Register canvas session routes with the Flask application.
+
+    Args:
+        app: Flask application instance
+    """
+
+    @app.route('/sessions', methods=['POST'])
+    def create_session():
+        """Create a canvas session, either blank or from an uploaded image"""
+        data = request.get_json(silent=True) or {}
+        image_data = data.get('image_data')
+
+        try:
+            if image_data:
+                img = data_uri_to_image(image_data)
+            else:
+                width = int(data.get('width', DEFAULT_CANVAS_WIDTH))
+                height = int(data.get('height', DEFAULT_CANVAS_HEIGHT))
+                if width <= 0 or height <= 0:
+                    return jsonify({'error': 'Canvas size must be positive'}), 400
+                if width * height > MAX_CANVAS_PIXELS:
+                    return jsonify({'error': 'Canvas too large'}), 400
+                img = new_canvas(width, height, parse_color(data.get('background', '#FFFFFF')))
+        except Exception as e:
+            return jsonify({'error': f'Invalid canvas data: {e}'}), 400
+
+        if img.width * img.height > MAX_CANVAS_PIXELS:
+            return jsonify({'error': 'Canvas too large'}), 400
+
+        codec = data.get('codec') or CANVAS_CODEC
+        try:
+            parse_codec(codec)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        session = get_session_store().create(img, codec, bool(data.get('tiled', TILED_SESSIONS)))
+        print(f"Created canvas session {session.id} ({img.width}x{img.height})")
+        return jsonify(session.describe()), 201
+
+    @app.route('/sessions', methods=['GET'])
+    def session_stats():
+        """Report session store usage"""
+        return jsonify(get_session_store().stats())
+
+    @app.route('/sessions/<session_id>', methods=['GET'])
+    def get_session(session_id):
+        """Return the session canvas and, optionally, its command history"""
+        session, error = lookup_session(session_id)
+        if error:
+            return error
+
+        codec = valid_codec(request.args.get('codec'), session.codec)
+        with session.lock:
+            result = session.describe()
+            result['image_data'] = encode_image_string(session.image, codec)
+            result['codec'] = codec
+            if request.args.get('include_history', '').lower() in ('true', '1'):
+                result['command_history'] = list(session.history)
+        return jsonify(result)
+
+    @app.route('/sessions/<session_id>', methods=['DELETE'])
+    def delete_session(session_id):
+        """Discard a session"""
+        if not get_session_store().delete(session_id):
+            return jsonify({'error': f'Unknown or expired session: {session_id}'}), 404
+        get_speculator().forget(session_id)
+        return jsonify({'status': 'Session deleted', 'session_id': session_id})
+
+    def history_response(session, patches, data):
+        """Build the payload returned after moving through a session's history"""
+        get_session_store().update(session.id)
+        payload = session.describe()
+        if patches is not None:
+            payload['patches'] = patches
+        elif data.get('return_image', True):
+            codec = requested_codec(data, session.codec)
+            with session.lock:
+                payload['image_data'] = encode_image_string(session.image, codec)
+            payload['codec'] = codec
+        return payload
+
+    @app.route('/sessions/<session_id>/undo', methods=['POST'])
+    def undo_session(session_id):
+        """Step back through the session history"""
+        session, error = lookup_session(session_id)
+        if error:
+            return error
+        data = request.get_json(silent=True) or {}
+        try:
+            steps = max(1, int(data.get('steps', 1)))
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({'error': 'steps must be an integer'}), 400
+        patches = session.undo(steps, requested_patch_format(data, session.codec))
+        return jsonify(history_response(session, patches, data))
+
+    @app.route('/sessions/<session_id>/redo', methods=['POST'])
+    def redo_session(session_id):
+        """Step forward along the session's redo history"""
+        session, error = lookup_session(session_id)
+        if error:
+            return error
+        data = request.get_json(silent=True) or {}
+        try:
+            steps = max(1, int(data.get('steps', 1)))
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({'error': 'steps must be an integer'}), 400
+        patches = session.redo(steps, requested_patch_format(data, session.codec))
+        return jsonify(history_response(session, patches, data))
+
+    @app.route('/sessions/<session_id>/seek', methods=['POST'])
+    def seek_session(session_id):
+        """Jump to the canvas state after any number of history commands"""
+        session, error = lookup_session(session_id)
+        if error:
+            return error
+        data = request.get_json(silent=True) or {}
+        if 'position' not in data:
+            return jsonify({'error': 'No position provided'}), 400
+        try:
+            position = int(data['position'])
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({'error': 'Position must be an integer'}), 400
+        patches = session.seek(position, requested_patch_format(data, session.codec))
+        return jsonify(history_response(session, patches, data))
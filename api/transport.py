@@ -0,0 +1,154 @@
+"""
+Binary transport for canvas payloads.
+
+JSON requests carry the canvas as a base64 data URI, which inflates it by a
+third and makes both ends parse megabyte strings. Draw and generation
+routes also accept the canvas as raw bytes:
+
+- multipart/form-data with the canvas in an 'image' file part and the rest
+  of the request as JSON in a 'payload' field, or
+- application/octet-stream (or image/*) with the canvas as the body and the
+  rest of the request as JSON in an X-Payload header.
+
+Responses are negotiated with Accept. 'multipart/form-data' returns the
+JSON result in a 'meta' field with the full image and each patch as file
+parts referenced by name; 'image/png' or 'application/octet-stream' returns
+the full image as the body with the JSON result in an X-Payload header.
+Parts carry the MIME type of their codec (see utils/codecs.py).
+Anything else gets the usual JSON.
+"""
+
+import base64
+import json
+import uuid
+
+from flask import request, jsonify, Response
+
+from utils.codecs import codec_mime_type
+
+# Header carrying the JSON part of an octet-stream request or response
+PAYLOAD_HEADER = 'X-Payload'
+
+BINARY_TYPES = ('application/octet-stream', 'image/png', 'image/jpeg', 'image/webp')
+
+def read_payload(image_field='image_data'):
+    """
+    Read a JSON, multipart or octet-stream request.
+
+    For binary requests the canvas bytes are stored under `image_field`;
+    routes decode them like a data URI.
+
+    Args:
+        image_field (str): Payload key the canvas belongs under
+
+    Returns:
+        tuple: (payload dict, None) on success, or (None, Flask response) on a malformed request
+    """
+    mimetype = request.mimetype
+    try:
+        if mimetype == 'multipart/form-data':
+            data = json.loads(request.form.get('payload') or '{}')
+            image = request.files.get('image')
+            if image is not None:
+                data[image_field] = image.read()
+        elif mimetype in BINARY_TYPES:
+            data = json.loads(request.headers.get(PAYLOAD_HEADER) or '{}')
+            body = request.get_data()
+            if body:
+                data[image_field] = body
+        else:
+            return request.get_json(silent=True) or {}, None
+    except ValueError as e:
+        return None, (jsonify({'error': f'Invalid request payload: {e}'}), 400)
+
+    if not isinstance(data, dict):
+        return None, (jsonify({'error': 'Request payload must be a JSON object'}), 400)
+    return data, None
+
+def _image_bytes(value):
+    """Decode a data URI or raw-codec base64 (or pass through bytes) for a binary response"""
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return base64.b64decode(value.split(',', 1)[-1])
+
+def _data_uri(value):
+    if isinstance(value, (bytes, bytearray)):
+        return f"data:image/png;base64,{base64.b64encode(value).decode()}"
+    return value
+
+def _preferred_type():
+    """Response type the client asked for; wildcards and ties keep JSON"""
+    return request.accept_mimetypes.best_match(
+        ['application/json', 'multipart/form-data', 'image/png', 'application/octet-stream'],
+        default='application/json',
+    )
+
+def encode_multipart(fields, files):
+    """
+    Encode a multipart/form-data body.
+
+    Args:
+        fields (dict): Text fields by name
+        files (dict): (bytes, content type) tuples by name
+
+    Returns:
+        tuple: (body bytes, content type header value)
+    """
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for name, value in fields.items():
+        chunks.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode()
+        )
+        chunks.append(value.encode())
+        chunks.append(b'\r\n')
+    for name, (data, content_type) in files.items():
+        chunks.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode()
+        )
+        chunks.append(data)
+        chunks.append(b'\r\n')
+    chunks.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(chunks), f'multipart/form-data; boundary={boundary}'
+
+def canvas_response(payload, status=200):
+    """
+    Return a draw result in the representation the client asked for.
+
+    Args:
+        payload (dict): Result with an optional 'image_data' (data URI or bytes)
+                        and optional 'patches'
+        status (int): HTTP status code
+
+    Returns:
+        Flask response
+    """
+    image = payload.get('image_data')
+    patches = payload.get('patches')
+    preferred = _preferred_type()
+
+    if preferred == 'multipart/form-data':
+        meta = {key: value for key, value in payload.items() if key not in ('image_data', 'patches')}
+        files = {}
+        if image:
+            files['image'] = (_image_bytes(image), codec_mime_type(payload.get('codec', 'png')))
+            meta['image_part'] = 'image'
+        if patches is not None:
+            meta['patches'] = []
+            for index, patch in enumerate(patches):
+                name = f'patch-{index}'
+                files[name] = (_image_bytes(patch['data']), codec_mime_type(patch['format']))
+                meta['patches'].append({**{k: v for k, v in patch.items() if k != 'data'}, 'part': name})
+        body, content_type = encode_multipart({'meta': json.dumps(meta)}, files)
+        return Response(body, status=status, content_type=content_type)
+
+    if image and preferred in ('image/png', 'application/octet-stream'):
+        meta = {key: value for key, value in payload.items() if key != 'image_data'}
+        response = Response(_image_bytes(image), status=status, mimetype=codec_mime_type(payload.get('codec', 'png')))
+        response.headers[PAYLOAD_HEADER] = json.dumps(meta)
+        return response
+
+    if isinstance(image, (bytes, bytearray)):
+        payload = {**payload, 'image_data': _data_uri(image)}
+    return jsonify(payload), status
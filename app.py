@@ -11,6 +11,7 @@ from dotenv import load_dotenv
 import os
 
 from api.routes import register_routes
+from api.transport import PAYLOAD_HEADER
 from ai.model import initialize_model
 
 # Load environment variables from .env file
@@ -24,7 +25,8 @@ def create_app():
         Flask: Configured Flask application
     """
     app = Flask(__name__)
-    CORS(app)
+    # Binary responses carry their JSON metadata in a header the page must be able to read
+    CORS(app, expose_headers=[PAYLOAD_HEADER])
     
     # Initialize the AI model
     initialize_model()
@@ -0,0 +1,91 @@
+"""
+Compare canvas codecs: encode time versus encoded size.
+
+Paints a canvas at each of our usual sizes with a deterministic mix of
+strokes, shapes and textures, then encodes it (and a typical dirty-rectangle
+patch) with every registered codec.
+
+Usage:
+    python benchmarks/bench_codecs.py [--repeat N] [--codecs png,png:1,webp,...]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from drawing.processor import apply_commands
+from utils.codecs import CODECS, encode_image
+
+SIZES = [(500, 400), (1024, 768), (2048, 1536)]
+
+DEFAULT_CODECS = ['png', 'png:1', 'png:0', 'webp', 'webp:4', 'rgba', 'rgba-zlib:1', 'rgba-zlib:6']
+if 'rgba-lz4' in CODECS:
+    DEFAULT_CODECS.append('rgba-lz4')
+
+COLORS = ['#1f3a5f', '#e07a5f', '#3d405b', '#81b29a', '#f2cc8f', '#222222']
+
+def paint(width, height, count=120, seed=7):
+    """Paint a canvas with a reproducible mix of commands"""
+    rng = random.Random(seed)
+    commands = []
+    for _ in range(count):
+        kind = rng.random()
+        color = rng.choice(COLORS)
+        if kind < 0.6:
+            x, y = rng.uniform(0, width), rng.uniform(0, height)
+            points = []
+            for _ in range(rng.randint(3, 8)):
+                x = min(max(x + rng.uniform(-80, 80), 0), width)
+                y = min(max(y + rng.uniform(-80, 80), 0), height)
+                points.append([x, y])
+            commands.append({'action': 'draw_polyline', 'points': points, 'color': color,
+                             'width': rng.uniform(2, 14), 'texture': rng.choice(['smooth', 'smooth', 'rough']),
+                             'seed': rng.randint(0, 1 << 30)})
+        elif kind < 0.85:
+            commands.append({'action': 'draw_circle', 'x': rng.uniform(0, width), 'y': rng.uniform(0, height),
+                             'radius': rng.uniform(10, 60), 'color': color, 'fill': rng.random() < 0.5})
+        else:
+            x0, y0 = rng.uniform(0, width), rng.uniform(0, height)
+            commands.append({'action': 'draw_rect', 'x0': x0, 'y0': y0, 'x1': x0 + rng.uniform(20, 150),
+                             'y1': y0 + rng.uniform(20, 150), 'color': color, 'fill': True})
+    img, _ = apply_commands(Image.new('RGBA', (width, height), (255, 255, 255, 255)), commands)
+    return img
+
+def bench(image, spec, repeat):
+    """Best-of-N encode time in milliseconds and encoded size in bytes"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = encode_image(image, spec)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, len(data)
+
+def report(label, image, codecs, repeat):
+    print(f"\n{label} ({image.width}x{image.height})")
+    print(f"{'codec':<14}{'encode ms':>11}{'bytes':>12}{'vs png time':>13}{'vs png size':>13}")
+    baseline_ms, baseline_bytes = bench(image, 'png', repeat)
+    for spec in codecs:
+        ms, size = bench(image, spec, repeat)
+        print(f"{spec:<14}{ms:>11.2f}{size:>12,}{baseline_ms / ms:>12.1f}x{size / baseline_bytes:>12.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='encodes per codec (best is reported)')
+    parser.add_argument('--codecs', default=','.join(DEFAULT_CODECS), help='comma-separated codec specs')
+    args = parser.parse_args()
+    codecs = [spec.strip() for spec in args.codecs.split(',') if spec.strip()]
+
+    for width, height in SIZES:
+        image = paint(width, height)
+        report('Full canvas', image, codecs, args.repeat)
+        # A typical single-stroke dirty rectangle
+        report('Patch', image.crop((width // 4, height // 4, width // 4 + 160, height // 4 + 120)), codecs, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Runtime settings for server-side subsystems.
+Values can be overridden with environment variables of the same name.
+"""
+
+import os
+
+def _env_int(name, default):
+    """Read an integer setting from the environment, falling back to default"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+# Canvas sessions
+DEFAULT_CANVAS_WIDTH = 500
+DEFAULT_CANVAS_HEIGHT = 400
+MAX_CANVAS_PIXELS = _env_int("MAX_CANVAS_PIXELS", 4096 * 4096)
+SESSION_MAX_COUNT = _env_int("SESSION_MAX_COUNT", 64)
+SESSION_MAX_BYTES = _env_int("SESSION_MAX_BYTES", 256 * 1024 * 1024)  # 256 MB
+SESSION_IDLE_TTL = _env_int("SESSION_IDLE_TTL", 30 * 60)  # seconds
+
+# Dirty-rectangle responses fall back to a full image above this fraction of the canvas
+PATCH_MAX_FRACTION = 0.5
+
+# Render cache (set RENDER_CACHE_MAX_BYTES=0 to disable, RENDER_CACHE_DIR to spill to disk)
+RENDER_CACHE_MAX_BYTES = _env_int("RENDER_CACHE_MAX_BYTES", 64 * 1024 * 1024)  # 64 MB
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR") or None
+RENDER_CACHE_DISK_MAX_BYTES = _env_int("RENDER_CACHE_DISK_MAX_BYTES", 512 * 1024 * 1024)  # 512 MB
+
+# Replay engine: store a compressed checkpoint every N commands
+REPLAY_CHECKPOINT_INTERVAL = _env_int("REPLAY_CHECKPOINT_INTERVAL", 25)
+
+# Model response cache (SQLite; set RESPONSE_CACHE_MAX_BYTES=0 to disable)
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", os.path.join(".cache", "responses.sqlite3"))
+RESPONSE_CACHE_TTL = _env_int("RESPONSE_CACHE_TTL", 7 * 24 * 60 * 60)  # seconds
+RESPONSE_CACHE_MAX_BYTES = _env_int("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024)  # 32 MB
+
+# Ask the model for schema-constrained JSON (set STRUCTURED_OUTPUT=0 for free-form responses)
+STRUCTURED_OUTPUT = _env_int("STRUCTURED_OUTPUT", 1) != 0
+
+# Model client: concurrent upstream calls and per-request timeout
+MODEL_MAX_CONCURRENCY = _env_int("MODEL_MAX_CONCURRENCY", 4)
+MODEL_REQUEST_TIMEOUT = _env_int("MODEL_REQUEST_TIMEOUT", 60)  # seconds
+
+# Background generation jobs: worker threads, queue bound, result retention and long-poll cap
+JOB_WORKERS = _env_int("JOB_WORKERS", 4)
+JOB_QUEUE_SIZE = _env_int("JOB_QUEUE_SIZE", 32)
+JOB_RESULT_TTL = _env_int("JOB_RESULT_TTL", 600)  # seconds
+JOB_MAX_WAIT = _env_int("JOB_MAX_WAIT", 30)  # seconds
+
+# Speculative prefetch: generate the next part for a session while the current one renders
+SPECULATIVE_PREFETCH = _env_int("SPECULATIVE_PREFETCH", 0) != 0
+SPECULATION_TTL = _env_int("SPECULATION_TTL", 120)  # seconds
+# How long a request waits for a prefetch that hasn't started building its prompt before generating itself
+SPECULATION_KEY_WAIT = _env_int("SPECULATION_KEY_WAIT", 250)  # milliseconds
+
+# Canvas image sent to the model: longest side limit (0 = full size), format
+# ('auto' passes acceptable uploads through unchanged, else png, jpeg or webp) and lossy quality
+MODEL_IMAGE_MAX_SIDE = _env_int("MODEL_IMAGE_MAX_SIDE", 0)
+MODEL_IMAGE_FORMAT = os.environ.get("MODEL_IMAGE_FORMAT", "auto").lower()
+MODEL_IMAGE_QUALITY = _env_int("MODEL_IMAGE_QUALITY", 85)
+
+# Default codec for canvas images in draw responses (see utils/codecs.py), e.g. png, png:1, webp, rgba-zlib
+CANVAS_CODEC = os.environ.get("CANVAS_CODEC", "png")
+
+# Render executor: worker processes (0 renders in the request thread), queued
+# batches beyond the busy workers, and seconds before a batch is abandoned
+RENDER_WORKERS = _env_int("RENDER_WORKERS", 0)
+RENDER_QUEUE_SIZE = _env_int("RENDER_QUEUE_SIZE", 64)
+RENDER_TIMEOUT = _env_int("RENDER_TIMEOUT", 30)
+
+# Tiled canvases: tile edge in pixels, threads rendering tiles concurrently (0 renders
+# them in the request thread) and whether new sessions are tiled by default
+TILE_SIZE = _env_int("TILE_SIZE", 256)
+TILE_WORKERS = _env_int("TILE_WORKERS", 4)
+TILED_SESSIONS = _env_int("TILED_SESSIONS", 0) != 0
+
+# Spatial index over drawn elements: grid cell edge in pixels
+SPATIAL_CELL_SIZE = _env_int("SPATIAL_CELL_SIZE", 50)
+
+# Estimated input tokens a generation prompt may use before its spatial context,
+# history and phase-implied instructions are shortened (0 = no limit, only measured)
+PROMPT_TOKEN_BUDGET = _env_int("PROMPT_TOKEN_BUDGET", 0)
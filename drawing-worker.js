@@ -7,61 +7,163 @@
 // Cache for API base URL
 let API_BASE_URL = 'http://127.0.0.1:5000';
 
+// Codecs for images returned while painting interactively (see utils/codecs.py and
+// benchmarks/bench_codecs.py): zlib-framed pixels for patches, fast PNG for full images
+const PATCH_CODEC = 'rgba-zlib:1';
+const IMAGE_CODEC = 'png:1';
+
+/**
+ * Convert a data URI to a Blob without a round trip through the main thread
+ * @param {string} dataUri - Image data URI
+ * @returns {Promise<Blob>} - The encoded image bytes
+ */
+async function dataUriToBlob(dataUri) {
+  const response = await fetch(dataUri);
+  return response.blob();
+}
+
+/**
+ * Convert a Blob to a data URI (the main thread keeps the canvas as one)
+ * @param {Blob} blob - Encoded image
+ * @returns {Promise<string>} - Image data URI
+ */
+function blobToDataUri(blob) {
+  return new Promise((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onload = () => resolve(reader.result);
+    reader.onerror = () => reject(reader.error);
+    reader.readAsDataURL(blob);
+  });
+}
+
+/**
+ * POST a request with the canvas as a binary part instead of a base64 string
+ * The server answers with multipart/form-data: a JSON 'meta' field plus the
+ * full image and patches as binary parts. JSON answers (errors) are handled too.
+ * @param {string} path - API path
+ * @param {Object} payload - Request fields other than the canvas
+ * @param {string} imageData - Current canvas data URI (optional)
+ * @returns {Promise<Object>} - { meta, form } where form holds the binary parts
+ */
+async function postBinary(path, payload, imageData) {
+  const body = new FormData();
+  body.append('payload', JSON.stringify(payload));
+  if (imageData) {
+    body.append('image', await dataUriToBlob(imageData), 'canvas.png');
+  }
+
+  const response = await fetch(`${API_BASE_URL}${path}`, {
+    method: 'POST',
+    headers: { 'Accept': 'multipart/form-data, application/json;q=0.9' },
+    body: body
+  });
+
+  const contentType = response.headers.get('Content-Type') || '';
+  let meta, form = null;
+  if (contentType.startsWith('multipart/form-data')) {
+    form = await response.formData();
+    meta = JSON.parse(form.get('meta'));
+  } else {
+    meta = await response.json();
+  }
+
+  if (meta.error) {
+    throw new Error(meta.error);
+  }
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`);
+  }
+  return { meta, form };
+}
+
+/**
+ * Resolve the binary parts of a draw response
+ * Patches are decoded to ImageBitmaps here, off the main thread, and the full
+ * image (if any) is turned back into the data URI the main thread keeps.
+ * @param {Object} meta - JSON metadata from the response
+ * @param {FormData} form - Binary parts, or null for a JSON response
+ * @returns {Promise<Object>} - { imageData, patches, bitmaps }
+ */
+async function resolveCanvasParts(meta, form) {
+  let imageData = meta.image_data;
+  let patches = meta.patches;
+  const bitmaps = [];
+
+  if (form && meta.image_part) {
+    imageData = await blobToDataUri(form.get(meta.image_part));
+  }
+  if (form && patches) {
+    patches = await Promise.all(patches.map(async patch => {
+      const blob = form.get(patch.part);
+      if (patch.format === 'rgba') {
+        const bytes = new Uint8ClampedArray(await blob.arrayBuffer());
+        return { ...patch, pixels: bytes };
+      }
+      if (patch.format.startsWith('rgba-zlib')) {
+        const inflated = blob.stream().pipeThrough(new DecompressionStream('deflate'));
+        const bytes = new Uint8ClampedArray(await new Response(inflated).arrayBuffer());
+        return { ...patch, pixels: bytes };
+      }
+      const bitmap = await createImageBitmap(blob);
+      bitmaps.push(bitmap);
+      return { ...patch, bitmap: bitmap };
+    }));
+  }
+  return { imageData, patches, bitmaps };
+}
+
 /**
  * Process a single drawing command
+ * The server answers with dirty-rectangle patches when the command only
+ * touches a small part of the canvas, otherwise with the full image.
  * @param {Object} command - The drawing command to process
  * @param {string} imageData - The current image data URI
- * @returns {Promise} - Promise that resolves with the updated image data
+ * @returns {Promise} - Promise that resolves with the image data or patches
  */
 async function processCommand(command, imageData) {
   try {
-    const response = await fetch(`${API_BASE_URL}/draw_command`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ command: command, image_data: imageData })
-    });
-
-    if (!response.ok) {
-      throw new Error(`HTTP error! status: ${response.status}`);
-    }
-
-    const result = await response.json();
-    
-    if (result.error) {
-      throw new Error(result.error);
-    }
-    
-    return result.image_data;
+    // Fast codecs: a few more bytes, several times less encode time
+    const { meta, form } = await postBinary('/draw_command', {
+      command: command,
+      response_mode: 'patch',
+      patch_format: PATCH_CODEC,
+      codec: IMAGE_CODEC
+    }, imageData);
+    return resolveCanvasParts(meta, form);
   } catch (error) {
     console.error('Worker: Error processing command:', error);
     throw error;
   }
 }
 
+/**
+ * Process an ordered list of drawing commands in a single request
+ * @param {Array} commands - The drawing commands to process, in order
+ * @param {string} imageData - The current image data URI
+ * @returns {Promise} - Promise that resolves with the updated image data and per-command results
+ */
+async function processCommands(commands, imageData) {
+  try {
+    const { meta, form } = await postBinary('/draw_commands', { commands: commands }, imageData);
+    const parts = await resolveCanvasParts(meta, form);
+    return { ...meta, image_data: parts.imageData };
+  } catch (error) {
+    console.error('Worker: Error processing commands:', error);
+    throw error;
+  }
+}
+
 /**
  * Get commands from the AI for a specific phase/part
+ * The canvas is uploaded as a binary part; the commands come back as JSON.
  * @param {Object} params - Parameters for the AI command generation
  * @returns {Promise} - Promise that resolves with the AI commands and phase info
  */
 async function getCommands(params) {
   try {
-    const response = await fetch(`${API_BASE_URL}/get_commands`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify(params)
-    });
-
-    if (!response.ok) {
-      throw new Error(`HTTP error! status: ${response.status}`);
-    }
-
-    const result = await response.json();
-    
-    if (result.error) {
-      throw new Error(result.error);
-    }
-    
-    return result;
+    const { current_image, ...payload } = params;
+    const { meta } = await postBinary('/get_commands', payload, current_image);
+    return meta;
   } catch (error) {
     console.error('Worker: Error getting commands:', error);
     throw error;
@@ -82,12 +184,26 @@ self.onmessage = async function(e) {
         
       case 'process_command':
         const { command, imageData } = data;
-        const updatedImageData = await processCommand(command, imageData);
+        const processed = await processCommand(command, imageData);
+        // Hand the decoded bitmaps over without copying them
         self.postMessage({ 
           type: 'command_processed',
           data: {
             command,
-            imageData: updatedImageData
+            imageData: processed.imageData,
+            patches: processed.patches
+          }
+        }, processed.bitmaps);
+        break;
+        
+      case 'process_commands':
+        const batchResult = await processCommands(data.commands, data.imageData);
+        self.postMessage({
+          type: 'commands_processed',
+          data: {
+            commands: data.commands,
+            imageData: batchResult.image_data,
+            results: batchResult.results
           }
         });
         break;
@@ -2,9 +2,11 @@
 Implementation of different drawing actions.
 """
 
-import random
-from PIL import ImageDraw
+import numpy as np
+from PIL import Image, ImageDraw
 from drawing.brushes import get_brush_by_type
+from drawing.textures import is_textured, texture_fill
+from utils.hashing import command_seed
 
 # Color mapping for named colors
 COLOR_MAP = {
@@ -48,6 +50,22 @@ def parse_color(color):
     # Default to black if invalid
     return (0, 0, 0, 255)
 
+def command_rng(command):
+    """
+    Create the local random generator for a drawing command.
+
+    Every random choice an action makes comes from this generator, seeded
+    with the command's 'seed' field or a hash of the command, so the same
+    command always renders the same pixels.
+
+    Args:
+        command (dict): Drawing command
+
+    Returns:
+        numpy.random.Generator: Seeded generator
+    """
+    return np.random.default_rng(command_seed(command))
+
 def parse_points(points_data):
     """
     Parse points data from various formats.
@@ -84,8 +102,6 @@ def draw_polyline(img, command):
     Returns:
         PIL.Image: The modified image
     """
-    d = ImageDraw.Draw(img)
-    
     points = parse_points(command.get('points', []))
     if len(points) <= 1:
         return img
@@ -98,7 +114,7 @@ def draw_polyline(img, command):
     
     # Get the appropriate brush function and use it
     brush_func = get_brush_by_type(brush_type)
-    brush_func(d, points, color, width, texture, pressure)
+    brush_func(img, points, color, width, texture, pressure, rng=command_rng(command))
     
     return img
 
@@ -173,17 +189,9 @@ def draw_rect(img, command):
     fill = command.get('fill', False)
     texture = command.get('texture', 'smooth')
     
-    if texture == 'rough' and fill:
+    if is_textured(texture) and fill:
         # Create textured fill with slightly varied colors
-        for y in range(int(y0), int(y1), 2):
-            for x in range(int(x0), int(x1), 2):
-                # Vary the color slightly for texture
-                r, g, b, a = color if len(color) == 4 else (*color, 255)
-                variation = random.uniform(0.9, 1.1)
-                r = min(255, max(0, int(r * variation)))
-                g = min(255, max(0, int(g * variation)))
-                b = min(255, max(0, int(b * variation)))
-                d.point((x, y), fill=(r, g, b, a))
+        texture_fill(img, (x0, y0, x1, y1), color, texture, rng=command_rng(command))
     else:
         # Use standard rectangle
         if fill:
@@ -217,19 +225,10 @@ def draw_circle(img, command):
     x0, y0 = x - radius, y - radius
     x1, y1 = x + radius, y + radius
     
-    if texture == 'rough' and fill:
-        # Create a textured fill for circle
-        for y_pos in range(int(y0), int(y1), 2):
-            for x_pos in range(int(x0), int(x1), 2):
-                # Check if point is inside circle
-                if ((x_pos - x)**2 + (y_pos - y)**2) <= radius**2:
-                    # Vary the color slightly for texture
-                    r, g, b, a = color if len(color) == 4 else (*color, 255)
-                    variation = random.uniform(0.9, 1.1)
-                    r = min(255, max(0, int(r * variation)))
-                    g = min(255, max(0, int(g * variation)))
-                    b = min(255, max(0, int(b * variation)))
-                    d.point((x_pos, y_pos), fill=(r, g, b, a))
+    if is_textured(texture) and fill:
+        # Create a textured fill masked to the circle
+        texture_fill(img, (x0, y0, x1, y1), color, texture, circle=(x, y, radius),
+                     rng=command_rng(command))
     else:
         # Use standard circle
         if fill:
@@ -263,51 +262,117 @@ def erase_area(img, command):
     
     return img
 
+# sRGB (D65) to XYZ conversion matrix and reference white for Lab distances
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+def rgb_to_lab(rgb):
+    """
+    Convert sRGB colors to CIE Lab.
+
+    Args:
+        rgb (numpy.ndarray): Array of shape (..., 3) with values in 0-255
+
+    Returns:
+        numpy.ndarray: Lab values with the same leading shape
+    """
+    c = np.asarray(rgb, dtype=np.float32) / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = (c @ _RGB_TO_XYZ.T) / _D65_WHITE
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    l = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+    return np.stack([l, a, b], axis=-1)
+
+def box_distance(pixels, target):
+    """Largest per-channel difference (the classic modify_color test)"""
+    diff = np.abs(pixels - target)
+    # Channel-wise maximum is much faster than reducing over the short last axis
+    return np.maximum(np.maximum(diff[..., 0], diff[..., 1]), diff[..., 2])
+
+def euclidean_distance(pixels, target):
+    """Straight-line distance in RGB space"""
+    diff = pixels - target
+    return np.sqrt(diff[..., 0] ** 2 + diff[..., 1] ** 2 + diff[..., 2] ** 2)
+
+def lab_distance(pixels, target):
+    """Perceptual CIE76 delta E"""
+    return euclidean_distance(rgb_to_lab(pixels), rgb_to_lab(target))
+
+# Color distance metrics for modify_color
+COLOR_METRICS = {
+    'box': box_distance,
+    'euclidean': euclidean_distance,
+    'lab': lab_distance,
+}
+
 def modify_color(img, command):
     """
     Modify colors in a circular area.
-    
+
+    Pixels within `tolerance` of the target color (measured with `metric`:
+    'box', 'euclidean' or 'lab') are replaced with the new color, keeping
+    their alpha. With `falloff` > 0 the outer fraction of the radius blends
+    gradually into the original colors instead of ending in a hard edge.
+
     Args:
         img (PIL.Image): Image to draw on
         command (dict): Modify color command parameters
-        
+
     Returns:
         PIL.Image: The modified image
     """
     target_color = command.get('target_color', '')
     new_color = command.get('new_color', '')
-    area_x = command.get('area_x', 0)
-    area_y = command.get('area_y', 0)
-    radius = command.get('radius', 50)
-    
+    area_x = int(command.get('area_x', 0))
+    area_y = int(command.get('area_y', 0))
+    radius = int(command.get('radius', 50))
+    tolerance = float(command.get('tolerance', 30))
+    metric = COLOR_METRICS.get(command.get('metric', 'box'), box_distance)
+    falloff = min(1.0, max(0.0, float(command.get('falloff', 0))))
+
     if not target_color or not new_color:
         return img
-        
-    # Convert colors to RGB tuples
-    target_color = parse_color(target_color)[:3]  # Only use RGB components
-    new_color = parse_color(new_color)[:3]
-    
-    # Get pixel data
-    pixel_data = img.load()
+
+    # Convert colors to RGB arrays
+    target_color = np.array(parse_color(target_color)[:3], dtype=np.float32)  # Only use RGB components
+    new_color = np.array(parse_color(new_color)[:3], dtype=np.float32)
+
+    # Define the area to modify (bounding box of the circle, clipped to the canvas)
     width, height = img.size
-    
-    # Define the area to modify (circular)
-    for x in range(max(0, area_x - radius), min(width, area_x + radius)):
-        for y in range(max(0, area_y - radius), min(height, area_y + radius)):
-            # Check if point is in the circle
-            if ((x - area_x) ** 2 + (y - area_y) ** 2) <= radius ** 2:
-                pixel = pixel_data[x, y]
-                # Check if this pixel is close to the target color
-                if (len(pixel) >= 3 and 
-                    abs(pixel[0] - target_color[0]) < 30 and 
-                    abs(pixel[1] - target_color[1]) < 30 and 
-                    abs(pixel[2] - target_color[2]) < 30):
-                    
-                    # Preserve alpha if exists
-                    alpha = pixel[3] if len(pixel) > 3 else 255
-                    new_pixel = new_color + (alpha,)
-                    pixel_data[x, y] = new_pixel
-    
+    left, right = max(0, area_x - radius), min(width, area_x + radius)
+    top, bottom = max(0, area_y - radius), min(height, area_y + radius)
+    if left >= right or top >= bottom:
+        return img
+
+    region = np.array(img.crop((left, top, right, bottom)))
+    pixels = region[..., :3].astype(np.float32)
+
+    # Distance of every pixel from the circle center
+    ys = np.arange(top, bottom, dtype=np.float32)[:, None] - area_y
+    xs = np.arange(left, right, dtype=np.float32)[None, :] - area_x
+    center_dist = np.sqrt(xs ** 2 + ys ** 2)
+
+    # Check which pixels are in the circle and close to the target color
+    mask = (center_dist <= radius) & (metric(pixels, target_color) < tolerance)
+    if not mask.any():
+        return img
+
+    # Replace colors, preserving alpha
+    if falloff > 0 and radius > 0:
+        # Blend weight: 1 inside, ramping down to 0 across the falloff band
+        weight = np.clip((radius - center_dist[mask]) / (falloff * radius), 0.0, 1.0)[:, None]
+        blended = pixels[mask] * (1 - weight) + new_color * weight
+        region[mask, :3] = np.rint(blended).astype(np.uint8)
+    else:
+        region[mask, :3] = new_color.astype(np.uint8)
+    img.paste(Image.fromarray(region), (left, top))
+
     return img
 
 def enhance_detail(img, command):
@@ -340,10 +405,12 @@ def enhance_detail(img, command):
     elif technique == 'sharpen':
         # Simulate sharpening by adding small contrasting dots
         color = color[:3] + (100,)  # Semi-transparent
-        for _ in range(int(radius * 0.8)):
-            dot_x = x + random.uniform(-radius, radius)
-            dot_y = y + random.uniform(-radius, radius)
-            dot_size = random.uniform(1, 3)
+        rng = command_rng(command)
+        count = max(0, int(radius * 0.8))
+        dots_x = x + rng.uniform(-radius, radius, count)
+        dots_y = y + rng.uniform(-radius, radius, count)
+        dot_sizes = rng.uniform(1, 3, count)
+        for dot_x, dot_y, dot_size in zip(dots_x.tolist(), dots_y.tolist(), dot_sizes.tolist()):
             d.ellipse((dot_x - dot_size, dot_y - dot_size, 
                       dot_x + dot_size, dot_y + dot_size), 
                       fill=color)
@@ -369,8 +436,8 @@ def soften(img, command):
     
     # Simulate softening by adding very transparent overlay
     soft_color = (255, 255, 255, 20)  # Very transparent white
-    for i in range(10):
-        blur_radius = random.uniform(radius * 0.5, radius * 1.2)
+    rng = command_rng(command)
+    for blur_radius in rng.uniform(radius * 0.5, radius * 1.2, 10).tolist():
         d.ellipse((x - blur_radius, y - blur_radius, 
                   x + blur_radius, y + blur_radius), 
                   fill=soft_color)
@@ -0,0 +1,186 @@
+"""
+Bounding boxes of the pixels each drawing action can modify.
+
+Boxes use PIL crop conventions: (left, top, right, bottom) with the right and
+bottom edges exclusive. Every function returns a conservative box (it may be
+larger than the pixels that actually changed, never smaller) or None when
+the command cannot touch the canvas.
+"""
+
+import math
+from drawing.actions import parse_points
+
+def _num(value, default=0):
+    """Coerce a command parameter to float, falling back to default"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float(default)
+
+def _box(x0, y0, x1, y1, pad=0):
+    """Build an integer box around the given float extents"""
+    left, right = sorted((x0, x1))
+    top, bottom = sorted((y0, y1))
+    return (int(math.floor(left - pad)), int(math.floor(top - pad)),
+            int(math.ceil(right + pad)) + 1, int(math.ceil(bottom + pad)) + 1)
+
+def _points_box(command, pad):
+    points = parse_points(command.get('points', []))
+    if len(points) <= 1:
+        return None
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return _box(min(xs), min(ys), max(xs), max(ys), pad)
+
+def polyline_bounds(command, size):
+    """Bounds of a brush stroke, padded for brush width, jitter and splatter spread"""
+    width = _num(command.get('width', 2), 2)
+    # Flat brush stamps reach 0.75 * width * 1.2 (rough) along the stroke,
+    # splatter reaches width / 2 offset plus width / 2 dot size
+    return _points_box(command, width * 1.5 + 2)
+
+def erase_bounds(command, size):
+    """Bounds of an eraser line"""
+    width = _num(command.get('width', 10), 10)
+    return _points_box(command, width / 2 + 1)
+
+def fill_area_bounds(command, size):
+    """A flood fill can reach any pixel connected to the seed point"""
+    return (0, 0, size[0], size[1])
+
+def rect_bounds(command, size):
+    """Bounds of a rectangle, including its outline width"""
+    width = _num(command.get('width', 2), 2)
+    return _box(_num(command.get('x0', 0)), _num(command.get('y0', 0)),
+                _num(command.get('x1', 100), 100), _num(command.get('y1', 100), 100),
+                width)
+
+def circle_bounds(command, size):
+    """Bounds of a circle, including its outline width"""
+    x = _num(command.get('x', 100), 100)
+    y = _num(command.get('y', 100), 100)
+    radius = abs(_num(command.get('radius', 50), 50))
+    width = _num(command.get('width', 2), 2)
+    return _box(x - radius, y - radius, x + radius, y + radius, width)
+
+def erase_area_bounds(command, size):
+    """Bounds of an erased rectangle"""
+    return _box(_num(command.get('x0', 0)), _num(command.get('y0', 0)),
+                _num(command.get('x1', 100), 100), _num(command.get('y1', 100), 100))
+
+def modify_color_bounds(command, size):
+    """Bounds of the circular recolor area"""
+    x = _num(command.get('area_x', 0))
+    y = _num(command.get('area_y', 0))
+    radius = abs(_num(command.get('radius', 50), 50))
+    return _box(x - radius, y - radius, x + radius, y + radius)
+
+def enhance_detail_bounds(command, size):
+    """Bounds of a highlight or of the scattered sharpening dots"""
+    x = _num(command.get('x', 100), 100)
+    y = _num(command.get('y', 100), 100)
+    radius = abs(_num(command.get('radius', 20), 20))
+    # Sharpening dots are scattered up to radius away and are up to 3px in size
+    return _box(x - radius, y - radius, x + radius, y + radius, 3)
+
+def soften_bounds(command, size):
+    """Bounds of the largest softening overlay"""
+    x = _num(command.get('x', 100), 100)
+    y = _num(command.get('y', 100), 100)
+    radius = abs(_num(command.get('radius', 20), 20)) * 1.2
+    return _box(x - radius, y - radius, x + radius, y + radius)
+
+# Bounds functions, keyed like ACTION_MAP
+BOUNDS_MAP = {
+    'draw_polyline': polyline_bounds,
+    'erase': erase_bounds,
+    'fill_area': fill_area_bounds,
+    'draw_rect': rect_bounds,
+    'draw_circle': circle_bounds,
+    'erase_area': erase_area_bounds,
+    'modify_color': modify_color_bounds,
+    'enhance_detail': enhance_detail_bounds,
+    'soften': soften_bounds,
+}
+
+def clip_box(box, size):
+    """
+    Clip a box to the canvas.
+
+    Args:
+        box (tuple): (left, top, right, bottom)
+        size (tuple): Canvas (width, height)
+
+    Returns:
+        tuple: Clipped box, or None if it lies entirely outside the canvas
+    """
+    if box is None:
+        return None
+    left, top = max(0, box[0]), max(0, box[1])
+    right, bottom = min(size[0], box[2]), min(size[1], box[3])
+    if left >= right or top >= bottom:
+        return None
+    return (left, top, right, bottom)
+
+def command_bounds(command, size):
+    """
+    Get the canvas region a command can modify.
+
+    Unknown actions can't be applied, so they get None; malformed parameters
+    of a known action conservatively cover the whole canvas.
+
+    Args:
+        command (dict): Drawing command
+        size (tuple): Canvas (width, height)
+
+    Returns:
+        tuple: Clipped (left, top, right, bottom) box, or None if nothing can change
+               (including unknown or missing actions)
+    """
+    action = command.get('action', '') if isinstance(command, dict) else ''
+    bounds_func = BOUNDS_MAP.get(action)
+    if bounds_func is None:
+        return None
+    try:
+        box = bounds_func(command, size)
+    except Exception:
+        box = (0, 0, size[0], size[1])
+    return clip_box(box, size)
+
+def box_area(box):
+    """Area of a box in pixels"""
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+def boxes_touch(a, b):
+    """True if two boxes overlap or share an edge"""
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def union_box(a, b):
+    """Smallest box containing both boxes"""
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def merge_boxes(boxes):
+    """
+    Merge overlapping boxes into disjoint regions.
+
+    Args:
+        boxes (list): Boxes, entries may be None
+
+    Returns:
+        list: Non-overlapping boxes covering every input box
+    """
+    regions = []
+    for box in boxes:
+        if box is None:
+            continue
+        # Keep absorbing regions until the merged box no longer touches any of them
+        merged = True
+        while merged:
+            merged = False
+            for i, region in enumerate(regions):
+                if boxes_touch(box, region):
+                    box = union_box(box, regions.pop(i))
+                    merged = True
+                    break
+        regions.append(box)
+    return regions
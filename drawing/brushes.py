@@ -2,22 +2,55 @@
 Brush implementations for different artistic styles and effects.
 """
 
-import random
 import math
+import numpy as np
 from PIL import ImageDraw
+from drawing.dabs import StrokeBuffer
 
-def draw_round_brush(d, points, color, width, texture, pressure):
+# Edge hardness of round brush dabs per texture
+ROUND_BRUSH_HARDNESS = {
+    'smooth': 0.9,
+    'rough': 0.6,
+}
+
+def draw_round_brush(img, points, color, width, texture, pressure, rng=None):
     """
     Draw with a round brush that creates tapered, organic strokes.
+
+    Dabs are stamped along the stroke into a stroke buffer and the whole
+    stroke is alpha-composited onto the image once, so semi-transparent
+    strokes blend with the canvas instead of overwriting it.
     
     Args:
-        d (PIL.ImageDraw): The drawing context
+        img (PIL.Image): The RGBA image to draw on
         points (list): List of (x, y) coordinates
         color (tuple): RGBA color tuple
         width (int): Base width of the brush
         texture (str): 'smooth' or 'rough'
         pressure (float): Pressure value affecting opacity
+        rng (numpy.random.Generator): Random source for rough texture
     """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    # Adjust opacity based on pressure
+    alpha = color[3] if len(color) == 4 else 255
+    opacity = min(1.0, max(0.0, alpha / 255 * pressure))
+    hardness = ROUND_BRUSH_HARDNESS.get(texture, ROUND_BRUSH_HARDNESS['smooth'])
+
+    # Widest dab: 1.2x width, up to 1.15x more with rough texture, plus jitter
+    pad = width * 0.7 + 3
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    stroke = StrokeBuffer(img.size, (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad))
+    if stroke.empty:
+        return
+
+    # Space dabs by a fraction of the brush size rather than every 2px
+    spacing = max(1.0, width * 0.3)
+
+    # Interpolate dab positions for every segment, then stamp them all at once
+    dab_x, dab_y, dab_width = [], [], []
     for i in range(len(points) - 1):
         # Calculate direction vector
         x1, y1 = points[i]
@@ -26,130 +59,171 @@ def draw_round_brush(d, points, color, width, texture, pressure):
         # Calculate distance between points
         dist = ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5
         
-        # Draw multiple circles along the path for organic feel
-        steps = max(3, int(dist / 2))
-        for j in range(steps + 1):
-            # Interpolate position
-            t = j / steps
-            x = x1 + (x2 - x1) * t
-            y = y1 + (y2 - y1) * t
-            
-            # Vary width slightly for organic feel
-            point_width = width * (0.8 + 0.4 * (1 - abs(t - 0.5) * 2))
-            
-            # Add slight randomness for texture
-            if texture == 'rough':
-                x += random.uniform(-1, 1)
-                y += random.uniform(-1, 1)
-                point_width *= random.uniform(0.85, 1.15)
-            
-            # Adjust opacity based on pressure
-            point_color = list(color)
-            if len(point_color) == 4:  # RGBA
-                point_color[3] = int(point_color[3] * pressure)
-            
-            # Draw the point as a circle
-            d.ellipse((x - point_width/2, y - point_width/2, 
-                      x + point_width/2, y + point_width/2), 
-                      fill=tuple(point_color))
-
-def draw_flat_brush(d, points, color, width, texture, pressure):
+        steps = max(3, int(dist / spacing))
+        t = np.arange(steps + 1) / steps
+        dab_x.append(x1 + (x2 - x1) * t)
+        dab_y.append(y1 + (y2 - y1) * t)
+        
+        # Vary width slightly for organic feel
+        dab_width.append(width * (0.8 + 0.4 * (1 - np.abs(t - 0.5) * 2)))
+
+    dab_x = np.concatenate(dab_x)
+    dab_y = np.concatenate(dab_y)
+    dab_width = np.concatenate(dab_width)
+    
+    # Add slight randomness for texture
+    if texture == 'rough':
+        dab_x += rng.uniform(-1, 1, len(dab_x))
+        dab_y += rng.uniform(-1, 1, len(dab_y))
+        dab_width *= rng.uniform(0.85, 1.15, len(dab_width))
+    
+    # Stamp the dabs into the stroke buffer and composite the stroke once
+    stroke.stamp(dab_x, dab_y, dab_width / 2, opacity, hardness)
+    stroke.composite(img, color)
+
+def flat_brush_stamps(points, width, texture, rng):
+    """
+    Compute the rotated rectangle of every flat brush stamp along a polyline.
+
+    All step positions and corners are generated in one NumPy pass. Stamps
+    are elongated 1.5x along the stroke direction.
+
+    Args:
+        points (list): List of (x, y) coordinates
+        width (int): Base width of the brush
+        texture (str): 'smooth' or 'rough' (rough varies each stamp's width)
+        rng (numpy.random.Generator): Random source for rough texture
+
+    Returns:
+        tuple: (corners, segment) where corners has shape (stamps, 4, 2) and
+               segment gives the index of the segment each stamp belongs to
+    """
+    pts = np.asarray(points, dtype=np.float64)
+    start, end = pts[:-1], pts[1:]
+    delta = end - start
+
+    # Angle of each segment and the number of stamps along it
+    angles = np.arctan2(delta[:, 1], delta[:, 0])
+    lengths = np.hypot(delta[:, 0], delta[:, 1])
+    steps = np.maximum(3, (lengths / 2).astype(np.int64))
+
+    # Interpolate stamp positions: t = j / steps for j in range(steps)
+    segment = np.repeat(np.arange(len(steps)), steps)
+    first = np.cumsum(steps) - steps
+    t = (np.arange(segment.size) - first[segment]) / steps[segment]
+    centers = start[segment] + delta[segment] * t[:, None]
+
+    # Create brush width, with variation for rough texture
+    half_width = np.full(segment.size, width / 2)
+    if texture == 'rough':
+        half_width *= rng.uniform(0.8, 1.2, segment.size)
+
+    # Corners of the unrotated stamp, relative to its center
+    half_long = half_width * 1.5  # Slightly elongated
+    offsets = np.stack([
+        np.stack([-half_long, -half_width], axis=-1),
+        np.stack([half_long, -half_width], axis=-1),
+        np.stack([half_long, half_width], axis=-1),
+        np.stack([-half_long, half_width], axis=-1),
+    ], axis=1)
+
+    # Rotate the corners into the stroke direction
+    cos = np.cos(angles)[segment][:, None]
+    sin = np.sin(angles)[segment][:, None]
+    corners = np.empty_like(offsets)
+    corners[..., 0] = offsets[..., 0] * cos - offsets[..., 1] * sin + centers[:, None, 0]
+    corners[..., 1] = offsets[..., 0] * sin + offsets[..., 1] * cos + centers[:, None, 1]
+    return corners, segment
+
+def draw_flat_brush(img, points, color, width, texture, pressure, rng=None):
     """
     Draw with a flat brush that creates angular, directional strokes.
+
+    With a smooth texture every stamp in a segment has the same size and
+    orientation, so their union is drawn as a single swept rectangle per
+    segment instead of one polygon per stamp.
     
     Args:
-        d (PIL.ImageDraw): The drawing context
+        img (PIL.Image): The RGBA image to draw on
         points (list): List of (x, y) coordinates
         color (tuple): RGBA color tuple
         width (int): Base width of the brush
         texture (str): 'smooth' or 'rough'
         pressure (float): Pressure value affecting opacity
+        rng (numpy.random.Generator): Random source for rough texture
     """
-    for i in range(len(points) - 1):
-        x1, y1 = points[i]
-        x2, y2 = points[i+1]
-        
-        # Calculate angle of line
-        angle = math.atan2(y2 - y1, x2 - x1)
-        
-        # Calculate perpendicular angle for brush width
-        perp_angle = angle + math.pi/2
-        
-        # Draw multiple overlapping rectangles
-        steps = max(3, int(((x2 - x1)**2 + (y2 - y1)**2)**0.5 / 2))
-        for j in range(steps):
-            # Interpolate position
-            t = j / steps
-            x = x1 + (x2 - x1) * t
-            y = y1 + (y2 - y1) * t
-            
-            # Create brush width with perpendicular offset
-            half_width = width / 2
-            if texture == 'rough':
-                half_width *= random.uniform(0.8, 1.2)
-            
-            # Define the rectangle for the brush stamp
-            rect_width = half_width * 2 * 1.5  # Slightly elongated
-            rect_height = half_width * 2
-            
-            # Apply rotation to the rectangle
-            points_rect = [(x - rect_width/2, y - rect_height/2),
-                         (x + rect_width/2, y - rect_height/2),
-                         (x + rect_width/2, y + rect_height/2),
-                         (x - rect_width/2, y + rect_height/2)]
-            
-            # Rotate points
-            rotated_points = []
-            for px, py in points_rect:
-                px_rel, py_rel = px - x, py - y
-                px_rot = px_rel * math.cos(angle) - py_rel * math.sin(angle)
-                py_rot = px_rel * math.sin(angle) + py_rel * math.cos(angle)
-                rotated_points.append((px_rot + x, py_rot + y))
-            
-            # Adjust opacity based on pressure
-            point_color = list(color)
-            if len(point_color) == 4:  # RGBA
-                point_color[3] = int(point_color[3] * pressure)
-            
-            # Draw the polygon
-            d.polygon(rotated_points, fill=tuple(point_color))
-
-def draw_splatter_brush(d, points, color, width, texture, pressure):
+    if rng is None:
+        rng = np.random.default_rng()
+    d = ImageDraw.Draw(img)
+
+    # Adjust opacity based on pressure
+    point_color = list(color)
+    if len(point_color) == 4:  # RGBA
+        point_color[3] = int(point_color[3] * pressure)
+    point_color = tuple(point_color)
+
+    corners, segment = flat_brush_stamps(points, width, texture, rng)
+
+    if texture == 'rough':
+        # Stamps differ in width, draw each one
+        for stamp in corners.tolist():
+            d.polygon([tuple(corner) for corner in stamp], fill=point_color)
+        return
+
+    # Sweep: back edge of the first stamp to front edge of the last one
+    last = np.append(segment[1:] != segment[:-1], True)
+    first = np.insert(last[:-1], 0, True)
+    for head, tail in zip(corners[first].tolist(), corners[last].tolist()):
+        d.polygon([tuple(head[0]), tuple(tail[1]), tuple(tail[2]), tuple(head[3])], fill=point_color)
+
+def draw_splatter_brush(img, points, color, width, texture, pressure, rng=None):
     """
     Draw with a splatter brush that creates scattered, spray-like effects.
+
+    Dot positions, sizes and opacities for the whole stroke are generated
+    in one batch from the random generator.
     
     Args:
-        d (PIL.ImageDraw): The drawing context
+        img (PIL.Image): The RGBA image to draw on
         points (list): List of (x, y) coordinates
         color (tuple): RGBA color tuple
         width (int): Base width of the brush
         texture (str): Not used for splatter brush
         pressure (float): Pressure value affecting opacity
+        rng (numpy.random.Generator): Random source for dot placement
     """
-    for i in range(len(points) - 1):
-        x1, y1 = points[i]
-        x2, y2 = points[i+1]
-        distance = ((x2 - x1)**2 + (y2 - y1)**2)**0.5
-        dots = int(distance * width / 10)  # Number of splatter dots
-        
-        for _ in range(dots):
-            # Random position along the line with some deviation
-            t = random.random()
-            x = x1 + (x2 - x1) * t + random.uniform(-width/2, width/2)
-            y = y1 + (y2 - y1) * t + random.uniform(-width/2, width/2)
-            
-            # Random dot size
-            dot_size = random.uniform(1, width/2)
-            
-            # Adjust opacity based on pressure and random factor
-            point_color = list(color)
-            if len(point_color) == 4:  # RGBA
-                point_color[3] = int(point_color[3] * pressure * random.uniform(0.5, 1))
-            
-            # Draw the dot
-            d.ellipse((x - dot_size, y - dot_size, 
-                      x + dot_size, y + dot_size), 
-                      fill=tuple(point_color))
+    if rng is None:
+        rng = np.random.default_rng()
+    d = ImageDraw.Draw(img)
+
+    pts = np.asarray(points, dtype=np.float64)
+    start, delta = pts[:-1], pts[1:] - pts[:-1]
+    distance = np.hypot(delta[:, 0], delta[:, 1])
+    dots = (distance * width / 10).astype(np.int64)  # Number of splatter dots per segment
+    segment = np.repeat(np.arange(len(dots)), dots)
+    count = segment.size
+    if count == 0:
+        return
+
+    # Random position along the line with some deviation
+    t = rng.random(count)
+    xy = start[segment] + delta[segment] * t[:, None] + rng.uniform(-width/2, width/2, (count, 2))
+    
+    # Random dot size
+    dot_size = rng.uniform(min(1, width/2), max(1, width/2), count)
+    
+    # Adjust opacity based on pressure and random factor
+    if len(color) == 4:  # RGBA
+        alpha = (color[3] * pressure * rng.uniform(0.5, 1, count)).astype(np.int64)
+    else:
+        alpha = None
+
+    # Draw the dots
+    for k, ((x, y), size) in enumerate(zip(xy.tolist(), dot_size.tolist())):
+        point_color = color[:3] + (int(alpha[k]),) if alpha is not None else color
+        d.ellipse((x - size, y - size, 
+                  x + size, y + size), 
+                  fill=tuple(point_color))
 
 def get_brush_by_type(brush_type):
     """
@@ -0,0 +1,204 @@
+"""
+Content-addressed cache of rendered drawing results.
+
+Entries are keyed by a hash of the decoded canvas pixels plus the
+canonicalized command, so a retried or replayed (canvas, command) pair skips
+both the drawing action and the PNG encode. Rendering is deterministic
+(see command_rng), which is what makes this safe.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from utils.hashing import canonical_json, stable_digest
+from config.settings import RENDER_CACHE_MAX_BYTES, RENDER_CACHE_DIR, RENDER_CACHE_DISK_MAX_BYTES
+
+def canvas_digest(img):
+    """
+    Hash the decoded pixels of a canvas.
+
+    Args:
+        img (PIL.Image): Canvas image
+
+    Returns:
+        str: Hex digest covering mode, size and pixel data
+    """
+    header = f"{img.mode}:{img.width}x{img.height}:".encode()
+    return stable_digest(header + img.tobytes())
+
+class RenderCache:
+    """
+    Byte-bounded LRU cache of rendered results with optional disk spill.
+
+    Values are strings (data URIs or serialized payloads). Entries evicted
+    from memory are written to `spill_dir` when one is configured, and read
+    back (and promoted to memory) on a later hit.
+    """
+
+    def __init__(self, max_bytes=RENDER_CACHE_MAX_BYTES, spill_dir=RENDER_CACHE_DIR,
+                 disk_max_bytes=RENDER_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def make_key(self, img, request):
+        """
+        Build the cache key for a canvas and a render request.
+
+        Args:
+            img (PIL.Image): Canvas before rendering
+            request: JSON-compatible description of what is rendered
+                     (a command, or a command list with response options)
+
+        Returns:
+            str: Cache key
+        """
+        return canvas_digest(img) + stable_digest(canonical_json(request))
+
+    def get(self, key):
+        """
+        Look up a cached result.
+
+        Args:
+            key (str): Cache key from make_key
+
+        Returns:
+            str: Cached value, or None on a miss
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = self._read_spilled(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        Store a rendered result.
+
+        Args:
+            key (str): Cache key from make_key
+            value (str): Result to cache
+        """
+        size = len(value)
+        if size > self.max_bytes:
+            return
+
+        spilled = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = value
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+                spilled.append((evicted_key, evicted))
+
+        for evicted_key, evicted in spilled:
+            self._spill(evicted_key, evicted)
+
+    def stats(self):
+        """
+        Report cache counters for monitoring.
+
+        Returns:
+            dict: Hit/miss counters, hit rate and memory usage
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'spill_dir': self.spill_dir,
+            }
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, key)
+
+    def _spill(self, key, value):
+        """Write an evicted entry to the spill directory, trimming it if needed"""
+        if not self.spill_dir:
+            return
+        try:
+            with open(self._spill_path(key), 'w', encoding='utf-8') as f:
+                f.write(value)
+            self._trim_spill()
+        except OSError as e:
+            print(f"Render cache spill failed: {e}")
+
+    def _read_spilled(self, key):
+        if not self.spill_dir:
+            return None
+        try:
+            with open(self._spill_path(key), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _trim_spill(self):
+        """Delete the oldest spilled entries until the directory fits its budget"""
+        files = []
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+# Process-wide render cache shared by all routes
+render_cache = RenderCache()
+
+def get_render_cache():
+    """
+    Get the process-wide render cache.
+
+    Returns:
+        RenderCache: The shared render cache
+    """
+    return render_cache
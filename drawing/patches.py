@@ -0,0 +1,91 @@
+"""
+Dirty-rectangle tracking so responses can carry only the changed pixels.
+"""
+
+from PIL import ImageChops
+from drawing.bounds import command_bounds, merge_boxes, box_area
+from utils.image import image_to_patch
+from config.settings import PATCH_MAX_FRACTION
+
+def changed_box(before, after):
+    """
+    Find the bounding box of pixels that differ between two same-sized images.
+
+    Args:
+        before (PIL.Image): Original pixels
+        after (PIL.Image): Updated pixels
+
+    Returns:
+        tuple: Box relative to the images, or None if they are identical
+    """
+    diff = ImageChops.difference(before, after)
+    # Check every band; RGBA getbbox() alone would only look at alpha
+    boxes = [box for box in (band.getbbox() for band in diff.split()) if box]
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+def diff_patches(before, after, patch_format='png'):
+    """
+    Express the difference between two canvases as patches.
+
+    Args:
+        before (PIL.Image): Canvas the client currently shows
+        after (PIL.Image): Updated canvas
+        patch_format (str): 'png' or 'rgba'
+
+    Returns:
+        list: Zero or one patch dicts, or None if the change is too large for patches to pay off
+    """
+    changed = changed_box(before, after)
+    if changed is None:
+        return []
+    if box_area(changed) > before.width * before.height * PATCH_MAX_FRACTION:
+        return None
+    return [image_to_patch(after, changed, patch_format)]
+
+class PatchTracker:
+    """
+    Remember the regions a batch of commands may touch, then extract the
+    pixels that actually changed as cropped patches.
+
+    Create the tracker before applying the commands and call `collect` with
+    the updated image afterwards.
+    """
+
+    def __init__(self, img, commands):
+        self.size = img.size
+        self.regions = merge_boxes([command_bounds(command, img.size) for command in commands])
+
+        # Don't bother snapshotting when a full image would be sent anyway
+        canvas_area = self.size[0] * self.size[1]
+        self.fits = sum(box_area(region) for region in self.regions) <= canvas_area * PATCH_MAX_FRACTION
+        self.before = [img.crop(region) for region in self.regions] if self.fits else []
+
+    def collect(self, img, patch_format='png'):
+        """
+        Extract changed regions from the updated image.
+
+        Args:
+            img (PIL.Image): Image after the commands were applied
+            patch_format (str): 'png' or 'rgba'
+
+        Returns:
+            list: Patch dicts with offsets, or None when the changes cover so
+                  much of the canvas that a full image is cheaper
+        """
+        if not self.fits:
+            return None
+
+        patches = []
+        for region, before in zip(self.regions, self.before):
+            after = img.crop(region)
+            # Tighten the conservative bounds to the pixels that really changed
+            changed = changed_box(before, after)
+            if changed is None:
+                continue
+            box = (region[0] + changed[0], region[1] + changed[1],
+                   region[0] + changed[2], region[1] + changed[3])
+            patches.append(image_to_patch(img, box, patch_format))
+        return patches
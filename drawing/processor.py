@@ -1,43 +1,362 @@
 """
 Main drawing processor for handling drawing commands.
+
+Rendering is pure Python and holds the GIL, so command batches can be
+dispatched to a pool of worker processes by the RenderExecutor. Canvases
+travel through shared memory as raw RGBA pixels; only the commands and the
+per-command results are pickled.
 """
 
+import atexit
+import json
+import multiprocessing
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+
 from PIL import Image
-from utils.image import data_uri_to_image, image_to_data_uri
+from utils.image import data_uri_to_image
+from utils.codecs import encode_image_string
 from drawing.actions import ACTION_MAP
+from drawing.bounds import command_bounds
+from drawing.patches import PatchTracker
+from drawing.cache import get_render_cache
+from config.settings import RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_TIMEOUT
+
+def apply_command(img, command):
+    """
+    Apply a single drawing command to an in-memory image.
+
+    Args:
+        img (PIL.Image): RGBA image to draw on
+        command (dict): Drawing command with action and parameters
+
+    Returns:
+        PIL.Image: The modified image
+
+    Raises:
+        ValueError: If the action is missing or unknown
+    """
+    action = command.get('action', '') if isinstance(command, dict) else ''
+    if not action or action not in ACTION_MAP:
+        raise ValueError(f"Unknown or missing action: {action}")
+
+    action_func = ACTION_MAP[action]
+    return action_func(img, command)
 
-def process_drawing_command(image_data, command):
+def process_drawing_command(image_data, command, codec='png'):
     """
     Process a drawing command and apply it to the image.
-    
+
     Args:
         image_data (str): Data URI of the image
         command (dict): Drawing command with action and parameters
-        
+        codec (str): Codec spec for the updated image (see utils.codecs)
+
     Returns:
-        str: Updated image as data URI
+        str: Updated image as data URI (base64 pixels for raw codecs)
     """
     action = command.get('action', '')
-    
+
     # Skip if no action or unknown action
     if not action or action not in ACTION_MAP:
         print(f"Unknown or missing action: {action}")
         return image_data
-    
+
     try:
         # Convert data URI to image
         img = data_uri_to_image(image_data)
         img = img.convert("RGBA")
-        
+
+        # Identical canvas and command: skip both the action and the encode
+        cache = get_render_cache()
+        if cache.enabled:
+            key = cache.make_key(img, {'command': command, 'codec': codec})
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
         # Process the drawing action
-        action_func = ACTION_MAP[action]
-        img = action_func(img, command)
-        
+        img, results = get_render_executor().apply(img, [command])
+        if results[0]['status'] != 'ok':
+            raise ValueError(results[0]['error'])
+
         # Convert back to data URI
-        updated_image_data = image_to_data_uri(img)
+        updated_image_data = encode_image_string(img, codec)
+        if cache.enabled:
+            cache.put(key, updated_image_data)
         return updated_image_data
-        
+
+    except RenderError:
+        raise
     except Exception as e:
         print(f"Drawing error: {e} for command {action}")
         # Return original image data if there's an error
-        return image_data
\ No newline at end of file
+        return image_data
+
+def apply_commands(img, commands):
+    """
+    Apply an ordered list of drawing commands to the same in-memory image.
+
+    A failing command does not abort the batch: the image is left as it was
+    before that command and processing continues with the next one.
+
+    Args:
+        img (PIL.Image): RGBA image to draw on
+        commands (list): Ordered list of drawing commands
+
+    Returns:
+        tuple: (PIL.Image, list) the final image and one result dict per
+               command with 'index', 'action', 'status', 'bounds' (the
+               region the command may have modified) and, on failure, 'error'
+    """
+    results = []
+
+    for index, command in enumerate(commands):
+        action = command.get('action', '') if isinstance(command, dict) else ''
+        bounds = command_bounds(command, img.size)
+        result = {'index': index, 'action': action, 'status': 'ok',
+                  'bounds': list(bounds) if bounds else None}
+
+        # Keep a copy so a half-applied command can't leak into the canvas
+        snapshot = img.copy()
+        try:
+            img = apply_command(img, command)
+        except Exception as e:
+            print(f"Drawing error: {e} for command {index} ({action})")
+            img = snapshot
+            result['status'] = 'error'
+            result['error'] = str(e)
+
+        results.append(result)
+
+    return img, results
+
+def process_drawing_commands(image_data, commands, patch_format=None, codec='png'):
+    """
+    Process a list of drawing commands with a single decode/encode cycle.
+
+    When a patch format is requested, only the changed regions are encoded
+    and returned as patches; the full image is still returned if the changes
+    cover too much of the canvas for patches to pay off.
+
+    Args:
+        image_data (str): Data URI of the image
+        commands (list): Ordered list of drawing commands
+        patch_format (str): None for a full image, or a codec spec for patches
+        codec (str): Codec spec for a full image (see utils.codecs)
+
+    Returns:
+        dict: 'results' plus either 'image_data' (with its 'codec') or
+              'patches', and the canvas 'width' and 'height'
+    """
+    img = data_uri_to_image(image_data)
+    img = img.convert("RGBA")
+
+    cache = get_render_cache()
+    if cache.enabled:
+        key = cache.make_key(img, {'commands': commands, 'patch_format': patch_format, 'codec': codec})
+        cached = cache.get(key)
+        if cached is not None:
+            return json.loads(cached)
+
+    tracker = PatchTracker(img, commands) if patch_format else None
+    img, results = get_render_executor().apply(img, commands)
+
+    payload = {'results': results}
+    patches = tracker.collect(img, patch_format) if tracker else None
+    if patches is not None:
+        payload['patches'] = patches
+    else:
+        payload['image_data'] = encode_image_string(img, codec)
+        payload['codec'] = codec
+    payload['width'], payload['height'] = img.size
+
+    if cache.enabled:
+        cache.put(key, json.dumps(payload))
+    return payload
+
+# Seconds between checks that a waited-on batch's pool is still running
+RESTART_POLL_INTERVAL = 0.25
+
+class RenderError(Exception):
+    """A batch could not be rendered by the executor"""
+
+class RenderQueueFullError(RenderError):
+    """Every worker is busy and the render queue is at capacity"""
+
+class RenderTimeoutError(RenderError):
+    """A batch did not finish within the render timeout"""
+
+def _render_shared(name, size, commands):
+    """
+    Render a batch in a worker process.
+
+    The canvas is read from and written back to the named shared memory
+    block, which holds `size` RGBA pixels.
+
+    Returns:
+        list: Per-command results from apply_commands
+    """
+    shm = SharedMemory(name)
+    try:
+        nbytes = size[0] * size[1] * 4
+        img = Image.frombytes("RGBA", size, bytes(shm.buf[:nbytes]))
+        img, results = apply_commands(img, commands)
+        shm.buf[:nbytes] = img.convert("RGBA").tobytes()
+        return results
+    finally:
+        shm.close()
+
+class RenderExecutor:
+    """
+    Dispatches command batches to a pool of worker processes.
+
+    With no workers, batches are rendered in the calling thread. Otherwise
+    at most `workers + max_queue` batches are admitted at once; beyond that
+    RenderQueueFullError is raised so callers can shed load. A batch that
+    runs longer than `timeout` seconds raises RenderTimeoutError and the
+    pool is restarted, since a worker can't be stopped mid-command.
+
+    Args:
+        workers (int): Worker processes (0 to render in-process)
+        max_queue (int): Batches that may wait for a free worker
+        timeout (float): Seconds to wait for a batch
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, max_queue=RENDER_QUEUE_SIZE, timeout=RENDER_TIMEOUT):
+        self.workers = max(0, workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue) if self.workers else None
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.active = 0
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def apply(self, img, commands):
+        """
+        Render commands onto an image, in a worker process if the pool is enabled.
+
+        Args:
+            img (PIL.Image): Canvas to draw on (not modified)
+            commands (list): Ordered list of drawing commands
+
+        Returns:
+            tuple: (PIL.Image, list) as returned by apply_commands
+
+        Raises:
+            RenderQueueFullError: If the queue is at capacity
+            RenderTimeoutError: If the batch takes longer than the timeout
+        """
+        if not self.enabled:
+            return apply_commands(img, commands)
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise RenderQueueFullError(f"Render queue is full ({self.workers + self.max_queue} batches in flight)")
+
+        img = img.convert("RGBA")
+        nbytes = img.width * img.height * 4
+        shm = SharedMemory(create=True, size=max(1, nbytes))
+        try:
+            with self._lock:
+                self.submitted += 1
+                self.active += 1
+            shm.buf[:nbytes] = img.tobytes()
+            pool = self._get_pool()
+            pending = pool.apply_async(_render_shared, (shm.name, img.size, commands))
+            results = self._wait(pool, pending)
+            rendered = Image.frombytes("RGBA", img.size, bytes(shm.buf[:nbytes]))
+            with self._lock:
+                self.completed += 1
+            return rendered, results
+        finally:
+            with self._lock:
+                self.active -= 1
+            shm.close()
+            shm.unlink()
+            self._slots.release()
+
+    def _wait(self, pool, pending):
+        """Wait for a batch, giving up if it times out or the pool is restarted under it"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                return pending.get(min(RESTART_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+            except multiprocessing.TimeoutError:
+                pass
+            if self._pool is not pool:
+                raise RenderError("Render pool was restarted while the batch was queued")
+            if time.monotonic() >= deadline:
+                with self._lock:
+                    self.timeouts += 1
+                self._restart()
+                raise RenderTimeoutError(f"Rendering did not finish within {self.timeout}s")
+
+    def stats(self):
+        """
+        Report executor counters for monitoring.
+
+        Returns:
+            dict: Pool size, queue limit and batch counters
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'timeout': self.timeout,
+                'active': self.active,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'restarts': self.restarts,
+            }
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    def _get_pool(self):
+        """Start the worker processes on first use"""
+        with self._lock:
+            if self._pool is None:
+                # Forking a threaded server is unsafe; start workers from a clean process
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._pool = context.Pool(self.workers)
+            return self._pool
+
+    def _restart(self):
+        """Replace the pool after a timeout, killing the stuck worker"""
+        self.shutdown()
+        with self._lock:
+            self.restarts += 1
+
+# Process-wide render executor shared by all routes
+render_executor = RenderExecutor()
+atexit.register(render_executor.shutdown)
+
+def get_render_executor():
+    """
+    Get the process-wide render executor.
+
+    Returns:
+        RenderExecutor: The shared render executor
+    """
+    return render_executor
@@ -0,0 +1,172 @@
+"""
+Command replay engine with periodic checkpoints.
+
+The engine keeps a command history with a movable position. Moving the
+position (undo, redo or seeking to any command) rebuilds the canvas by
+replaying ACTION_MAP actions from the nearest checkpoint, so the cost of a
+jump is bounded by the checkpoint interval rather than the history length.
+Rendering is deterministic (see command_rng), so replays are pixel-exact.
+"""
+
+import json
+import zlib
+
+from PIL import Image
+from drawing.processor import apply_command
+from config.settings import REPLAY_CHECKPOINT_INTERVAL
+
+class Checkpoint:
+    """A zlib-compressed raw RGBA snapshot of the canvas"""
+
+    def __init__(self, img):
+        self.size = img.size
+        self.data = zlib.compress(img.tobytes(), 1)
+
+    def restore(self):
+        """
+        Decompress the snapshot.
+
+        Returns:
+            PIL.Image: The canvas as it was when the checkpoint was taken
+        """
+        return Image.frombytes("RGBA", self.size, zlib.decompress(self.data))
+
+class ReplayEngine:
+    """
+    Canvas history with undo, redo and seek.
+
+    `commands` holds every recorded command; the first `position` of them are
+    reflected in `image`, the rest form the redo tail. Recording new commands
+    discards the redo tail.
+    """
+
+    def __init__(self, image, checkpoint_interval=REPLAY_CHECKPOINT_INTERVAL):
+        self._image = image.convert("RGBA")
+        self._pending = None
+        self.size = self._image.size
+        self.checkpoint_interval = max(1, checkpoint_interval)
+        self.commands = []
+        self.position = 0
+        self.commands_bytes = 0
+        self._command_sizes = []
+        self.checkpoints = {0: Checkpoint(self._image)}
+
+    @property
+    def image(self):
+        """The canvas at the current position"""
+        if self._pending is not None:
+            self._image = self._pending()
+            self._pending = None
+        return self._image
+
+    @property
+    def history(self):
+        """Commands that make up the current canvas"""
+        return self.commands[:self.position]
+
+    @property
+    def can_undo(self):
+        return self.position > 0
+
+    @property
+    def can_redo(self):
+        return self.position < len(self.commands)
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the image, checkpoints and history"""
+        # An image that hasn't been produced yet is held by whoever produces it
+        image_bytes = 0 if self._pending is not None else self.size[0] * self.size[1] * 4
+        checkpoint_bytes = sum(len(checkpoint.data) for checkpoint in self.checkpoints.values())
+        return image_bytes + checkpoint_bytes + self.commands_bytes
+
+    def record(self, commands, image):
+        """
+        Record commands that have already been applied to produce `image`.
+
+        Args:
+            commands (list): Commands applied since the current position
+            image: Canvas after applying them (PIL.Image), or a callable returning
+                   it, called only once the image is needed
+        """
+        self._truncate()
+        for command in commands:
+            size = len(json.dumps(command, default=str))
+            self.commands.append(command)
+            self._command_sizes.append(size)
+            self.commands_bytes += size
+        self.position = len(self.commands)
+        if callable(image):
+            self._image, self._pending = None, image
+        else:
+            self._image, self._pending = image, None
+
+        # Checkpoint once we've moved at least one interval past the last one
+        if self.position - max(self.checkpoints) >= self.checkpoint_interval:
+            self.checkpoints[self.position] = Checkpoint(self.image)
+
+    def seek(self, position):
+        """
+        Rebuild the canvas as it was after `position` commands.
+
+        Args:
+            position (int): Number of history commands to apply (clamped to the history)
+
+        Returns:
+            PIL.Image: The canvas at that position
+        """
+        position = max(0, min(len(self.commands), int(position)))
+        if position == self.position:
+            return self.image
+
+        # Start from the nearest checkpoint, or from the current image when
+        # moving forward and that is closer
+        start = max(index for index in self.checkpoints if index <= position)
+        if self.position <= position and self.position > start:
+            # Copy so callers holding the old image still see the old pixels
+            start, img = self.position, self.image.copy()
+        else:
+            img = self.checkpoints[start].restore()
+
+        for command in self.commands[start:position]:
+            try:
+                img = apply_command(img, command)
+            except Exception as e:
+                print(f"Replay error: {e} for command {command.get('action', '')}")
+
+        self._image, self._pending = img, None
+        self.position = position
+        return img
+
+    def undo(self, steps=1):
+        """Move back `steps` commands"""
+        return self.seek(self.position - steps)
+
+    def redo(self, steps=1):
+        """Move forward `steps` commands along the redo tail"""
+        return self.seek(self.position + steps)
+
+    def describe(self):
+        """
+        Summarize the history state for API responses.
+
+        Returns:
+            dict: Position, history length and undo/redo availability
+        """
+        return {
+            'position': self.position,
+            'history_length': len(self.commands),
+            'can_undo': self.can_undo,
+            'can_redo': self.can_redo,
+            'checkpoints': sorted(self.checkpoints),
+        }
+
+    def _truncate(self):
+        """Drop the redo tail and any checkpoints that belong to it"""
+        if self.position == len(self.commands):
+            return
+        self.commands_bytes -= sum(self._command_sizes[self.position:])
+        del self.commands[self.position:]
+        del self._command_sizes[self.position:]
+        for index in [index for index in self.checkpoints if index > self.position]:
+            del self.checkpoints[index]
@@ -0,0 +1,281 @@
+"""
+Formal schema of the drawing command vocabulary.
+
+ACTION_FIELDS describes the arguments of every action in ACTION_MAP (keep
+the two in sync). It is used both to build the structured response schema
+passed to the model and to validate and normalize the commands that come back.
+"""
+
+import re
+
+from drawing.actions import COLOR_MAP, COLOR_METRICS, parse_points
+from drawing.textures import TEXTURE_STYLES
+
+BRUSH_TYPES = ['round', 'flat', 'splatter']
+TEXTURES = ['smooth', *TEXTURE_STYLES]
+
+# Largest line width and radius that render in reasonable time and memory on the biggest canvas
+MAX_WIDTH = 256
+MAX_RADIUS = 8192
+
+# Field specs: 'type' is one of number, integer, boolean, color, points or enum;
+# numbers outside an optional 'min'/'max' range are clamped to it
+ACTION_FIELDS = {
+    'draw_polyline': {
+        'points': {'type': 'points', 'required': True},
+        'color': {'type': 'color'},
+        'width': {'type': 'number', 'min': 1, 'max': MAX_WIDTH},
+        'brush_type': {'type': 'enum', 'values': BRUSH_TYPES},
+        'texture': {'type': 'enum', 'values': TEXTURES},
+        'pressure': {'type': 'number'},
+    },
+    'erase': {
+        'points': {'type': 'points', 'required': True},
+        'width': {'type': 'integer', 'min': 1, 'max': MAX_WIDTH},
+    },
+    'fill_area': {
+        'x': {'type': 'number', 'required': True},
+        'y': {'type': 'number', 'required': True},
+        'color': {'type': 'color'},
+    },
+    'draw_rect': {
+        'x0': {'type': 'number', 'required': True},
+        'y0': {'type': 'number', 'required': True},
+        'x1': {'type': 'number', 'required': True},
+        'y1': {'type': 'number', 'required': True},
+        'color': {'type': 'color'},
+        'width': {'type': 'integer', 'min': 1, 'max': MAX_WIDTH},
+        'fill': {'type': 'boolean'},
+        'texture': {'type': 'enum', 'values': TEXTURES},
+    },
+    'draw_circle': {
+        'x': {'type': 'number', 'required': True},
+        'y': {'type': 'number', 'required': True},
+        'radius': {'type': 'number', 'required': True, 'min': 0, 'max': MAX_RADIUS},
+        'color': {'type': 'color'},
+        'width': {'type': 'integer', 'min': 1, 'max': MAX_WIDTH},
+        'fill': {'type': 'boolean'},
+        'texture': {'type': 'enum', 'values': TEXTURES},
+    },
+    'erase_area': {
+        'x0': {'type': 'number', 'required': True},
+        'y0': {'type': 'number', 'required': True},
+        'x1': {'type': 'number', 'required': True},
+        'y1': {'type': 'number', 'required': True},
+    },
+    'modify_color': {
+        'target_color': {'type': 'color', 'required': True},
+        'new_color': {'type': 'color', 'required': True},
+        'area_x': {'type': 'number'},
+        'area_y': {'type': 'number'},
+        'radius': {'type': 'number', 'min': 0, 'max': MAX_RADIUS},
+        'tolerance': {'type': 'number'},
+        'metric': {'type': 'enum', 'values': list(COLOR_METRICS)},
+        'falloff': {'type': 'number'},
+    },
+    'enhance_detail': {
+        'x': {'type': 'number', 'required': True},
+        'y': {'type': 'number', 'required': True},
+        'radius': {'type': 'number', 'min': 0, 'max': MAX_RADIUS},
+        'technique': {'type': 'enum', 'values': ['highlight', 'sharpen']},
+        'color': {'type': 'color'},
+    },
+    'soften': {
+        'x': {'type': 'number', 'required': True},
+        'y': {'type': 'number', 'required': True},
+        'radius': {'type': 'number', 'min': 0, 'max': MAX_RADIUS},
+    },
+}
+
+# Actions whose (x0, y0) and (x1, y1) corners are put in order, as Pillow requires
+BOX_ACTIONS = ('draw_rect', 'erase_area')
+
+# Accepted on every command
+COMMON_FIELDS = {
+    'seed': {'type': 'integer'},
+}
+
+HEX_COLOR_RE = re.compile(r'#(?:[0-9a-fA-F]{3}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})')
+
+# Gemini schema types for each field type
+SCHEMA_TYPES = {
+    'number': {'type': 'number'},
+    'integer': {'type': 'integer'},
+    'boolean': {'type': 'boolean'},
+    'color': {'type': 'string', 'description': 'Hex color like #RRGGBB'},
+    'points': {'type': 'array', 'items': {'type': 'array', 'items': {'type': 'number'}}},
+}
+
+def command_response_schema(actions=None):
+    """
+    Build the structured response schema for the model.
+
+    The schema has no union types, so commands are a single object type with
+    an 'action' enum and the union of every action's fields (a field declared
+    as both number and integer is an integer); per-action requirements are
+    enforced by validate_command. 'analysis' sorts before
+    'commands', so the model plans before it draws.
+
+    Args:
+        actions (list): Actions to allow (default: all of ACTION_MAP)
+
+    Returns:
+        dict: Response schema for GenerationConfig.response_schema
+    """
+    actions = list(actions or ACTION_FIELDS)
+    properties = {'action': {'type': 'string', 'enum': actions}}
+    for action in actions:
+        for name, spec in ACTION_FIELDS[action].items():
+            if name in properties:
+                # Shared fields take the strictest declaration, so every action accepts the value
+                if spec['type'] == 'integer' and properties[name] == SCHEMA_TYPES['number']:
+                    properties[name] = dict(SCHEMA_TYPES['integer'])
+                continue
+            if spec['type'] == 'enum':
+                properties[name] = {'type': 'string', 'enum': list(spec['values'])}
+            else:
+                properties[name] = dict(SCHEMA_TYPES[spec['type']])
+
+    return {
+        'type': 'object',
+        'properties': {
+            'analysis': {'type': 'string', 'description': 'Brief plan for this step'},
+            'commands': {
+                'type': 'array',
+                'items': {'type': 'object', 'properties': properties, 'required': ['action']},
+            },
+        },
+        'required': ['analysis', 'commands'],
+    }
+
+def _coerce(value, spec):
+    """
+    Convert a field value to its declared type.
+
+    Returns:
+        The normalized value
+
+    Raises:
+        ValueError: If the value can't be converted
+    """
+    kind = spec['type']
+    if kind in ('number', 'integer'):
+        if isinstance(value, bool):
+            raise ValueError("expected a number")
+        if isinstance(value, str):
+            value = float(value.strip())
+        if not isinstance(value, (int, float)) or value != value or value in (float('inf'), float('-inf')):
+            raise ValueError("expected a finite number")
+        value = min(max(value, spec.get('min', value)), spec.get('max', value))
+        if kind == 'integer' or float(value).is_integer():
+            # Pillow takes line widths and seeds as ints only
+            return int(round(value))
+        return float(value)
+
+    if kind == 'boolean':
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ('true', 'false'):
+            return value.lower() == 'true'
+        if isinstance(value, (int, float)):
+            return bool(value)
+        raise ValueError("expected a boolean")
+
+    if kind == 'color':
+        if not isinstance(value, str):
+            raise ValueError("expected a color string")
+        value = value.strip()
+        if value.lower() in COLOR_MAP:
+            return value.lower()
+        if not HEX_COLOR_RE.fullmatch(value):
+            raise ValueError(f"invalid color {value!r}")
+        if len(value) == 4:
+            value = '#' + ''.join(c * 2 for c in value[1:])
+        return value
+
+    if kind == 'points':
+        if isinstance(value, str):
+            value = [list(point) for point in parse_points(value)]
+        if not isinstance(value, list):
+            raise ValueError("expected a list of [x, y] points")
+        points = []
+        for point in value:
+            if not isinstance(point, (list, tuple)) or len(point) < 2:
+                raise ValueError("expected [x, y] points")
+            points.append([_coerce(point[0], {'type': 'number'}), _coerce(point[1], {'type': 'number'})])
+        if len(points) < 2:
+            raise ValueError("need at least two points")
+        return points
+
+    if kind == 'enum':
+        if value not in spec['values']:
+            raise ValueError(f"expected one of {', '.join(spec['values'])}")
+        return value
+
+    raise ValueError(f"unknown field type {kind}")
+
+def validate_command(command):
+    """
+    Check a command against the schema and normalize its field types.
+
+    Invalid optional fields are dropped (the action falls back to its
+    default); unknown actions and missing or invalid required fields reject
+    the whole command. Unknown fields are dropped.
+
+    Args:
+        command (dict): Command from the model
+
+    Returns:
+        tuple: (normalized command or None if rejected, list of problem strings)
+    """
+    if not isinstance(command, dict):
+        return None, ["command is not an object"]
+    action = command.get('action')
+    fields = ACTION_FIELDS.get(action)
+    if fields is None:
+        return None, [f"unknown action {action!r}"]
+
+    normalized = {'action': action}
+    problems = []
+    for name, spec in {**fields, **COMMON_FIELDS}.items():
+        if name not in command or command[name] is None:
+            if spec.get('required'):
+                problems.append(f"missing {name}")
+                return None, problems
+            continue
+        try:
+            normalized[name] = _coerce(command[name], spec)
+        except (ValueError, TypeError) as e:
+            problems.append(f"{name}: {e}")
+            if spec.get('required'):
+                return None, problems
+
+    if action in BOX_ACTIONS:
+        for low, high in (('x0', 'x1'), ('y0', 'y1')):
+            if normalized[low] > normalized[high]:
+                normalized[low], normalized[high] = normalized[high], normalized[low]
+
+    for name in command:
+        if name not in normalized and name not in fields and name not in COMMON_FIELDS and name != 'action':
+            problems.append(f"unknown field {name}")
+    return normalized, problems
+
+def validate_commands(commands):
+    """
+    Validate a list of commands.
+
+    Args:
+        commands (list): Commands from the model
+
+    Returns:
+        tuple: (list of valid normalized commands, list of {index, action, problems} for rejected ones)
+    """
+    valid, rejected = [], []
+    for index, command in enumerate(commands):
+        normalized, problems = validate_command(command)
+        if normalized is None:
+            action = command.get('action') if isinstance(command, dict) else None
+            rejected.append({'index': index, 'action': action, 'problems': problems})
+        else:
+            valid.append(normalized)
+    return valid, rejected
@@ -0,0 +1,309 @@
+"""
+Server-side canvas sessions.
+
+A session keeps the decoded RGBA canvas and its command history in memory so
+clients can reference a session id instead of shipping the whole image on
+every request. Sessions live in a bounded in-process store with LRU eviction
+by bytes, idle TTL eviction and a cap on the number of sessions.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from PIL import Image
+from ai.context import PromptContext
+from drawing.processor import get_render_executor
+from drawing.patches import PatchTracker, diff_patches
+from drawing.replay import ReplayEngine
+from drawing.tiles import TiledCanvas, get_tile_pool
+from config.settings import SESSION_MAX_COUNT, SESSION_MAX_BYTES, SESSION_IDLE_TTL, TILED_SESSIONS
+
+class CanvasSession:
+    """
+    A single canvas held in memory together with its command history.
+
+    The canvas and history live in a ReplayEngine, which also provides undo,
+    redo and seeking through checkpointed replay.
+
+    Callers must hold `lock` while reading or mutating the image or history.
+    `codec` is the default codec spec for images returned to the client.
+    Tiled sessions render through a TiledCanvas on the tile thread pool
+    instead of the render executor and only assemble the full image when
+    `image` is read. `context` follows the history so
+    continuation prompts are summarized without rescanning it.
+    """
+
+    def __init__(self, image, codec='png', tiled=False):
+        self.id = uuid.uuid4().hex
+        self.codec = codec
+        self.replay = ReplayEngine(image)
+        self.tiles = TiledCanvas(self.replay.image, pool=get_tile_pool()) if tiled else None
+        self.context = PromptContext(self.replay.image.size)
+        self.created_at = time.time()
+        self.last_access = self.created_at
+        self.lock = threading.RLock()
+
+    @property
+    def image(self):
+        """The current canvas"""
+        return self.replay.image
+
+    @property
+    def size(self):
+        """Canvas (width, height), known without assembling a tiled canvas"""
+        return self.replay.size
+
+    @property
+    def history(self):
+        """Commands that make up the current canvas"""
+        return self.replay.history
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the session, including checkpoints and tiles"""
+        return self.replay.nbytes + (self.tiles.nbytes if self.tiles else 0)
+
+    def apply(self, commands, patch_format=None):
+        """
+        Apply drawing commands to the session canvas and record the ones that succeed.
+
+        Recording discards any redo history.
+
+        Args:
+            commands (list): Ordered list of drawing commands
+            patch_format (str): If set ('png' or 'rgba'), also extract the changed regions
+
+        Returns:
+            tuple: (list, list) per-command results as returned by apply_commands,
+                   and the changed-region patches (None if not requested or too large)
+        """
+        with self.lock:
+            # Patches are cropped from the tiles, so a tiled canvas is only assembled when the image is used
+            canvas = self.tiles if self.tiles else self.image
+            tracker = PatchTracker(canvas, commands) if patch_format else None
+            if self.tiles:
+                results = self.tiles.apply(commands)
+                image = self.tiles.to_image
+            else:
+                image, results = get_render_executor().apply(self.image, commands)
+                canvas = image
+            applied = [command for command, result in zip(commands, results) if result['status'] == 'ok']
+            self.replay.record(applied, image)
+            self.context.ingest(applied)
+            patches = tracker.collect(canvas, patch_format) if tracker else None
+        return results, patches
+
+    def seek(self, position, patch_format=None):
+        """
+        Move the canvas to another point in its history (undo, redo or time travel).
+
+        Args:
+            position (int): Number of history commands the canvas should reflect
+            patch_format (str): If set ('png' or 'rgba'), also extract the changed regions
+
+        Returns:
+            list: Changed-region patches (None if not requested or too large)
+        """
+        with self.lock:
+            before = self.image if patch_format else None
+            after = self.replay.seek(position)
+            self.context.sync(self.replay.commands, self.replay.position)
+            if self.tiles:
+                self.tiles.load(after)
+            return diff_patches(before, after, patch_format) if patch_format else None
+
+    def undo(self, steps=1, patch_format=None):
+        """
+        Move back `steps` commands, reading the position under the lock so concurrent undos each count.
+
+        Returns:
+            list: Changed-region patches (None if not requested or too large)
+        """
+        with self.lock:
+            return self.seek(self.replay.position - steps, patch_format)
+
+    def redo(self, steps=1, patch_format=None):
+        """
+        Move forward `steps` commands along the redo history, like undo.
+
+        Returns:
+            list: Changed-region patches (None if not requested or too large)
+        """
+        with self.lock:
+            return self.seek(self.replay.position + steps, patch_format)
+
+    def touch(self):
+        """Mark the session as recently used"""
+        self.last_access = time.time()
+
+    def describe(self):
+        """
+        Summarize the session for API responses.
+
+        Returns:
+            dict: Session metadata
+        """
+        width, height = self.size
+        return {
+            'session_id': self.id,
+            'width': width,
+            'height': height,
+            'codec': self.codec,
+            'tiled': self.tiles is not None,
+            **self.replay.describe(),
+            'bytes': self.nbytes,
+            'created_at': self.created_at,
+            'last_access': self.last_access,
+        }
+
+class SessionStore:
+    """
+    Bounded, thread-safe store of canvas sessions.
+
+    Least recently used sessions are evicted first when the store exceeds
+    `max_sessions` or `max_bytes`; sessions idle for longer than `idle_ttl`
+    seconds are dropped whenever the store is accessed.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX_COUNT, max_bytes=SESSION_MAX_BYTES,
+                 idle_ttl=SESSION_IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def create(self, image, codec='png', tiled=TILED_SESSIONS):
+        """
+        Create a new session holding the given image.
+
+        Args:
+            image (PIL.Image): Initial canvas
+            codec (str): Default codec spec for images returned to the client
+            tiled (bool): Render the session through a tiled canvas
+
+        Returns:
+            CanvasSession: The new session
+        """
+        session = CanvasSession(image, codec, tiled)
+        with self._lock:
+            self._sessions[session.id] = session
+            self._evict(keep=session.id)
+        return session
+
+    def get(self, session_id):
+        """
+        Look up a session and mark it as recently used.
+
+        Args:
+            session_id (str): Session identifier
+
+        Returns:
+            CanvasSession: The session, or None if unknown or expired
+        """
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session.touch()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        """
+        Remove a session.
+
+        Args:
+            session_id (str): Session identifier
+
+        Returns:
+            bool: True if the session existed
+        """
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def update(self, session_id):
+        """
+        Re-check byte limits after a session has grown.
+
+        Args:
+            session_id (str): Session that was just modified
+        """
+        with self._lock:
+            self._evict(keep=session_id)
+
+    def stats(self):
+        """
+        Report store usage for monitoring.
+
+        Returns:
+            dict: Session count, byte usage, limits and eviction count
+        """
+        with self._lock:
+            self._evict_expired()
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self._total_bytes(),
+                'max_sessions': self.max_sessions,
+                'max_bytes': self.max_bytes,
+                'idle_ttl': self.idle_ttl,
+                'evictions': self.evictions,
+            }
+
+    def _total_bytes(self):
+        return sum(session.nbytes for session in self._sessions.values())
+
+    def _evict_expired(self):
+        """Drop sessions that have been idle for longer than the TTL"""
+        if self.idle_ttl <= 0:
+            return
+        cutoff = time.time() - self.idle_ttl
+        expired = [sid for sid, session in self._sessions.items() if session.last_access < cutoff]
+        for sid in expired:
+            del self._sessions[sid]
+            self.evictions += 1
+
+    def _evict(self, keep=None):
+        """Evict least recently used sessions until the store is within its limits"""
+        self._evict_expired()
+        total = self._total_bytes()
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or total > self.max_bytes):
+            sid, session = next(iter(self._sessions.items()))
+            if sid == keep:
+                # Never evict the session that is being used right now
+                self._sessions.move_to_end(sid)
+                sid, session = next(iter(self._sessions.items()))
+            del self._sessions[sid]
+            total -= session.nbytes
+            self.evictions += 1
+            print(f"Evicted canvas session {sid}")
+
+def new_canvas(width, height, background=(255, 255, 255, 255)):
+    """
+    Create a blank RGBA canvas.
+
+    Args:
+        width (int): Canvas width in pixels
+        height (int): Canvas height in pixels
+        background (tuple): RGBA background color
+
+    Returns:
+        PIL.Image: The blank canvas
+    """
+    return Image.new("RGBA", (width, height), background)
+
+# Process-wide session store shared by all routes
+session_store = SessionStore()
+
+def get_session_store():
+    """
+    Get the process-wide session store.
+
+    Returns:
+        SessionStore: The shared session store
+    """
+    return session_store
@@ -0,0 +1,301 @@
+"""
+Uniform-grid spatial index over drawn elements.
+
+Every command that can touch the canvas becomes an element holding its
+bounding box (see drawing/bounds.py), color and z-order, which is its
+position in the command history. Elements are bucketed into fixed-size grid
+cells, so region queries, hit tests, occlusion checks and coverage only
+look at the cells involved instead of scanning the whole history.
+
+The index is kept up to date as commands are added: an opaque fill marks the
+elements it hides when it is indexed, and `truncate` undoes the most recent
+additions, so following a growing (or undone) history never rescans it.
+"""
+
+import math
+from collections import Counter
+from drawing.actions import parse_color, parse_points
+from drawing.bounds import command_bounds, box_area
+from drawing.textures import is_textured
+from config.settings import DEFAULT_CANVAS_WIDTH, DEFAULT_CANVAS_HEIGHT, SPATIAL_CELL_SIZE
+
+# Share of the canvas an opaque fill must cover to count as the background
+BACKGROUND_FRACTION = 0.9
+
+def _num(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float(default)
+
+def _segment_distance(px, py, a, b):
+    """Distance from a point to the segment a-b"""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length = dx * dx + dy * dy
+    t = 0.0 if length == 0 else max(0.0, min(1.0, ((px - a[0]) * dx + (py - a[1]) * dy) / length))
+    return math.hypot(px - (a[0] + t * dx), py - (a[1] + t * dy))
+
+class Element:
+    """
+    A drawn command in the index.
+
+    Args:
+        z (int): Position of the command in the history (higher is on top)
+        command (dict): The drawing command
+        box (tuple): Clipped (left, top, right, bottom) bounds of the pixels it can change
+    """
+
+    def __init__(self, z, command, box):
+        self.z = z
+        self.command = command
+        self.action = command.get('action', '')
+        self.box = box
+        self.color = command.get('color', command.get('new_color'))
+        self.filled = bool(command.get('fill', False)) or self.action == 'fill_area'
+        self.cover = self._cover_box()
+        self.background = False
+        # z of the earliest later opaque fill covering the element, and for fills the elements they hid first
+        self.hidden_by = None
+        self.hides = []
+
+    @property
+    def center(self):
+        return ((self.box[0] + self.box[2]) / 2, (self.box[1] + self.box[3]) / 2)
+
+    def _cover_box(self):
+        """Box every pixel of which the command paints opaquely, or None"""
+        command = self.command
+        if self.action != 'draw_rect' or not self.filled or is_textured(command.get('texture', 'smooth')):
+            return None
+        if parse_color(command.get('color', (0, 0, 0, 255)))[3] != 255:
+            return None
+        try:
+            x0, x1 = sorted((math.trunc(command.get('x0', 0)), math.trunc(command.get('x1', 100))))
+            y0, y1 = sorted((math.trunc(command.get('y0', 0)), math.trunc(command.get('y1', 100))))
+        except (TypeError, ValueError):
+            return None
+        return (x0, y0, x1 + 1, y1 + 1)
+
+    def hit(self, x, y):
+        """
+        True if the command paints near a point.
+
+        Shapes are tested geometrically (outlines only count near the edge),
+        everything else by its bounding box.
+        """
+        command = self.command
+        if not (self.box[0] <= x < self.box[2] and self.box[1] <= y < self.box[3]):
+            return False
+        width = _num(command.get('width', 2), 2)
+        if self.action in ('draw_polyline', 'erase'):
+            points = parse_points(command.get('points', []))
+            reach = width / 2 + 1
+            return any(_segment_distance(x, y, a, b) <= reach for a, b in zip(points, points[1:]))
+        if self.action == 'draw_circle':
+            dist = math.hypot(x - _num(command.get('x', 100), 100), y - _num(command.get('y', 100), 100))
+            radius = abs(_num(command.get('radius', 50), 50))
+            return dist <= radius + 1 if self.filled else abs(dist - radius) <= width
+        if self.action == 'draw_rect' and not self.filled:
+            x0, x1 = sorted((_num(command.get('x0', 0)), _num(command.get('x1', 100), 100)))
+            y0, y1 = sorted((_num(command.get('y0', 0)), _num(command.get('y1', 100), 100)))
+            inside = x0 + width < x <= x1 - width and y0 + width < y <= y1 - width
+            return not inside
+        return True
+
+class SpatialIndex:
+    """
+    Drawn elements bucketed into a uniform grid.
+
+    Args:
+        size (tuple): Canvas (width, height)
+        cell_size (int): Grid cell edge in pixels
+    """
+
+    def __init__(self, size=(DEFAULT_CANVAS_WIDTH, DEFAULT_CANVAS_HEIGHT), cell_size=SPATIAL_CELL_SIZE):
+        self.size = size
+        self.cell_size = max(1, cell_size)
+        self.elements = []
+        self.count = 0
+        self._cells = {}
+        # Foreground elements per cell, for coverage
+        self._foreground = Counter()
+        self._backgrounds = []
+        # Foreground elements not hidden by a later fill, by action
+        self.shown = Counter()
+
+    @classmethod
+    def from_commands(cls, commands, size=(DEFAULT_CANVAS_WIDTH, DEFAULT_CANVAS_HEIGHT)):
+        """Build an index over a command history"""
+        index = cls(size)
+        index.extend(commands)
+        return index
+
+    def add(self, command):
+        """
+        Index the next command of the history.
+
+        Args:
+            command (dict): Drawing command
+
+        Returns:
+            Element: The new element, or None if the command can't touch the canvas
+        """
+        z = self.count
+        self.count += 1
+        box = command_bounds(command, self.size) if isinstance(command, dict) else None
+        if box is None:
+            return None
+        element = Element(z, command, box)
+        if element.cover:
+            self._hide_under(element)
+            if box_area(element.cover) >= self.size[0] * self.size[1] * BACKGROUND_FRACTION:
+                element.background = True
+                self._backgrounds.append(element)
+        self.elements.append(element)
+        if not element.background:
+            self.shown[element.action] += 1
+        for cell in self._cells_for(box):
+            self._cells.setdefault(cell, []).append(element)
+            if not element.background:
+                self._foreground[cell] += 1
+        return element
+
+    def _hide_under(self, cover):
+        """Mark the visible elements a new opaque fill covers completely as hidden by it"""
+        left, top, right, bottom = cover.cover
+        for cell in self._cells_for(cover.cover):
+            for element in self._cells.get(cell, ()):
+                box = element.box
+                if (element.hidden_by is None and left <= box[0] and top <= box[1]
+                        and right >= box[2] and bottom >= box[3]):
+                    element.hidden_by = cover.z
+                    cover.hides.append(element)
+                    if not element.background:
+                        self.shown[element.action] -= 1
+
+    def extend(self, commands):
+        """Index several commands in history order"""
+        for command in commands or []:
+            self.add(command)
+
+    def truncate(self, count):
+        """
+        Drop the elements of every command from position `count` on, as if they were never added.
+
+        Args:
+            count (int): Number of history commands to keep
+        """
+        while self.elements and self.elements[-1].z >= count:
+            element = self.elements.pop()
+            # Cells list their elements in drawing order, so the newest is last
+            for cell in self._cells_for(element.box):
+                elements = self._cells[cell]
+                elements.pop()
+                if not elements:
+                    del self._cells[cell]
+                if not element.background:
+                    self._foreground[cell] -= 1
+            for hidden in element.hides:
+                hidden.hidden_by = None
+                if not hidden.background:
+                    self.shown[hidden.action] += 1
+            element.hides = []
+            if element.background:
+                self._backgrounds.pop()
+            elif element.hidden_by is None:
+                self.shown[element.action] -= 1
+        self.count = min(self.count, max(0, count))
+
+    def query(self, box, include_background=True):
+        """
+        Elements whose bounds intersect a box.
+
+        Args:
+            box (tuple): (left, top, right, bottom)
+            include_background (bool): Whether to include background fills
+
+        Returns:
+            list: Elements from bottom to top
+        """
+        found = {}
+        for cell in self._cells_for(box):
+            for element in self._cells.get(cell, ()):
+                if (element.box[0] < box[2] and box[0] < element.box[2]
+                        and element.box[1] < box[3] and box[1] < element.box[3]):
+                    found[element.z] = element
+        return [found[z] for z in sorted(found)
+                if include_background or not found[z].background]
+
+    def topmost_at(self, x, y):
+        """
+        The element drawn last at a point.
+
+        Args:
+            x (float): Canvas x coordinate
+            y (float): Canvas y coordinate
+
+        Returns:
+            Element: Topmost element that paints near the point, or None
+        """
+        cell = (int(x) // self.cell_size, int(y) // self.cell_size)
+        # Cells list their elements in drawing order
+        for element in reversed(self._cells.get(cell, ())):
+            if element.hit(x, y):
+                return element
+        return None
+
+    def occluded(self, element):
+        """True if a later opaque fill covers everything the element can have drawn"""
+        return element.hidden_by is not None
+
+    def background(self):
+        """The most recent background fill, or None"""
+        return self._backgrounds[-1] if self._backgrounds else None
+
+    def visible(self):
+        """Foreground elements not hidden behind a later opaque fill, bottom to top"""
+        return [element for element in self.elements
+                if not element.background and element.hidden_by is None]
+
+    def uncovered(self, box=None):
+        """
+        Grid cells inside a box that no foreground element touches.
+
+        Args:
+            box (tuple): Region to check (default: the whole canvas)
+
+        Returns:
+            list: Cell boxes clipped to the region
+        """
+        box = box or (0, 0, self.size[0], self.size[1])
+        empty = []
+        for cell in self._cells_for(box):
+            if not self._foreground[cell]:
+                left, top, right, bottom = self._cell_box(cell)
+                empty.append((max(left, box[0]), max(top, box[1]), min(right, box[2]), min(bottom, box[3])))
+        return empty
+
+    def coverage(self, box=None):
+        """Fraction of a region's area (default: the canvas) in cells touched by foreground elements"""
+        box = box or (0, 0, self.size[0], self.size[1])
+        total = box_area(box)
+        if total <= 0:
+            return 0.0
+        empty = sum(box_area(cell) for cell in self.uncovered(box))
+        return max(0.0, 1.0 - empty / total)
+
+    def _cell_box(self, cell):
+        size = self.cell_size
+        return (cell[0] * size, cell[1] * size,
+                min(self.size[0], (cell[0] + 1) * size), min(self.size[1], (cell[1] + 1) * size))
+
+    def _cells_for(self, box):
+        """Grid cells a box overlaps, clipped to the canvas"""
+        size = self.cell_size
+        left, top = max(0, int(box[0])), max(0, int(box[1]))
+        right, bottom = min(self.size[0], int(math.ceil(box[2]))), min(self.size[1], int(math.ceil(box[3])))
+        if left >= right or top >= bottom:
+            return []
+        return [(col, row)
+                for row in range(top // size, (bottom - 1) // size + 1)
+                for col in range(left // size, (right - 1) // size + 1)]
@@ -0,0 +1,118 @@
+"""
+NumPy-backed texture engine for filled shapes.
+
+Each texture style generates a brightness multiplier field for a whole region
+in one array operation; the field is applied to the fill color, masked to the
+shape and pasted onto the image in a single operation.
+"""
+
+import numpy as np
+from PIL import Image
+
+def rough_field(width, height, rng, offset=(0, 0)):
+    """
+    Jittered color field matching the classic rough texture.
+
+    Only every other pixel on every other row (counted from the shape's
+    top-left corner) is painted, each with a random brightness between 90%
+    and 110% of the fill color.
+
+    Args:
+        width (int): Field width
+        height (int): Field height
+        rng (numpy.random.Generator): Random source
+        offset (tuple): Position of the field relative to the shape origin
+
+    Returns:
+        tuple: (multiplier array, coverage mask array)
+    """
+    field = rng.uniform(0.9, 1.1, size=(height, width))
+    coverage = np.zeros((height, width), dtype=bool)
+    coverage[offset[1] % 2::2, offset[0] % 2::2] = True
+    return field, coverage
+
+def value_noise_field(width, height, rng, offset=(0, 0), cell_size=12):
+    """
+    Smooth blotchy variation from bilinearly interpolated value noise.
+
+    Returns:
+        tuple: (multiplier array, coverage mask array)
+    """
+    grid_w = max(2, width // cell_size + 2)
+    grid_h = max(2, height // cell_size + 2)
+    grid = rng.uniform(0.85, 1.15, size=(grid_h, grid_w)).astype(np.float32)
+    field = np.asarray(Image.fromarray(grid).resize((width, height), Image.BILINEAR))
+    return field, np.ones((height, width), dtype=bool)
+
+def paper_grain_field(width, height, rng, offset=(0, 0)):
+    """
+    Fine paper grain: per-pixel speckle over faint horizontal fibres.
+
+    Returns:
+        tuple: (multiplier array, coverage mask array)
+    """
+    speckle = rng.normal(0.0, 0.025, size=(height, width))
+    fibres = rng.normal(0.0, 0.015, size=(height, 1))
+    field = np.clip(1.0 + speckle + fibres, 0.9, 1.1)
+    return field, np.ones((height, width), dtype=bool)
+
+# Available fill textures; 'smooth' is drawn with plain ImageDraw fills
+TEXTURE_STYLES = {
+    'rough': rough_field,
+    'noise': value_noise_field,
+    'paper': paper_grain_field,
+}
+
+def is_textured(texture):
+    """True if the texture name needs the texture engine"""
+    return texture in TEXTURE_STYLES
+
+def texture_fill(img, box, color, texture='rough', circle=None, rng=None):
+    """
+    Fill a rectangular or circular region with a textured color.
+
+    Painted pixels replace the existing ones (like ImageDraw fills), pixels
+    outside the shape or left uncovered by the texture keep their color.
+
+    Args:
+        img (PIL.Image): RGBA image to draw on
+        box (tuple): (x0, y0, x1, y1) region to fill, right/bottom exclusive
+        color (tuple): RGBA fill color
+        texture (str): One of TEXTURE_STYLES
+        circle (tuple): Optional (cx, cy, radius) mask for circular fills
+        rng (numpy.random.Generator): Random source (default: unseeded)
+
+    Returns:
+        PIL.Image: The modified image
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    x0, y0 = int(box[0]), int(box[1])
+    x1, y1 = int(box[2]), int(box[3])
+
+    # Only generate the field for the part of the shape that is on the canvas
+    left, top = max(0, x0), max(0, y0)
+    right, bottom = min(img.width, x1), min(img.height, y1)
+    if left >= right or top >= bottom:
+        return img
+    width, height = right - left, bottom - top
+
+    field_func = TEXTURE_STYLES.get(texture, rough_field)
+    field, coverage = field_func(width, height, rng, offset=(left - x0, top - y0))
+
+    if circle is not None:
+        cx, cy, radius = circle
+        ys = np.arange(top, bottom)[:, None]
+        xs = np.arange(left, right)[None, :]
+        coverage = coverage & (((xs - cx) ** 2 + (ys - cy) ** 2) <= radius ** 2)
+
+    r, g, b, a = color if len(color) == 4 else (*color, 255)
+    rgb = np.asarray((r, g, b), dtype=np.float32)
+    painted = np.clip(field[..., None] * rgb, 0, 255).astype(np.uint8)
+
+    region = np.array(img.crop((left, top, right, bottom)))
+    region[coverage, :3] = painted[coverage]
+    region[coverage, 3] = a
+    img.paste(Image.fromarray(region), (left, top))
+    return img
@@ -0,0 +1,341 @@
+"""
+Tiled canvases rendered concurrently in a thread pool.
+
+A TiledCanvas splits the image into fixed-size square tiles. Each command is
+clipped against the tiles its bounding box intersects and only those tiles
+are rendered; untouched tiles are never copied, re-rendered or re-pasted.
+
+Actions that work on whole pixels (plain rectangles, erased areas and
+recolors, which are what large full-canvas commands usually are) give the
+same pixels wherever they are drawn. Runs of them are rendered tile by tile
+in parallel, translated into each tile's coordinates, on a thread pool
+(Pillow and NumPy release the GIL for the heavy parts).
+
+Everything else is rendered in place on the canvas, at its own coordinates:
+Pillow rasterizes shifted float coordinates slightly differently, brush dab
+positions are interpolated in floating point, flood fills can reach any
+pixel and textured fills draw one noise field for the whole shape. Only the
+tiles under the command's bounds are folded back into the canvas first.
+Either way the result is pixel-identical to apply_commands, and the full
+image is assembled only when it is requested.
+"""
+
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from drawing.actions import ACTION_MAP
+from drawing.bounds import command_bounds
+from drawing.processor import apply_command
+from drawing.textures import is_textured
+from config.settings import TILE_SIZE, TILE_WORKERS
+
+# Actions that can be rendered per tile, with their coordinate fields and defaults
+TILE_LOCAL_ACTIONS = {
+    'draw_rect': {'x0': 0, 'y0': 0, 'x1': 100, 'y1': 100},
+    'erase_area': {'x0': 0, 'y0': 0, 'x1': 100, 'y1': 100},
+    'modify_color': {'area_x': 0, 'area_y': 0},
+}
+
+# Fields holding x coordinates; the rest hold y coordinates
+X_FIELDS = {'x0', 'x1', 'area_x'}
+
+# How each action truncates its coordinates to whole pixels. Truncation rounds
+# toward zero, so it has to happen before translating into (possibly negative)
+# tile coordinates
+TRUNCATE = {
+    'draw_rect': math.trunc,
+    'erase_area': math.trunc,
+    'modify_color': int,
+}
+
+def is_tile_local(command):
+    """
+    True if a command renders identically on each tile on its own.
+
+    Args:
+        command (dict): Drawing command
+
+    Returns:
+        bool: True for the actions in TILE_LOCAL_ACTIONS, except textured fills
+    """
+    action = command.get('action', '') if isinstance(command, dict) else ''
+    if action not in TILE_LOCAL_ACTIONS:
+        return False
+    if action == 'draw_rect':
+        return not (command.get('fill', False) and is_textured(command.get('texture', 'smooth')))
+    return True
+
+def translate_command(command, dx, dy):
+    """
+    Shift a tile-local command's coordinates.
+
+    Args:
+        command (dict): Drawing command accepted by is_tile_local
+        dx (int): Offset added to x coordinates
+        dy (int): Offset added to y coordinates
+
+    Returns:
+        dict: Translated copy of the command
+
+    Raises:
+        TypeError, ValueError: If a coordinate is malformed
+    """
+    action = command.get('action', '')
+    translated = dict(command)
+    for field, default in TILE_LOCAL_ACTIONS[action].items():
+        value = TRUNCATE[action](command.get(field, default))
+        translated[field] = value + (dx if field in X_FIELDS else dy)
+    return translated
+
+def _render_tile(tile, origin, commands):
+    """
+    Render commands onto a copy of one tile, skipping any that fail.
+
+    Returns:
+        tuple: (PIL.Image, dict) the rendered tile and error messages of failed commands by index
+    """
+    tile = tile.copy()
+    failed = {}
+    for index, command in commands:
+        snapshot = tile.copy()
+        try:
+            tile = apply_command(tile, translate_command(command, -origin[0], -origin[1]))
+        except Exception as e:
+            tile = snapshot
+            failed[index] = str(e)
+    return tile, failed
+
+class TiledCanvas:
+    """
+    An RGBA canvas stored as a working image plus lazily split tiles.
+
+    Tiles are cropped from the working image when a tile-local command first
+    touches them and stay split until another command needs their pixels in
+    the image: a command rendered in place folds the tiles under its bounds
+    back in, and `to_image` folds in all of them. The working image is copied
+    before the first in-place change after it was handed out, so images
+    returned by `to_image` never change.
+
+    Args:
+        image (PIL.Image): Initial canvas
+        tile_size (int): Tile edge in pixels
+        pool (ThreadPoolExecutor): Pool tiles are rendered on, or None to render in the calling thread
+    """
+
+    def __init__(self, image, tile_size=TILE_SIZE, pool=None):
+        self.tile_size = max(1, tile_size)
+        self.pool = pool
+        self.load(image)
+
+    def load(self, image):
+        """Replace the whole canvas, dropping every tile"""
+        # The image is not modified in place while the caller may hold it
+        self._image = image if image.mode == "RGBA" else image.convert("RGBA")
+        self._shared = self._image is image
+        self.size = self._image.size
+        self._tiles = {}
+
+    @property
+    def nbytes(self):
+        """Memory held on top of the image shared with the caller: split tiles and a private working copy"""
+        tile_bytes = sum(tile.width * tile.height * 4 for tile in self._tiles.values())
+        return tile_bytes + (0 if self._shared else self.size[0] * self.size[1] * 4)
+
+    @property
+    def dirty(self):
+        """Keys of tiles changed since they were split off the working image"""
+        return set(self._tiles)
+
+    def tile_box(self, key):
+        """Canvas box (left, top, right, bottom) of the tile at (column, row)"""
+        left, top = key[0] * self.tile_size, key[1] * self.tile_size
+        return (left, top, min(self.size[0], left + self.tile_size), min(self.size[1], top + self.tile_size))
+
+    def tiles_for(self, box):
+        """
+        Keys of the tiles a box intersects.
+
+        Args:
+            box (tuple): Clipped (left, top, right, bottom) box, or None
+
+        Returns:
+            list: (column, row) keys in row-major order
+        """
+        if box is None:
+            return []
+        size = self.tile_size
+        return [(col, row)
+                for row in range(box[1] // size, (box[3] - 1) // size + 1)
+                for col in range(box[0] // size, (box[2] - 1) // size + 1)]
+
+    def apply(self, commands):
+        """
+        Apply an ordered list of drawing commands.
+
+        Consecutive commands of the same kind are rendered together: tile-local
+        ones tile by tile on the pool, the others in place on the canvas.
+        Failed commands leave the canvas as it was, as with apply_commands.
+
+        Args:
+            commands (list): Ordered list of drawing commands
+
+        Returns:
+            list: One result dict per command, as returned by apply_commands
+        """
+        results = []
+        run, local = [], False
+        for index, command in enumerate(commands):
+            action = command.get('action', '') if isinstance(command, dict) else ''
+            bounds = command_bounds(command, self.size)
+            results.append({'index': index, 'action': action, 'status': 'ok',
+                            'bounds': list(bounds) if bounds else None})
+            if action not in ACTION_MAP:
+                results[-1]['status'] = 'error'
+                results[-1]['error'] = f"Unknown or missing action: {action}"
+                print(f"Drawing error: {results[-1]['error']} for command {index} ({action})")
+                continue
+            if bounds is None:
+                continue
+            if run and is_tile_local(command) != local:
+                self._render(run, local, results)
+                run = []
+            run.append((index, command, bounds))
+            local = is_tile_local(command)
+        if run:
+            self._render(run, local, results)
+        return results
+
+    def crop(self, box):
+        """
+        Copy a region of the current canvas without assembling the whole image.
+
+        Args:
+            box (tuple): Clipped (left, top, right, bottom) box
+
+        Returns:
+            PIL.Image: The region
+        """
+        region = self._image.crop(box)
+        for key in self.tiles_for(box):
+            tile = self._tiles.get(key)
+            if tile is not None:
+                left, top = self.tile_box(key)[:2]
+                region.paste(tile, (left - box[0], top - box[1]))
+        return region
+
+    def to_image(self):
+        """
+        Get the full canvas, folding in the tiles that are still split off.
+
+        The returned image is never modified afterwards: the next in-place
+        change works on a copy.
+
+        Returns:
+            PIL.Image: The assembled canvas
+        """
+        self._fold(list(self._tiles))
+        self._shared = True
+        return self._image
+
+    def _fold(self, keys):
+        """Paste split-off tiles back into the working image and drop them"""
+        keys = [key for key in keys if key in self._tiles]
+        if not keys:
+            return
+        self._own()
+        for key in keys:
+            self._image.paste(self._tiles.pop(key), self.tile_box(key)[:2])
+
+    def _own(self):
+        """Copy the working image before changing it in place if it was handed out"""
+        if self._shared:
+            self._image = self._image.copy()
+            self._shared = False
+
+    def _tile(self, key):
+        tile = self._tiles.get(key)
+        if tile is None:
+            tile = self._image.crop(self.tile_box(key))
+        return tile
+
+    def _render(self, run, local, results):
+        if local:
+            self._render_tiles(run, results)
+        else:
+            self._render_in_place(run, results)
+
+    def _render_tiles(self, run, results):
+        """Render a run of tile-local commands tile by tile"""
+        work = {}
+        for index, command, bounds in run:
+            for key in self.tiles_for(bounds):
+                work.setdefault(key, []).append((index, command))
+
+        # A command that fails on some of its tiles but not others is dropped and the run re-rendered
+        excluded = {}
+        while True:
+            jobs = {key: [(index, command) for index, command in items if index not in excluded]
+                    for key, items in work.items()}
+            rendered = self._map(jobs)
+            outcomes = {}
+            for key, (_, failed) in rendered.items():
+                for index, _ in jobs[key]:
+                    outcomes.setdefault(index, []).append(failed.get(index))
+            mixed = {index: next(error for error in errors if error)
+                     for index, errors in outcomes.items() if any(errors) and not all(errors)}
+            if not mixed:
+                break
+            excluded.update(mixed)
+
+        failed = {index: errors[0] for index, errors in outcomes.items() if errors[0]}
+        for index, error in {**failed, **excluded}.items():
+            print(f"Drawing error: {error} for command {index} ({results[index]['action']})")
+            results[index]['status'] = 'error'
+            results[index]['error'] = error
+        for key, (tile, _) in rendered.items():
+            self._tiles[key] = tile
+
+    def _map(self, jobs):
+        """Render each tile's commands, on the pool when several tiles are involved"""
+        args = [(key, self._tile(key), self.tile_box(key)[:2], commands) for key, commands in jobs.items()]
+        if self.pool is None or len(args) == 1:
+            return {key: _render_tile(tile, origin, commands) for key, tile, origin, commands in args}
+        futures = {key: self.pool.submit(_render_tile, tile, origin, commands)
+                   for key, tile, origin, commands in args}
+        return {key: future.result() for key, future in futures.items()}
+
+    def _render_in_place(self, run, results):
+        """Render a run of other commands on the working image, touching only their bounds"""
+        for index, command, bounds in run:
+            self._fold(self.tiles_for(bounds))
+            self._own()
+
+            # Only the command's bounds can change, so that is all a failure has to restore
+            snapshot = self._image.crop(bounds)
+            try:
+                self._image = apply_command(self._image, command)
+            except Exception as e:
+                print(f"Drawing error: {e} for command {index} ({results[index]['action']})")
+                self._image.paste(snapshot, bounds[:2])
+                results[index]['status'] = 'error'
+                results[index]['error'] = str(e)
+
+# Threads shared by all tiled canvases, started on first use
+_tile_pool = None
+_tile_pool_lock = threading.Lock()
+
+def get_tile_pool():
+    """
+    Get the process-wide tile rendering pool.
+
+    Returns:
+        ThreadPoolExecutor: The shared pool, or None if TILE_WORKERS is 0
+    """
+    global _tile_pool
+    if TILE_WORKERS <= 0:
+        return None
+    with _tile_pool_lock:
+        if _tile_pool is None:
+            _tile_pool = ThreadPoolExecutor(TILE_WORKERS, thread_name_prefix='tile')
+        return _tile_pool
@@ -39,7 +39,7 @@ if (window.Worker) {
           break;
           
         case 'command_processed':
-          handleCommandProcessed(data.command, data.imageData);
+          handleCommandProcessed(data.command, data.imageData, data.patches);
           break;
           
         case 'commands_received':
@@ -368,6 +368,9 @@ let currentIteration = 0;
 let prompt = '';
 let drawingTimerId = null;
 let commandHistory = []; // Add this array to store command history
+let commandStreamActive = false; // True while commands are still streaming in
+let awaitingStreamedCommand = false; // True when the queue ran dry mid-stream
+const useCommandStream = typeof ReadableStream !== 'undefined' && typeof TextDecoder !== 'undefined';
 
 function updateBrushPreview() {
   const previewCanvas = document.getElementById('brush-preview');
@@ -489,12 +492,76 @@ function updateBrushPreview() {
 }
 
 
+/**
+ * Composite dirty-rectangle patches returned by the server onto the canvas
+ * Patches never overlap, so they can be drawn in any order.
+ * @param {Array} patches - Patches with x, y, width, height, format and data
+ *                           (or a decoded bitmap/pixels from the worker)
+ * @returns {Promise} - Promise that resolves once every patch is drawn
+ */
+function applyPatches(patches) {
+  return Promise.all(patches.map(patch => new Promise((resolve, reject) => {
+    // Binary responses arrive already decoded by the worker
+    if (patch.bitmap) {
+      ctx.clearRect(patch.x, patch.y, patch.width, patch.height);
+      ctx.drawImage(patch.bitmap, patch.x, patch.y);
+      patch.bitmap.close();
+      resolve();
+      return;
+    }
+    if (patch.pixels) {
+      ctx.putImageData(new ImageData(patch.pixels, patch.width, patch.height), patch.x, patch.y);
+      resolve();
+      return;
+    }
+    if (patch.format === 'rgba') {
+      const bytes = Uint8ClampedArray.from(atob(patch.data), c => c.charCodeAt(0));
+      ctx.putImageData(new ImageData(bytes, patch.width, patch.height), patch.x, patch.y);
+      resolve();
+      return;
+    }
+    const img = new Image();
+    img.onload = () => {
+      ctx.clearRect(patch.x, patch.y, patch.width, patch.height);
+      ctx.drawImage(img, patch.x, patch.y);
+      resolve();
+    };
+    img.onerror = reject;
+    img.src = patch.data;
+  })));
+}
+
+/**
+ * Schedule the next queued command once the canvas has been updated
+ */
+function scheduleNextCommand() {
+  // Only set the timeout if the queue is NOT empty
+  if (commandQueue.length > 0) {
+    drawingTimerId = setTimeout(processNextCommand, 200);
+  } else {
+    // If the queue IS empty, processNextCommand will handle phase transitions
+    processNextCommand();
+  }
+}
+
 /**
  * Handle processed command result from worker
  * @param {Object} command - The drawing command that was processed
  * @param {string} updatedImageData - Updated image data URI
+ * @param {Array} patches - Changed regions to composite instead of a full image
  */
-function handleCommandProcessed(command, updatedImageData) {
+function handleCommandProcessed(command, updatedImageData, patches) {
+  if (patches) {
+    applyPatches(patches)
+      .then(() => {
+        currentImageData = canvas.toDataURL('image/png');
+        console.log(`Applied ${patches.length} patch(es). Scheduling next command.`);
+      })
+      .catch(() => console.error('Error applying patches'))
+      .finally(scheduleNextCommand);
+    return;
+  }
+
   if (!updatedImageData) {
     console.error('No updated image data received');
     return;
@@ -506,42 +573,22 @@ function handleCommandProcessed(command, updatedImageData) {
     ctx.clearRect(0, 0, canvas.width, canvas.height);
     ctx.drawImage(img, 0, 0);
     console.log("Image updated. Scheduling next command.");
-    
-    // Only set the timeout if the queue is NOT empty
-    if (commandQueue.length > 0) {
-      drawingTimerId = setTimeout(processNextCommand, 200);
-    } else {
-      // If the queue IS empty, processNextCommand will handle phase transitions
-      processNextCommand();
-    }
+    scheduleNextCommand();
   };
   
   img.onerror = () => {
     console.error('Error loading image');
-    if (commandQueue.length > 0) {
-      drawingTimerId = setTimeout(processNextCommand, 200);
-    } else {
-      processNextCommand();
-    }
+    scheduleNextCommand();
   };
   
   img.src = currentImageData;
 }
 
 /**
- * Handle commands received from AI
- * @param {Object} result - Result data from the worker
+ * Record the phase progression returned with a batch of commands
+ * @param {Object} result - current_part, next_part, next_phase and has_more
  */
-function handleCommandsReceived(result) {
-  console.log("getMoreCommands result:", result);
-
-  if (result.error) {
-    console.error('Server error:', result.error);
-    setStatus(`Error: ${result.error}`, 'error');
-    isDrawing = false;
-    return;
-  }
-
+function applyStepInfo(result) {
   // Update current part information - critical fix for the sub-phase looping issue
   if (result.current_part !== undefined) {
     currentPart = result.current_part;
@@ -567,20 +614,47 @@ function handleCommandsReceived(result) {
     console.log("has_more is false. Setting isDrawing to false.");
     isDrawing = false;
   }
+}
 
-  // Update the thinking container if available
-  if (result.thinking) {
-    const thinkingContainer = document.getElementById('ai-thinking');
-    const thinkingToggle = document.getElementById('thinking-toggle');
+/**
+ * Show the AI's thinking in the collapsible thinking container
+ * @param {string} thinking - Thinking text so far
+ */
+function showThinking(thinking) {
+  const thinkingContainer = document.getElementById('ai-thinking');
+  const thinkingToggle = document.getElementById('thinking-toggle');
+  if (thinkingContainer) {
+    // Format the thinking content with proper HTML
+    thinkingContainer.innerHTML = `<pre style="white-space: pre-wrap; word-break: break-word;">${escapeHtml(thinking)}</pre>`;
+  }
+  if (thinkingToggle && thinkingToggle.style.display !== 'block') {
     if (thinkingContainer) {
-      // Format the thinking content with proper HTML
-      thinkingContainer.innerHTML = `<pre style="white-space: pre-wrap; word-break: break-word;">${escapeHtml(result.thinking)}</pre>`;
       thinkingContainer.style.display = 'none'; // Start collapsed by default
     }
-    if (thinkingToggle) {
-      thinkingToggle.style.display = 'block';
-      thinkingToggle.textContent = 'Show AI Thinking';
-    }
+    thinkingToggle.style.display = 'block';
+    thinkingToggle.textContent = 'Show AI Thinking';
+  }
+}
+
+/**
+ * Handle commands received from AI
+ * @param {Object} result - Result data from the worker
+ */
+function handleCommandsReceived(result) {
+  console.log("getMoreCommands result:", result);
+
+  if (result.error) {
+    console.error('Server error:', result.error);
+    setStatus(`Error: ${result.error}`, 'error');
+    isDrawing = false;
+    return;
+  }
+
+  applyStepInfo(result);
+
+  // Update the thinking container if available
+  if (result.thinking) {
+    showThinking(result.thinking);
   }
 
   commandQueue = [...commandQueue, ...result.commands];
@@ -597,6 +671,99 @@ function handleCommandsReceived(result) {
   }
 }
 
+/**
+ * Parse one Server-Sent Event block
+ * @param {string} raw - Event text without the trailing blank line
+ * @returns {Object} - { event, data } with data parsed from JSON
+ */
+function parseStreamEvent(raw) {
+  let event = 'message';
+  const dataLines = [];
+  for (const line of raw.split('\n')) {
+    if (line.startsWith('event:')) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith('data:')) {
+      dataLines.push(line.slice(5).trimStart());
+    }
+  }
+  return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null };
+}
+
+/**
+ * Request commands over the streaming endpoint and queue each one as it arrives,
+ * so drawing starts while the rest of the response is still being generated
+ * @param {Object} requestData - Same payload as /get_commands
+ */
+async function streamCommands(requestData) {
+  const response = await fetch(`${API_BASE_URL}/get_commands/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(requestData)
+  });
+
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let thinking = '';
+
+  commandStreamActive = true;
+  // Nothing is drawing yet, so the first command should start the queue
+  awaitingStreamedCommand = true;
+
+  try {
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const { event, data } = parseStreamEvent(buffer.slice(0, boundary));
+        buffer = buffer.slice(boundary + 2);
+
+        switch (event) {
+          case 'step':
+            applyStepInfo(data);
+            updatePhaseIndicator();
+            break;
+
+          case 'thinking':
+            thinking += data.text;
+            showThinking(thinking);
+            break;
+
+          case 'command':
+            commandQueue.push(data.command);
+            if (awaitingStreamedCommand) {
+              awaitingStreamedCommand = false;
+              processNextCommand();
+            }
+            break;
+
+          case 'done':
+            console.log(`Command stream complete: ${data.count} commands${data.cached ? ' (cached)' : ''}`);
+            break;
+
+          case 'error':
+            throw new Error(data.error);
+        }
+      }
+    }
+  } finally {
+    commandStreamActive = false;
+  }
+
+  // If drawing caught up with the stream, continue now that it has ended
+  if (awaitingStreamedCommand) {
+    awaitingStreamedCommand = false;
+    processNextCommand();
+  }
+}
+
 async function processNextCommand() {
   // ALWAYS clear the timer 
   if (drawingTimerId) {
@@ -605,6 +772,12 @@ async function processNextCommand() {
   }
   console.log(`processNextCommand called. Queue length: ${commandQueue.length}, isDrawing: ${isDrawing}, phase: ${currentPhase}, part: ${currentPart}`);
 
+  if (!commandQueue.length && commandStreamActive) {
+    // More commands are on the way; the stream resumes drawing when one arrives
+    awaitingStreamedCommand = true;
+    return;
+  }
+
   if (!commandQueue.length) {
     console.log("Command queue is empty.");
     
@@ -709,8 +882,10 @@ async function getMoreCommands() {
       command_history: commandHistory
     };
 
-    // Use the worker if available, otherwise fallback to direct API call
-    if (drawingWorker) {
+    // Prefer streaming, then the worker, then a direct API call
+    if (useCommandStream) {
+      await streamCommands(requestData);
+    } else if (drawingWorker) {
       drawingWorker.postMessage({
         type: 'get_commands',
         data: requestData
@@ -0,0 +1,48 @@
+"""
+Response cache keys must not depend on the interpreter's hash seed.
+
+Keys are persisted in SQLite and shared between worker processes, so the
+same request has to get the same key after a restart.
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Builds a continuation prompt (which summarizes the history's colors) and prints its cache key
+KEY_SCRIPT = """
+from io import BytesIO
+from PIL import Image
+from ai.cache import request_key
+from ai.generation import build_prompt
+
+buffer = BytesIO()
+Image.new('RGBA', (8, 8), 'white').save(buffer, format='PNG')
+image_part = {'mime_type': 'image/png', 'data': buffer.getvalue()}
+
+history = [
+    {'action': 'draw_rect', 'x0': 10, 'y0': 10, 'x1': 50, 'y1': 50, 'color': '#ff0000'},
+    {'action': 'draw_circle', 'x': 100, 'y': 100, 'radius': 20, 'color': '#00ff00'},
+    {'action': 'draw_polyline', 'points': [[0, 0], [40, 40]], 'color': '#0000ff'},
+    {'action': 'draw_rect', 'x0': 60, 'y0': 60, 'x1': 90, 'y1': 90, 'color': '#ffff00'},
+]
+parts, _ = build_prompt('a house by a lake', 'sketch', 1, history, image_part)
+print('KEY', request_key(parts))
+"""
+
+def request_key_with_seed(seed):
+    env = dict(os.environ, PYTHONHASHSEED=str(seed))
+    output = subprocess.run([sys.executable, '-c', KEY_SCRIPT], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return next(line.split()[1] for line in output.splitlines() if line.startswith('KEY '))
+
+class RequestKeyTest(unittest.TestCase):
+
+    def test_same_prompt_same_key_across_hash_seeds(self):
+        self.assertEqual(request_key_with_seed(1), request_key_with_seed(2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+Pluggable encoders for canvas images sent back to clients.
+
+A default-settings PNG save dominates the cost of most draw requests.
+Codecs trade bytes for encode time: PNG at a chosen zlib level, lossless
+WebP, or raw RGBA pixels, optionally zlib- or lz4-framed. A codec is named
+by a spec string, optionally with a level after a colon: 'png', 'png:1',
+'webp', 'rgba', 'rgba-zlib:1', 'rgba-lz4'.
+
+Image codecs are sent as data URIs; raw codecs as plain base64, like RGBA
+patches always were, so the client needs the width and height alongside.
+"""
+
+import base64
+import zlib
+from collections import namedtuple
+from io import BytesIO
+
+try:
+    import lz4.frame
+except ImportError:  # optional dependency
+    lz4 = None
+
+# encode(image, level) -> bytes; levels is the accepted (min, max) range, or None
+Codec = namedtuple('Codec', 'name mime_type raw default_level levels encode')
+
+CODECS = {}
+
+def register_codec(name, mime_type, encode, raw=False, default_level=None, levels=None):
+    """
+    Add a codec to the registry.
+
+    Args:
+        name (str): Codec name used in specs
+        mime_type (str): MIME type of the encoded bytes
+        encode: Callable (PIL.Image, level) -> bytes
+        raw (bool): True if the bytes are not a self-describing image file
+        default_level (int): Level used when the spec has none
+        levels (tuple): (min, max) levels the codec accepts, or None if it takes none
+    """
+    CODECS[name] = Codec(name, mime_type, raw, default_level, levels, encode)
+
+def _encode_png(image, level):
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", compress_level=level)
+    return buffered.getvalue()
+
+def _encode_webp(image, level):
+    # Lossless; method trades encode time for size (0 fastest, 6 smallest)
+    buffered = BytesIO()
+    image.save(buffered, format="WEBP", lossless=True, method=level, quality=round(level / 6 * 100))
+    return buffered.getvalue()
+
+def _encode_rgba(image, level):
+    return image.convert("RGBA").tobytes()
+
+def _encode_rgba_zlib(image, level):
+    return zlib.compress(image.convert("RGBA").tobytes(), level)
+
+def _encode_rgba_lz4(image, level):
+    return lz4.frame.compress(image.convert("RGBA").tobytes(), compression_level=level)
+
+register_codec('png', 'image/png', _encode_png, default_level=6, levels=(0, 9))
+register_codec('webp', 'image/webp', _encode_webp, default_level=0, levels=(0, 6))
+register_codec('rgba', 'application/octet-stream', _encode_rgba, raw=True)
+register_codec('rgba-zlib', 'application/zlib', _encode_rgba_zlib, raw=True, default_level=1, levels=(0, 9))
+if lz4 is not None:
+    register_codec('rgba-lz4', 'application/x-lz4', _encode_rgba_lz4, raw=True, default_level=0, levels=(0, 16))
+
+def parse_codec(spec):
+    """
+    Resolve a codec spec.
+
+    Args:
+        spec (str): Codec name, optionally followed by ':level'
+
+    Returns:
+        tuple: (Codec, level)
+
+    Raises:
+        ValueError: If the codec is unknown or the level is invalid
+    """
+    name, _, level = str(spec).partition(':')
+    codec = CODECS.get(name.strip().lower())
+    if codec is None:
+        raise ValueError(f"Unknown codec {spec!r} (available: {', '.join(CODECS)})")
+    if not level:
+        return codec, codec.default_level
+    if codec.levels is None:
+        raise ValueError(f"Codec {codec.name} takes no level")
+    level = int(level)
+    if not codec.levels[0] <= level <= codec.levels[1]:
+        raise ValueError(f"Codec {codec.name} level must be between {codec.levels[0]} and {codec.levels[1]}")
+    return codec, level
+
+def valid_codec(spec, default='png'):
+    """
+    Get a usable codec spec, falling back to `default` for unknown ones.
+
+    Args:
+        spec (str): Requested codec spec (or None)
+        default (str): Spec to use when none or an invalid one was requested
+
+    Returns:
+        str: A codec spec parse_codec accepts
+    """
+    if not spec:
+        return default
+    try:
+        parse_codec(spec)
+    except ValueError:
+        return default
+    return spec
+
+def codec_mime_type(spec):
+    """MIME type of the bytes a codec produces"""
+    return parse_codec(spec)[0].mime_type
+
+def is_raw_codec(spec):
+    """True if a codec produces raw pixels rather than an image file"""
+    return parse_codec(spec)[0].raw
+
+def encode_image(image, spec='png'):
+    """
+    Encode an image with a codec.
+
+    Args:
+        image (PIL.Image): Image to encode
+        spec (str): Codec spec
+
+    Returns:
+        bytes: Encoded image
+    """
+    codec, level = parse_codec(spec)
+    return codec.encode(image, level)
+
+def encode_image_string(image, spec='png'):
+    """
+    Encode an image for a JSON payload.
+
+    Args:
+        image (PIL.Image): Image to encode
+        spec (str): Codec spec
+
+    Returns:
+        str: Data URI for image codecs, plain base64 for raw codecs
+    """
+    codec, level = parse_codec(spec)
+    encoded = base64.b64encode(codec.encode(image, level)).decode()
+    if codec.raw:
+        return encoded
+    return f"data:{codec.mime_type};base64,{encoded}"
@@ -0,0 +1,53 @@
+"""
+Stable hashing helpers for commands and canvases.
+"""
+
+import hashlib
+import json
+
+def canonical_json(obj):
+    """
+    Serialize an object to JSON with a stable key order and no whitespace.
+
+    Args:
+        obj: JSON-compatible object (unknown types are stringified)
+
+    Returns:
+        str: Canonical JSON string
+    """
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str)
+
+def stable_digest(data, digest_size=16):
+    """
+    Hash bytes or text with BLAKE2b.
+
+    Args:
+        data (bytes or str): Data to hash
+        digest_size (int): Digest length in bytes
+
+    Returns:
+        str: Hex digest
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.blake2b(data, digest_size=digest_size).hexdigest()
+
+def command_seed(command):
+    """
+    Get the random seed for a drawing command.
+
+    An explicit integer 'seed' field wins; otherwise the seed is derived from
+    a hash of the canonicalized command, so identical commands always render
+    identically.
+
+    Args:
+        command (dict): Drawing command
+
+    Returns:
+        int: Non-negative 64-bit seed
+    """
+    seed = command.get('seed')
+    if isinstance(seed, (int, float)) and not isinstance(seed, bool):
+        return int(seed) & 0xFFFFFFFFFFFFFFFF
+    fields = {key: value for key, value in command.items() if key != 'seed'}
+    return int(stable_digest(canonical_json(fields), digest_size=8), 16)
@@ -6,19 +6,42 @@ import base64
 from io import BytesIO
 from PIL import Image
 
+from utils.codecs import valid_codec, encode_image_string
+
+# Image formats the model accepts as inline data, by PIL format name
+MODEL_IMAGE_TYPES = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+def data_uri_to_bytes(uri):
+    """
+    Extract the encoded image bytes from a data URI without decoding the image.
+
+    Args:
+        uri (str): Data URI string starting with 'data:image/'
+
+    Returns:
+        bytes: The encoded image
+    """
+    _, encoded = uri.split(",", 1)
+    return base64.b64decode(encoded)
+
 def data_uri_to_image(uri):
     """
     Convert a data URI to a PIL Image.
     
     Args:
-        uri (str): Data URI string starting with 'data:image/'
+        uri (str): Data URI string starting with 'data:image/', or the
+                   encoded image bytes from a binary request
         
     Returns:
         PIL.Image: The converted image
     """
-    _, encoded = uri.split(",", 1)
-    data = base64.b64decode(encoded)
-    return Image.open(BytesIO(data))
+    if isinstance(uri, (bytes, bytearray)):
+        return Image.open(BytesIO(uri))
+    return Image.open(BytesIO(data_uri_to_bytes(uri)))
 
 def image_to_data_uri(image, format="PNG"):
     """
@@ -34,4 +57,105 @@ def image_to_data_uri(image, format="PNG"):
     buffered = BytesIO()
     image.save(buffered, format=format)
     img_str = base64.b64encode(buffered.getvalue()).decode()
-    return f"data:image/{format.lower()};base64,{img_str}"
\ No newline at end of file
+    return f"data:image/{format.lower()};base64,{img_str}"
+
+def image_to_patch(image, box, format="png"):
+    """
+    Crop a region of an image into a patch the client can composite.
+
+    Args:
+        image (PIL.Image): The source image (RGBA)
+        box (tuple): (left, top, right, bottom) region to crop
+        format (str): Codec spec; image codecs ('png', 'webp') give a data URI,
+                      raw codecs ('rgba', 'rgba-zlib') base64 pixel bytes
+
+    Returns:
+        dict: Patch with x, y, width, height, format and data
+    """
+    region = image.crop(box)
+    format = valid_codec(format)
+    return {
+        'x': box[0],
+        'y': box[1],
+        'width': region.width,
+        'height': region.height,
+        'format': format,
+        'data': encode_image_string(region, format),
+    }
+
+def prepare_model_image(source, max_side=0, format="auto", quality=85):
+    """
+    Prepare a canvas image as inline data for the model.
+
+    Encoded uploads that the model accepts and that fit within `max_side` are
+    passed through byte-for-byte (only the header is read). Anything else is
+    decoded, downscaled so its longest side is at most `max_side`, and
+    encoded as PNG, or as JPEG/WebP at `quality`.
+
+    Args:
+        source: Encoded image bytes, a data URI string, or a PIL Image
+        max_side (int): Longest side limit in pixels (0 for no limit)
+        format (str): 'auto' (pass through, else PNG), 'png', 'jpeg' or 'webp'
+        quality (int): JPEG/WebP quality (1-100)
+
+    Returns:
+        tuple: (image part dict with mime_type and data, dict describing the chosen size and format)
+    """
+    format = (format or "auto").upper()
+    if format == "JPG":
+        format = "JPEG"
+    if isinstance(source, str):
+        source = data_uri_to_bytes(source)
+    elif isinstance(source, bytearray):
+        source = bytes(source)
+
+    original_bytes = None
+    if isinstance(source, (bytes, bytearray)):
+        original_bytes = bytes(source)
+        image = Image.open(BytesIO(original_bytes))
+    else:
+        image = source
+    original_size = image.size
+
+    scale = 1.0
+    if max_side and max(image.size) > max_side:
+        scale = max_side / max(image.size)
+
+    passthrough = (
+        original_bytes is not None
+        and scale == 1.0
+        and image.format in MODEL_IMAGE_TYPES
+        and format in ("AUTO", image.format)
+    )
+    if passthrough:
+        data, target = original_bytes, image.format
+    else:
+        target = format if format in MODEL_IMAGE_TYPES else "PNG"
+        if scale != 1.0:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        if target == "JPEG" and image.mode != "RGB":
+            # JPEG has no alpha; flatten onto white like the blank canvas
+            rgba = image.convert("RGBA")
+            flat = Image.new("RGB", rgba.size, (255, 255, 255))
+            flat.paste(rgba, mask=rgba.getchannel("A"))
+            image = flat
+        buffered = BytesIO()
+        if target == "PNG":
+            image.save(buffered, format="PNG")
+        else:
+            image.save(buffered, format=target, quality=max(1, min(100, int(quality))))
+        data = buffered.getvalue()
+
+    info = {
+        'format': target.lower(),
+        'width': image.width,
+        'height': image.height,
+        'bytes': len(data),
+        'passthrough': passthrough,
+        'original_width': original_size[0],
+        'original_height': original_size[1],
+    }
+    if original_bytes is not None:
+        info['original_bytes'] = len(original_bytes)
+    return {"mime_type": MODEL_IMAGE_TYPES[target], "data": data}, info
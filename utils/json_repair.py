@@ -0,0 +1,583 @@
+"""
+Single-pass tolerant parser for model responses containing drawing commands.
+
+Model output wraps JSON in prose, <think> blocks and code fences, and the JSON
+itself often has comments, single quotes, trailing commas, missing
+separators or is cut off mid-command. Rather than cleaning the text with
+regexes and retrying json.loads, the parser below tokenizes the response once,
+builds values directly, repairs what it can along the way and emits each
+command as soon as its closing brace is seen. Every character is visited a
+bounded number of times, however malformed the input.
+"""
+
+import json
+import re
+
+# Outside JSON: skip anything that can't start a tag, a fence or a value
+TEXT_RE = re.compile(r'[^<{\[`]+')
+# Inside a value: skip whitespace and classify the next token with one match.
+# Strings without escapes, numbers and bare words take a following colon or
+# comma along, so a typical key or value costs one step
+TOKEN_RE = re.compile(r'''\s*(?:
+    (?P<open>[{\[])
+    |(?P<close>[}\]](?:\s*,)?)
+    |(?P<punct>[,:])
+    |(?P<string>"[^"\\]*"(?:\s*[:,])?)
+    |(?P<quoted>'[^'\\]*'(?:\s*[:,])?)
+    |(?P<number>[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?(?:\s*,)?)
+    |(?P<word>[A-Za-z_$#][\w$#.-]*(?:\s*[:,])?)
+    |(?P<other>\S)
+)''', re.VERBOSE)
+STRING_BODY_RE = {
+    '"': re.compile(r'[^"\\]+'),
+    "'": re.compile(r"[^'\\]+"),
+}
+
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+LITERALS = {'true': True, 'false': False, 'null': None}
+PYTHON_LITERALS = {'True': True, 'False': False, 'None': None}
+
+# Well-formed values are decoded at C speed; only containers this shallow try
+# it, which bounds how often a failed attempt can rescan the same text
+DECODER = json.JSONDecoder()
+FAST_PATH_MAX_DEPTH = 2
+
+# String fields of a top-level wrapper object that carry the model's reasoning
+THINKING_KEYS = ('analysis', 'thinking')
+
+THINK_OPEN = '<think>'
+THINK_CLOSE = '</think>'
+FENCE = '```'
+
+class _Frame:
+    """An open object or array and where we are inside it"""
+
+    __slots__ = ('kind', 'value', 'state', 'key', 'is_command')
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.value = {} if kind == 'obj' else []
+        # Arrays: 'value' or 'comma'; objects: 'key', 'colon', 'value' or 'comma'
+        self.state = 'key' if kind == 'obj' else 'value'
+        self.key = None
+        self.is_command = False
+
+class CommandStreamParser:
+    """
+    Incrementally extract thinking text and drawing commands from model output.
+
+    Feed text chunks as they arrive. Text inside <think></think> is passed
+    through as it streams (as is an 'analysis' or 'thinking' string in a
+    top-level wrapper object), and every object with an 'action' key that isn't
+    nested inside another command is emitted once complete, whether it sits
+    in a top-level array, in a {"commands": [...]} wrapper or stands alone.
+
+    Repairs applied along the way are counted in `repairs`.
+    """
+
+    def __init__(self):
+        self.commands = []
+        self.values = []
+        self.repairs = {}
+        self._thinking = []
+        self._events = []
+        self._buf = ''
+        self._pos = 0
+        self._mode = 'text'  # 'text', 'think' or 'value'
+        self._stack = []
+        self._string = None  # (quote, parts) while inside a string
+        self._comment = None  # Terminator while inside a comment
+        self._after_comma = False
+        self._command_frames = 0
+
+    @property
+    def thinking(self):
+        """All thinking text seen so far"""
+        return ''.join(self._thinking).strip()
+
+    def feed(self, chunk):
+        """
+        Consume the next chunk of model output.
+
+        Args:
+            chunk (str): Text chunk
+
+        Returns:
+            list: New ('thinking', str) and ('command', dict) events, in order
+        """
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        self._scan(final=False)
+        return self._take_events()
+
+    def close(self):
+        """
+        Finish the stream, closing anything left open.
+
+        A command cut off by the end of the response is dropped rather than
+        drawn half-finished.
+
+        Returns:
+            list: Any final ('thinking', str) and ('command', dict) events
+        """
+        self._scan(final=True)
+        if self._stack:
+            self._repair('unclosed_brackets')
+        while self._stack:
+            frame = self._pop()
+            if frame.kind == 'obj' and 'action' in frame.value and self._command_frames == 0:
+                self._repair('truncated_commands')
+                continue
+            self._attach(frame.value)
+        return self._take_events()
+
+    def _emit_thinking(self, text):
+        self._thinking.append(text)
+        self._events.append(('thinking', text))
+
+    def _take_events(self):
+        events, self._events = self._events, []
+        return events
+
+    def _repair(self, name):
+        self.repairs[name] = self.repairs.get(name, 0) + 1
+
+    def _scan(self, final):
+        buf = self._buf
+        end = len(buf)
+
+        while self._pos < end:
+            pos = self._pos
+
+            if self._string is not None:
+                if not self._scan_string(final):
+                    return
+                continue
+
+            if self._comment is not None:
+                found = buf.find(self._comment, pos)
+                if found == -1:
+                    # Keep a possible partial terminator for the next chunk
+                    self._pos = end if final else max(pos, end - len(self._comment) + 1)
+                    return
+                self._pos = found + len(self._comment)
+                self._comment = None
+                continue
+
+            if self._mode == 'think':
+                found = buf.find(THINK_CLOSE, pos)
+                stop = found if found != -1 else (end if final else max(pos, end - len(THINK_CLOSE) + 1))
+                if stop > pos:
+                    self._emit_thinking(buf[pos:stop])
+                if found == -1:
+                    self._pos = stop
+                    return
+                self._pos = found + len(THINK_CLOSE)
+                self._mode = 'text'
+                continue
+
+            if self._mode == 'text':
+                match = TEXT_RE.match(buf, pos)
+                if match:
+                    self._pos = match.end()
+                    continue
+                char = buf[pos]
+                if char == '<':
+                    rest = buf[pos:pos + len(THINK_OPEN)]
+                    if rest == THINK_OPEN:
+                        self._mode = 'think'
+                        self._pos += len(THINK_OPEN)
+                    elif THINK_OPEN.startswith(rest) and not final:
+                        return  # Wait for the rest of a possible tag
+                    else:
+                        self._pos += 1
+                elif char == '`':
+                    if not self._skip_fence(final):
+                        return
+                elif not self._decode_value():
+                    self._mode = 'value'
+                    self._push('obj' if char == '{' else 'arr')
+                    self._pos += 1
+                continue
+
+            if not self._scan_tokens(final):
+                return
+
+    def _skip_fence(self, final):
+        """Skip a code fence (or a stray backtick); False to wait for more input"""
+        rest = self._buf[self._pos:self._pos + len(FENCE)]
+        if rest == FENCE:
+            self._pos += len(FENCE)
+        elif FENCE.startswith(rest) and not final:
+            return False
+        else:
+            self._pos += 1
+        return True
+
+    def _scan_tokens(self, final):
+        """
+        Consume tokens inside a JSON value until it ends or the input runs out.
+
+        Returns:
+            bool: False to wait for more input
+        """
+        buf = self._buf
+        end = len(buf)
+        stack = self._stack
+
+        while self._pos < end and self._mode == 'value':
+            if self._string is not None:
+                if not self._scan_string(final):
+                    return False
+                continue
+            if self._comment is not None:
+                return True
+
+            match = TOKEN_RE.match(buf, self._pos)
+            if match is None:
+                # Only whitespace is left
+                self._pos = end
+                return True
+            kind = match.lastgroup
+            pos = self._pos = match.start(kind)
+            char = buf[pos]
+
+            if kind == 'open':
+                if len(stack) > FAST_PATH_MAX_DEPTH or not self._decode_value():
+                    self._push('obj' if char == '{' else 'arr')
+                    self._pos += 1
+            elif kind == 'close':
+                self._pos += 1
+                self._close_container('obj' if char == '}' else 'arr')
+                if stack and match.end() > self._pos:
+                    # The comma after it, unless that closed the outermost value
+                    self._pos = match.end()
+                    self._comma()
+            elif kind == 'punct':
+                self._pos += 1
+                if char == ',':
+                    self._comma()
+                else:
+                    self._colon()
+            elif kind == 'string' or kind == 'quoted':
+                # A complete string without escapes; the rest go through _scan_string
+                if kind == 'quoted':
+                    self._repair('single_quotes')
+                self._pos = match.end()
+                token = match.group(kind)
+                separator = token[-1]
+                text = token[1:token.rindex(char)]
+                top = stack[-1]
+                if separator == ':' and top.kind == 'obj' and top.state == 'key':
+                    # The common "key": case, as _scalar and _colon would handle it
+                    top.key = text
+                    top.state = 'value'
+                    self._after_comma = False
+                    continue
+                if separator == ':' or not self._attach_fast(top, text):
+                    self._scalar(text, is_key=True)
+                self._separator(separator)
+            elif kind != 'other':
+                token = match.group(kind)
+                separator = token[-1]
+                if separator in ':,':
+                    token = token[:-1].rstrip()
+                elif match.end() == end and not final:
+                    return False  # The token may continue in the next chunk
+                self._pos = match.end()
+                if kind == 'word':
+                    self._word(token)
+                else:
+                    try:
+                        value = float(token) if '.' in token or 'e' in token or 'E' in token else int(token)
+                    except ValueError:
+                        self._repair('stray_characters')
+                        self._separator(separator)
+                        continue
+                    if not self._attach_fast(stack[-1], value):
+                        self._scalar(value, is_key=False)
+                self._separator(separator)
+            elif char in '"\'':
+                if char == "'":
+                    self._repair('single_quotes')
+                self._string = (char, [])
+                self._pos += 1
+            elif char == '/':
+                if pos + 1 >= end and not final:
+                    return False
+                follower = buf[pos + 1:pos + 2]
+                if follower in ('/', '*'):
+                    self._repair('comments')
+                    self._comment = '\n' if follower == '/' else '*/'
+                    self._pos += 2
+                else:
+                    self._repair('stray_characters')
+                    self._pos += 1
+            elif char == '`':
+                if not self._skip_fence(final):
+                    return False
+            else:
+                self._repair('stray_characters')
+                self._pos += 1
+        return True
+
+    def _attach_fast(self, top, value):
+        """
+        Store a scalar where a value is expected without any repair to make.
+
+        Returns:
+            bool: False if the general path (_scalar) has to handle it
+        """
+        if top.state != 'value':
+            return False
+        if top.kind == 'arr':
+            top.value.append(value)
+        elif top.key is None or top.key == 'action' or top.key in THINKING_KEYS:
+            return False
+        else:
+            top.value[top.key] = value
+            top.key = None
+        top.state = 'comma'
+        self._after_comma = False
+        return True
+
+    def _decode_value(self):
+        """
+        Try to decode a complete, well-formed value in one go.
+
+        Returns:
+            bool: True if the value was consumed, False to tokenize it instead
+        """
+        if len(self._stack) > FAST_PATH_MAX_DEPTH:
+            return False
+        try:
+            value, end = DECODER.raw_decode(self._buf, self._pos)
+        except (ValueError, RecursionError):
+            # Nesting too deep for the C decoder goes through the tokenizer, which keeps its own stack
+            return False
+        self._begin_value()
+        if not self._stack and isinstance(value, dict) and 'action' not in value:
+            for key in THINKING_KEYS:
+                if isinstance(value.get(key), str):
+                    self._emit_thinking(value[key])
+        if self._command_frames == 0:
+            self._emit_nested(value)
+        self._attach(value)
+        self._pos = end
+        return True
+
+    def _emit_nested(self, value):
+        """Emit the outermost commands inside a decoded value"""
+        if isinstance(value, dict):
+            if 'action' in value:
+                self.commands.append(value)
+                self._events.append(('command', value))
+                return
+            value = value.values()
+        elif not isinstance(value, list):
+            return
+        for item in value:
+            if isinstance(item, (dict, list)):
+                self._emit_nested(item)
+
+    def _scan_string(self, final):
+        """Consume string contents; False to wait for more input"""
+        buf = self._buf
+        quote, parts = self._string
+        body = STRING_BODY_RE[quote]
+
+        while True:
+            match = body.match(buf, self._pos)
+            if match:
+                parts.append(match.group())
+                self._pos = match.end()
+            if self._pos >= len(buf):
+                if not final:
+                    return False
+                self._repair('unterminated_strings')
+                break
+            if buf[self._pos] == quote:
+                self._pos += 1
+                break
+
+            # Backslash escape
+            escape = buf[self._pos + 1:self._pos + 2]
+            if not escape:
+                if not final:
+                    return False
+                self._pos += 1
+                continue
+            if escape == 'u':
+                digits = buf[self._pos + 2:self._pos + 6]
+                if len(digits) < 4 and not final:
+                    return False
+                try:
+                    parts.append(chr(int(digits, 16)))
+                    self._pos += 6
+                except ValueError:
+                    parts.append('u')
+                    self._pos += 2
+                continue
+            parts.append(ESCAPES.get(escape, escape))
+            self._pos += 2
+
+        self._string = None
+        self._scalar(''.join(parts), is_key=True)
+        return True
+
+    def _word(self, token):
+        """Handle a bare number, literal or identifier"""
+        if token[0] in '-+.0123456789':
+            try:
+                value = float(token) if '.' in token or 'e' in token or 'E' in token else int(token)
+            except ValueError:
+                self._repair('stray_characters')
+                return
+            self._scalar(value, is_key=False)
+        elif token in LITERALS:
+            self._scalar(LITERALS[token], is_key=False, word=token)
+        elif token in PYTHON_LITERALS:
+            self._repair('python_literals')
+            self._scalar(PYTHON_LITERALS[token], is_key=False, word=token)
+        else:
+            # Unquoted key or string value (e.g. a bare #hex color)
+            top = self._stack[-1]
+            expecting_key = top.kind == 'obj' and top.state in ('key', 'comma')
+            self._repair('unquoted_keys' if expecting_key else 'unquoted_strings')
+            self._scalar(token, is_key=True)
+
+    def _scalar(self, value, is_key, word=None):
+        """Place a scalar as an object key or a value"""
+        top = self._stack[-1]
+        if top.kind == 'obj' and top.state in ('key', 'comma'):
+            if top.state == 'comma':
+                self._repair('missing_commas')
+            if is_key or word is not None:
+                top.key = value if is_key else word
+                top.state = 'colon'
+                self._after_comma = False
+            else:
+                self._repair('stray_characters')
+            return
+        self._begin_value()
+        self._attach(value)
+
+    def _begin_value(self):
+        """Repair missing separators before a value starts"""
+        self._after_comma = False
+        if not self._stack:
+            return
+        top = self._stack[-1]
+        if top.state == 'comma':
+            self._repair('missing_commas')
+            if top.kind == 'obj':
+                # A value where a key belongs: there's no key to store it under
+                self._repair('missing_keys')
+                top.key = None
+                top.state = 'value'
+        elif top.state == 'colon':
+            self._repair('missing_colons')
+            top.state = 'value'
+        elif top.kind == 'obj' and top.state == 'key':
+            self._repair('missing_keys')
+            top.state = 'value'
+
+    def _attach(self, value):
+        """Store a finished value in its parent container"""
+        if not self._stack:
+            self.values.append(value)
+            self._mode = 'text'
+            return
+        top = self._stack[-1]
+        if top.kind == 'arr':
+            top.value.append(value)
+        elif top.key is not None:
+            if top.key in THINKING_KEYS and len(self._stack) == 1 and isinstance(value, str):
+                self._emit_thinking(value)
+            top.value[top.key] = value
+            if top.key == 'action' and not top.is_command:
+                top.is_command = True
+                self._command_frames += 1
+            top.key = None
+        top.state = 'comma'
+
+    def _push(self, kind):
+        self._begin_value()
+        self._stack.append(_Frame(kind))
+
+    def _pop(self):
+        frame = self._stack.pop()
+        if frame.is_command:
+            self._command_frames -= 1
+        return frame
+
+    def _close_container(self, kind):
+        """Close the innermost open container of `kind`, repairing mismatches"""
+        if self._stack and self._stack[-1].kind == kind:
+            depth = len(self._stack) - 1
+        else:
+            depth = next((i for i in range(len(self._stack) - 1, -1, -1) if self._stack[i].kind == kind), None)
+        if depth is None:
+            self._repair('stray_characters')
+            return
+        while len(self._stack) - 1 > depth:
+            self._repair('mismatched_brackets')
+            self._complete(self._pop())
+
+        top = self._stack[-1]
+        if self._after_comma:
+            self._repair('trailing_commas')
+            self._after_comma = False
+        if top.kind == 'obj' and top.state in ('colon', 'value'):
+            self._repair('missing_values')
+        self._complete(self._pop())
+
+    def _complete(self, frame):
+        """Emit a finished command and attach the value to its parent"""
+        value = frame.value
+        if frame.kind == 'obj' and 'action' in value and self._command_frames == 0:
+            self.commands.append(value)
+            self._events.append(('command', value))
+        self._attach(value)
+
+    def _separator(self, char):
+        """Handle a colon or comma that was matched together with the token before it"""
+        if char == ',':
+            self._comma()
+        elif char == ':':
+            self._colon()
+
+    def _colon(self):
+        top = self._stack[-1]
+        if top.kind == 'obj' and top.state == 'colon':
+            top.state = 'value'
+        else:
+            self._repair('stray_characters')
+
+    def _comma(self):
+        top = self._stack[-1]
+        if top.state == 'comma':
+            top.state = 'key' if top.kind == 'obj' else 'value'
+            self._after_comma = True
+            return
+        if top.kind == 'obj' and top.state in ('colon', 'value'):
+            self._repair('missing_values')
+            top.key = None
+            top.state = 'key'
+            return
+        self._repair('extra_commas')
+
+def parse_commands(text):
+    """
+    Parse a complete model response.
+
+    Args:
+        text (str): Raw model output
+
+    Returns:
+        tuple: (list of command dicts, thinking text, dict of repair counts)
+    """
+    parser = CommandStreamParser()
+    parser.feed(text)
+    parser.close()
+    return parser.commands, parser.thinking, parser.repairs